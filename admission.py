@@ -0,0 +1,200 @@
+"""Admission control for the endpoints that send mail or hash passwords.
+
+ADMISSION_LIMITS maps an endpoint to the limits on its submissions (GET,
+HEAD and OPTIONS requests are never limited):
+
+    'login': {'concurrency': 8, 'per_ip': (60, 600), 'per_email': (10, 600)}
+
+per_ip and per_email are token buckets allowing count requests per period
+seconds, refilled continuously. A request over either gets 429 Too Many
+Requests with Retry-After set to when the next token is due. per_ip keys
+on request.remote_addr, so behind a reverse proxy set TRUSTED_PROXIES to
+the number of proxies; otherwise every client shares the proxy's address
+and the per_ip limits become site-wide ones. concurrency
+caps how many of the endpoint's requests run at once; past it the request
+is turned away with 503 and Retry-After: 1 instead of queueing behind the
+others and starving the cheap survey pages.
+
+With ADMISSION_BACKEND = 'sqlite' the buckets and running-request slots
+live in a small database of their own (ADMISSION_DB), so every worker
+process shares the same limits. The 'memory' backend keeps them per
+process. A worker that dies mid-request gives its slot back after
+ADMISSION_SLOT_LEASE seconds.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRUNE_INTERVAL = 60.0
+
+
+class MemoryBackend:
+    """Buckets and slots for a single worker process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._running = {}
+        self._last_prune = time.time()
+
+    def take(self, key, rate, burst, now):
+        """Take a token from key's bucket; returns 0 if one was there, else seconds until one is."""
+        with self._lock:
+            if now - self._last_prune >= PRUNE_INTERVAL:
+                self._prune(now)
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now, now + (burst - tokens + 1) / rate)
+            return 0
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket.
+        self._last_prune = now
+        for key in [key for key, (_, _, full_at) in self._buckets.items() if full_at < now]:
+            del self._buckets[key]
+
+    def acquire(self, route, limit, now):
+        """Claim one of route's limit slots; returns a slot to release, or None if all are taken."""
+        with self._lock:
+            running = self._running.get(route, 0)
+            if running >= limit:
+                return None
+            self._running[route] = running + 1
+            return route
+
+    def release(self, slot):
+        with self._lock:
+            self._running[slot] -= 1
+
+
+class SQLiteBackend:
+    """Buckets and slots shared by every worker through a local SQLite file."""
+
+    def __init__(self, path, lease=60.0):
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        self._last_prune = 0.0
+        conn = self._connection()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bucket (
+                key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS ix_bucket_full_at ON bucket (full_at);
+            CREATE TABLE IF NOT EXISTS slot (id INTEGER PRIMARY KEY, route TEXT NOT NULL, expires REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS ix_slot_route ON slot (route, expires);
+        """)
+
+    def _connection(self):
+        # Connections must not cross a fork, so they are kept per process and thread.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            # The limits are disposable, so nothing here is worth an fsync.
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, now):
+        conn = self._connection()
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = now
+            conn.execute('DELETE FROM bucket WHERE full_at < ?', (now,))
+            conn.execute('DELETE FROM slot WHERE expires < ?', (now,))
+        # One statement, so concurrent workers cannot both spend the last token.
+        row = conn.execute("""
+            INSERT INTO bucket (key, tokens, updated, full_at) VALUES (:key, :burst - 1, :now, :now + 1 / :rate)
+            ON CONFLICT (key) DO UPDATE SET
+                tokens = min(:burst, tokens + (:now - updated) * :rate) - 1,
+                updated = :now,
+                full_at = :now + (:burst - min(:burst, tokens + (:now - updated) * :rate) + 1) / :rate
+            WHERE min(:burst, tokens + (:now - updated) * :rate) >= 1
+            RETURNING tokens""", {'key': key, 'rate': rate, 'burst': burst, 'now': now}).fetchone()
+        if row is not None:
+            return 0
+        tokens, updated = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+        return (1 - min(burst, tokens + (now - updated) * rate)) / rate
+
+    def acquire(self, route, limit, now):
+        cursor = self._connection().execute("""
+            INSERT INTO slot (route, expires)
+            SELECT ?, ? WHERE (SELECT count(*) FROM slot WHERE route = ? AND expires >= ?) < ?""",
+            (route, now + self.lease, route, now, limit))
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def release(self, slot):
+        self._connection().execute('DELETE FROM slot WHERE id = ?', (slot,))
+
+
+class AdmissionControl:
+
+    def __init__(self, app=None):
+        self.limits = {}
+        self.backend = None
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._rate_limited = 0
+        self._overloaded = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.limits = app.config.get('ADMISSION_LIMITS', self.limits)
+        if app.config.get('ADMISSION_BACKEND', 'memory') == 'sqlite':
+            path = app.config.get('ADMISSION_DB') or os.path.join(app.instance_path, 'admission.db')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.backend = SQLiteBackend(path, app.config.get('ADMISSION_SLOT_LEASE', 60.0))
+        else:
+            self.backend = MemoryBackend()
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['admission'] = self
+
+    def _before_request(self):
+        limits = self.limits.get(request.endpoint)
+        if limits is None or request.method in SAFE_METHODS:
+            return
+        now = time.time()
+        for kind, key in (('per_ip', request.remote_addr), ('per_email', _email())):
+            if kind not in limits or not key:
+                continue
+            count, period = limits[kind]
+            wait = self.backend.take(f'{request.endpoint}:{kind}:{key}', count / period, count, now)
+            if wait:
+                self._count('_rate_limited')
+                raise TooManyRequests(retry_after=math.ceil(wait))
+        if 'concurrency' in limits:
+            slot = self.backend.acquire(request.endpoint, limits['concurrency'], now)
+            if slot is None:
+                self._count('_overloaded')
+                raise ServiceUnavailable(retry_after=1)
+            g._admission_slot = slot
+        self._count('_admitted')
+
+    def _teardown_request(self, exc):
+        slot = g.pop('_admission_slot', None)
+        if slot is not None:
+            self.backend.release(slot)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {'admitted': self._admitted, 'rate_limited': self._rate_limited,
+                    'overloaded': self._overloaded}
+
+
+def _email():
+    return request.form.get('email', '').strip().lower()
@@ -0,0 +1,184 @@
+"""Vectorised survey analytics over a cached float64 matrix of hectare columns.
+
+    python analytics.py --by municipality --percentiles 50 90 99
+"""
+import argparse
+import json
+import threading
+
+import numpy as np
+from sqlalchemy import text
+
+import archive
+from models import db, HECTARE_COLUMNS, HECTARE_SCALE, LAND_TYPES, TENURES
+
+GROUP_LEVELS = ('district', 'municipality')
+DEFAULT_PERCENTILES = (25, 50, 75, 90, 99)
+# Tukey fence multiplier for outlier flags.
+OUTLIER_IQR = 1.5
+
+
+class SurveyMatrix:
+    """Column-oriented snapshot of every survey with its demographics group.
+
+    ids, user_ids, district and municipality are 1-D arrays; hectares is an
+    (n, len(HECTARE_COLUMNS)) float64 matrix in HECTARE_COLUMNS order.
+    """
+
+    def __init__(self, ids, user_ids, district, municipality, hectares, max_timestamp):
+        self.ids = ids
+        self.user_ids = user_ids
+        self.district = district
+        self.municipality = municipality
+        self.hectares = hectares
+        self.max_timestamp = max_timestamp
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, after_id=0, session=None):
+        columns = ', '.join(f's.{name}' for name, _, _ in HECTARE_COLUMNS)
+        rows = (session or db.session).execute(text(f"""
+            SELECT s.id, s.user_id, d.district, d.municipality, s.timestamp, {columns}
+            FROM {archive.history('survey')} s
+            JOIN demographic d ON d.id = s.demographic_id
+            WHERE s.id > :after_id
+            ORDER BY s.id
+        """), {'after_id': after_id}).all()
+        width = len(HECTARE_COLUMNS)
+        if not rows:
+            return cls(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, object),
+                       np.empty(0, object), np.empty((0, width)), None)
+        ids, user_ids, district, municipality, timestamps = zip(*(row[:5] for row in rows))
+        # Areas arrive as integer hundredths of a hectare.
+        hectares = np.array([row[5:] for row in rows], dtype=np.float64) / HECTARE_SCALE
+        np.nan_to_num(hectares, copy=False)
+        return cls(np.array(ids, np.int64), np.array(user_ids, np.int64),
+                   np.array(district, object), np.array(municipality, object),
+                   hectares, max(timestamps))
+
+    def extend(self, other):
+        if not len(other):
+            return self
+        return SurveyMatrix(np.concatenate([self.ids, other.ids]),
+                            np.concatenate([self.user_ids, other.user_ids]),
+                            np.concatenate([self.district, other.district]),
+                            np.concatenate([self.municipality, other.municipality]),
+                            np.vstack([self.hectares, other.hectares]),
+                            max(filter(None, [self.max_timestamp, other.max_timestamp])))
+
+
+_cache = {'matrix': None, 'version': None}
+_cache_lock = threading.Lock()
+
+
+def survey_matrix(session=None):
+    """Return the cached matrix, topping it up or reloading it when surveys change.
+
+    The cache is versioned by (row count, max id, max timestamp). New rows are
+    appended by id; anything else (deletes, edits) forces a reload. Archived
+    surveys stay in the history view, so archival changes nothing here.
+    """
+    session = session or db.session
+    version = tuple(session.execute(
+        text(f"SELECT COUNT(*), MAX(id), MAX(timestamp) FROM {archive.history('survey')}")).one())
+    with _cache_lock:
+        matrix, cached = _cache['matrix'], _cache['version']
+        if matrix is not None and cached == version:
+            return matrix
+        if matrix is not None and cached[1] is not None and version[1] is not None \
+                and version[0] > cached[0] and version[2] >= cached[2]:
+            matrix = matrix.extend(SurveyMatrix.load(after_id=cached[1], session=session))
+        else:
+            matrix = SurveyMatrix.load(session=session)
+        _cache['matrix'], _cache['version'] = matrix, version
+        return matrix
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache['matrix'] = _cache['version'] = None
+
+
+def _groups(matrix, by):
+    if by not in GROUP_LEVELS:
+        raise ValueError(f"by must be one of {', '.join(GROUP_LEVELS)}")
+    labels, inverse = np.unique(getattr(matrix, by).astype(str), return_inverse=True)
+    return labels, inverse.ravel()
+
+
+def grouped_statistics(matrix, by='district', percentiles=DEFAULT_PERCENTILES):
+    """Per-group totals, means, tenure shares, area percentiles and outliers."""
+    labels, inverse = _groups(matrix, by)
+    n_groups = len(labels)
+    counts = np.bincount(inverse, minlength=n_groups)
+    sums = np.zeros((n_groups, matrix.hectares.shape[1]))
+    for j in range(matrix.hectares.shape[1]):
+        sums[:, j] = np.bincount(inverse, weights=matrix.hectares[:, j], minlength=n_groups)
+    means = sums / np.maximum(counts, 1)[:, None]
+
+    # Sums reshaped to (group, land type, tenure) give tenure shares per land type.
+    by_land = sums.reshape(n_groups, len(LAND_TYPES), len(TENURES))
+    land_totals = by_land.sum(axis=2, keepdims=True)
+    shares = np.divide(by_land, land_totals, out=np.zeros_like(by_land), where=land_totals > 0)
+
+    # Percentiles of each respondent's total area, plus the quartiles for outliers.
+    totals = matrix.hectares.sum(axis=1)
+    qs = list(percentiles) + [25, 75]
+    pct = group_percentiles(totals, inverse, counts, qs)
+    q1, q3 = pct[:, -2], pct[:, -1]
+    fence = q3 + OUTLIER_IQR * (q3 - q1)
+    outliers = totals > fence[inverse]
+    outlier_ids, outlier_groups = matrix.ids[outliers], inverse[outliers]
+
+    results = []
+    for g, label in enumerate(labels):
+        results.append({
+            by: label,
+            'respondents': int(counts[g]),
+            'total_hectares': float(sums[g].sum()),
+            'columns': {name: {'sum': float(sums[g, j]), 'mean': float(means[g, j])}
+                        for j, (name, _, _) in enumerate(HECTARE_COLUMNS)},
+            'tenure_shares': {land_type: {tenure: float(shares[g, i, k])
+                                          for k, tenure in enumerate(TENURES)}
+                              for i, land_type in enumerate(LAND_TYPES)},
+            'percentiles': {f'{p:g}': float(v) for p, v in zip(percentiles, pct[g])},
+            'outlier_survey_ids': outlier_ids[outlier_groups == g].tolist(),
+        })
+    return results
+
+
+def group_percentiles(values, inverse, counts, qs):
+    """(n_groups, len(qs)) percentiles of values within each group."""
+    order = np.lexsort((values, inverse))
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    result = np.zeros((len(counts), len(qs)))
+    for g in range(len(counts)):
+        group_values = values[order[bounds[g]:bounds[g + 1]]]
+        if len(group_values):
+            result[g] = np.percentile(group_values, qs)
+    return result
+
+
+def summary(by='district', percentiles=DEFAULT_PERCENTILES, session=None):
+    matrix = survey_matrix(session)
+    return {'by': by, 'surveys': len(matrix),
+            'groups': grouped_statistics(matrix, by, percentiles)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Survey land-use statistics per district or municipality.')
+    parser.add_argument('--by', choices=GROUP_LEVELS, default='district')
+    parser.add_argument('--percentiles', type=float, nargs='+', default=list(DEFAULT_PERCENTILES))
+    args = parser.parse_args()
+
+    from app import app, replica
+    with app.app_context(), replica.session() as session:
+        result = summary(args.by, args.percentiles, session)
+        result['data_as_of'] = session.info['data_as_of']
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,85 @@
 import json
-from flask import Flask, render_template, redirect, url_for, flash, session, request, jsonify
+from functools import wraps
+from flask import Flask, render_template, redirect, url_for, flash, session, request, jsonify, Response, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_migrate import Migrate
-from forms import RegistrationForm, LoginForm, ScreeningForm, DemographicForm, SurveyForm, FieldHorticulturalCropsForm
-from models import db, User, Survey, FieldHorticulturalCrops, Demographic
-from decimal import Decimal
+from werkzeug.middleware.proxy_fix import ProxyFix
+from forms import RegistrationForm, LoginForm, ScreeningForm
+from models import db, User
 from flask_mail import Mail, Message
+from mail_queue import MailQueue
+from config import Config
+from database import init_database
+from usernames import base_username, allocate_username
+from rollups import land_use_report
+import analytics
+import multiselect
+import drafts
+import spatial
+import search
+import respondents
+import ingest
+from user_cache import UserCache
+from location_buffer import LocationBuffer
+from page_cache import PageCache
+from replica import Replica
+import metrics as instrumentation
+from profiling import RequestProfiler
+from admission import AdmissionControl
+from passwords import hasher, PasswordHasherBusy
+from sqlalchemy.exc import IntegrityError
 import secrets
 from datetime import datetime, timedelta
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-app.config['MAIL_SERVER'] = 'smtp.your-email-provider.com'
-app.config['MAIL_PORT'] = 587 
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USE_SSL'] = False
-app.config['MAIL_USERNAME'] = 'your-email@example.com'
-app.config['MAIL_PASSWORD'] = 'your-email-password'
-app.config['MAIL_DEFAULT_SENDER'] = 'your-email@example.com'
+app.config.from_object(Config)
+if app.config.get('TRUSTED_PROXIES'):
+    # Client address and scheme from the proxies' X-Forwarded-For/-Proto headers.
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=1)
+
+metrics = instrumentation.Metrics(app)
+otp_emails = metrics.counter('otp_emails_total', 'OTP emails handed to the mail queue.')
+username_retries = metrics.counter('username_allocation_retries_total',
+                                   'Registrations that lost a username race and retried.')
+profiler = RequestProfiler(app)
+admission = AdmissionControl(app)
 
 mail = Mail(app)
+mail_queue = MailQueue(mail, app)
 
-db.init_app(app)
+init_database(app, db)
+hasher.init_app(app)
 migrate = Migrate(app, db)
 
+USERNAME_ALLOCATION_ATTEMPTS = 5
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+user_cache = UserCache(app)
+location_buffer = LocationBuffer(app, user_cache)
+page_cache = PageCache(app)
+replica = Replica(app, db)
+
+metrics.register_stats('mail_queue', mail_queue.stats)
+metrics.register_stats('user_cache', user_cache.stats)
+metrics.register_stats('location_buffer', location_buffer.stats)
+metrics.register_stats('admission', admission.stats)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
+
+def admin_required(view):
+    """Restrict a view to logged-in staff listed in ADMIN_EMAILS."""
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if current_user.email.lower() not in app.config['ADMIN_EMAILS']:
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
 
 def generate_otp(length=6):
     """Generate a random OTP of given length."""
@@ -40,28 +88,35 @@ def generate_otp(length=6):
     return otp
 
 def send_otp_email(user_email, otp):
-    """Send an OTP to the user's email address."""
+    """Queue an OTP email to the user's address for background delivery."""
     msg = Message('Your OTP for Verification', recipients=[user_email])
     msg.body = f'Your OTP is: {otp}\n\nThis OTP is valid for 10 minutes.'
-    mail.send(msg)
+    otp_emails.inc()
+    return mail_queue.enqueue(msg)
 
 @app.route('/')
+@page_cache.cached
 def home():
     return render_template('home.html')
 
 @app.route('/location', methods=['POST'])
 @login_required
 def update_location():
-    data = request.json
+    data = request.get_json(silent=True) or {}
     latitude = data.get('latitude')
     longitude = data.get('longitude')
 
     if not latitude or not longitude:
         return jsonify({'error': 'Invalid data'}), 400
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid data'}), 400
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({'error': 'Invalid data'}), 400
 
-    current_user.latitude = latitude
-    current_user.longitude = longitude
-    db.session.commit()
+    # Buffered: written with other users' fixes in the next batched UPDATE.
+    location_buffer.record(current_user.id, latitude, longitude)
 
     return jsonify({'success': 'Location updated successfully'})
 
@@ -79,27 +134,36 @@ def register():
             flash('An account with this email already exists. Please use a different email.', 'danger')
             return redirect(url_for('register'))
 
-        base_username = f"{form.first_name.data.lower()}{form.surname.data[0].lower()}"
-        username = base_username
-
-        # Generate a unique username if necessary
-        counter = 1
-        while User.query.filter_by(username=username).first():
-            username = f"{base_username}{counter}"
-            counter += 1
-
         user = User(
-            username=username,
             first_name=form.first_name.data,
             surname=form.surname.data,
             email=form.email.data,
             phone_number=form.phone_number.data,
             address=form.address.data
         )
-        user.set_password(form.password.data)
-
-        db.session.add(user)
-        db.session.commit()
+        try:
+            user.set_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return redirect(url_for('register'))
+        base = base_username(form.first_name.data, form.surname.data)
+
+        # Generate a unique username, retrying if a concurrent registration took it
+        for attempt in range(USERNAME_ALLOCATION_ATTEMPTS):
+            user.username = allocate_username(base)
+            db.session.add(user)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                username_retries.inc()
+                if User.query.filter_by(email=form.email.data).first():
+                    flash('An account with this email already exists. Please use a different email.', 'danger')
+                    return redirect(url_for('register'))
+        else:
+            flash('We could not create your account right now. Please try again.', 'danger')
+            return redirect(url_for('register'))
 
         flash(f'Account created for {form.first_name.data}!', 'success')
         return redirect(url_for('login'))
@@ -112,7 +176,19 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('login.html', form=form), 503
+        if valid:
+            if user.password_needs_rehash():
+                # Upgrade hashes made with an older method or cost while we have the password.
+                try:
+                    user.set_password(form.password.data)
+                    db.session.commit()
+                except PasswordHasherBusy:
+                    pass  # keep the old hash; the upgrade is retried on a later login
             login_user(user)
             flash('Login successful!', 'success')
             return redirect(url_for('screening'))
@@ -160,7 +236,8 @@ def screening():
         province = form.province.data
         if province == "Western Cape":
             flash('You are part of the target population.', 'success')
-            return redirect(url_for('submit_demographic'))
+            # Pick up a half-finished questionnaire where the user left it.
+            return redirect(url_for(drafts.STEP_ENDPOINTS[drafts.next_step(current_user.id)]))
         else:
             flash('You are not part of the target population. Thank you for your time.', 'info')
             return redirect(url_for('not_targeted'))
@@ -169,91 +246,159 @@ def screening():
 @app.route('/submit-demographic', methods=['GET', 'POST'])
 @login_required
 def submit_demographic():
-    form = DemographicForm()
+    form = drafts.form_for('demographic', current_user.id)
     if form.validate_on_submit():
-        demographic_response = Demographic(
-            user_id=current_user.id,
-            registered_name=form.registered_name.data,
-            province=form.province.data,
-            district=form.district.data,
-            municipality=form.municipality.data,
-            agricultural_activity=",".join(form.agricultural_activity.data),
-            other_agricultural_activity=form.other_agricultural_activity.data,
-            farm_activity=",".join(form.farm_activity.data)
-        )
-        db.session.add(demographic_response)
-        db.session.commit()
-        
-        
-        selected_activities = form.agricultural_activity.data
-        if 'farming' in selected_activities:
-            session['demographics_farming_selected'] = True
-            return redirect(url_for('survey'))
-        elif 'forestry' in selected_activities:
-            session['demographics_farming_selected'] = False
-            return redirect(url_for('survey'))
-        else:
+        step = drafts.advance(current_user.id, 'demographic', form)
+        if step is None:
             return redirect(url_for('home'))
-    
+        return redirect(url_for(drafts.STEP_ENDPOINTS[step]))
+
     return render_template('demographics.html', form=form)
 
 @app.route('/survey', methods=['GET', 'POST'])
 @login_required
 def survey():
-    form = SurveyForm()
+    form = drafts.form_for('survey', current_user.id)
     if form.validate_on_submit():
-        survey_response = Survey(
-            user_id=current_user.id,
-            crops_own=Decimal(form.crops_own.data or 0),
-            crops_govt=Decimal(form.crops_govt.data or 0),
-            crops_traditional=Decimal(form.crops_traditional.data or 0),
-            crops_other=Decimal(form.crops_other.data or 0),
-            pastures_own=Decimal(form.pastures_own.data or 0),
-            pastures_govt=Decimal(form.pastures_govt.data or 0),
-            pastures_traditional=Decimal(form.pastures_traditional.data or 0),
-            pastures_other=Decimal(form.pastures_other.data or 0),
-            greenhouses_own=Decimal(form.greenhouses_own.data or 0),
-            greenhouses_govt=Decimal(form.greenhouses_govt.data or 0),
-            greenhouses_traditional=Decimal(form.greenhouses_traditional.data or 0),
-            greenhouses_other=Decimal(form.greenhouses_other.data or 0),
-            natural_forest_own=Decimal(form.natural_forest_own.data or 0),
-            natural_forest_govt=Decimal(form.natural_forest_govt.data or 0),
-            natural_forest_traditional=Decimal(form.natural_forest_traditional.data or 0),
-            natural_forest_other=Decimal(form.natural_forest_other.data or 0),
-            woodland_own=Decimal(form.woodland_own.data or 0),
-            woodland_govt=Decimal(form.woodland_govt.data or 0),
-            woodland_traditional=Decimal(form.woodland_traditional.data or 0),
-            woodland_other=Decimal(form.woodland_other.data or 0),
-          
-        )
-        db.session.add(survey_response)
-        db.session.commit()
-
-        if session.get('demographics_farming_selected'):
-            return redirect(url_for('field_horticultural_crops'))
-        else:
+        step = drafts.advance(current_user.id, 'survey', form)
+        if step is None:
             return redirect(url_for('thank_you'))
+        return redirect(url_for(drafts.STEP_ENDPOINTS[step]))
     return render_template('survey.html', form=form)
 
 @app.route('/field-horticultural-crops', methods=['GET', 'POST'])
 @login_required
 def field_horticultural_crops():
-    form = FieldHorticulturalCropsForm()
+    form = drafts.form_for('field_horticultural_crops', current_user.id)
     if form.validate_on_submit():
-        field_horticultural_crops_response = FieldHorticulturalCrops(
-            user_id=current_user.id,
-            farming_practice=",".join(form.farming_practice.data),
-            water_supply=",".join(form.water_supply.data),
-            irrigation_system=",".join(form.irrigation_system.data)
-        )
-        db.session.add(field_horticultural_crops_response)
-        db.session.commit()
-
+        drafts.advance(current_user.id, 'field_horticultural_crops', form)
         return redirect(url_for('thank_you'))
     return render_template('field_horticultural_crops.html', form=form)
 
+@app.route('/reports/land-use')
+@login_required
+def land_use():
+    level = request.args.get('level', 'municipality')
+    with replica.session() as session:
+        try:
+            groups = land_use_report(level, session,
+                                     province=request.args.get('province'),
+                                     district=request.args.get('district'),
+                                     municipality=request.args.get('municipality'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'level': level, 'groups': groups, 'data_as_of': session.info['data_as_of']})
+
+@app.route('/reports/analytics')
+@admin_required
+def survey_analytics():
+    by = request.args.get('by', 'district')
+    with replica.session() as session:
+        try:
+            percentiles = [float(p) for p in request.args.getlist('percentile')] or analytics.DEFAULT_PERCENTILES
+            summary = analytics.summary(by, percentiles, session)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        summary['data_as_of'] = session.info['data_as_of']
+        return jsonify(summary)
+
+@app.route('/reports/farms')
+@admin_required
+def farms_by_answers():
+    criteria = {field: request.args.getlist(field) for field in multiselect.VOCABULARIES}
+    match = request.args.get('match', 'all')
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    try:
+        query = multiselect.matching_respondents(criteria, match)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    with replica.session() as session:
+        demographic_ids = session.scalars(query.limit(limit)).all()
+        return jsonify({'match': match, 'demographic_ids': demographic_ids,
+                        'data_as_of': session.info['data_as_of']})
+
+# Other respondents' usernames and exact farm locations are for staff only.
+@app.route('/farms/nearby')
+@admin_required
+def farms_nearby():
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    radius_km = request.args.get('radius_km', 10.0, type=float)
+    limit = min(request.args.get('limit', 50, type=int), 1000)
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({'error': 'lat and lon are required coordinates'}), 400
+    if radius_km is None or not 0 < radius_km <= 500:
+        return jsonify({'error': 'radius_km must be between 0 and 500'}), 400
+    farms = spatial.nearby(latitude, longitude, radius_km, limit)
+    return jsonify({'latitude': latitude, 'longitude': longitude, 'radius_km': radius_km, 'farms': farms})
+
+@app.route('/farms/within')
+@admin_required
+def farms_within():
+    box = [request.args.get(name, type=float) for name in ('south', 'west', 'north', 'east')]
+    limit = min(request.args.get('limit', 1000, type=int), 10000)
+    if None in box:
+        return jsonify({'error': 'south, west, north and east are required'}), 400
+    south, west, north, east = box
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        return jsonify({'error': 'Invalid bounding box'}), 400
+    farms = [{'id': row.id, 'username': row.username, 'latitude': row.latitude, 'longitude': row.longitude}
+             for row in spatial.within_box(south, west, north, east, limit)]
+    return jsonify({'farms': farms})
+
+@app.route('/admin/search')
+@admin_required
+def admin_search():
+    query = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    try:
+        results, has_more, truncated = search.search(query, request.args.get('field'), page, per_page)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'q': query, 'page': max(page, 1), 'has_more': has_more, 'truncated': truncated,
+                    'results': results})
+
+@app.route('/admin/respondents')
+@admin_required
+def admin_respondents():
+    cursor = request.args.get('cursor')
+    per_page = request.args.get('per_page', 20, type=int)
+    with replica.session() as session:
+        try:
+            entries, next_cursor = respondents.listing(cursor, per_page, session)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'respondents': entries, 'next_cursor': next_cursor,
+                        'data_as_of': session.info['data_as_of']})
+
+@app.route('/api/ingest', methods=['POST'])
+@login_required
+def ingest_bundles():
+    max_bytes = app.config['INGEST_MAX_BYTES']
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+    if request.content_length > max_bytes:
+        return jsonify({'error': f'At most {max_bytes} bytes per request'}), 413
+    try:
+        bundles = ingest.parse_bundles(request.get_data(), request.content_type or '')
+    except ValueError as e:
+        return jsonify({'error': f'Malformed request body: {e}'}), 400
+    if len(bundles) > app.config['INGEST_MAX_RECORDS']:
+        return jsonify({'error': f"At most {app.config['INGEST_MAX_RECORDS']} records per request"}), 413
+
+    results = ingest.ingest(bundles, current_user.id)
+    summary = {status: sum(1 for r in results if r['status'] == status)
+               for status in ('created', 'duplicate', 'invalid')}
+    return jsonify({'summary': summary, 'results': results})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=instrumentation.CONTENT_TYPE)
+
 @app.route('/thank_you')
 @login_required
+@page_cache.cached
 def thank_you():
     return render_template('thank_you.html')
 
@@ -264,6 +409,7 @@ def logout():
     return redirect(url_for('home'))
 
 @app.route('/not_targeted')
+@page_cache.cached
 def not_targeted():
     return render_template('not_targeted.html')
 
@@ -0,0 +1,157 @@
+"""Yearly archive tables for old survey and crops answers.
+
+Rows older than ARCHIVE_AFTER_DAYS move out of survey and
+field_horticultural_crops into one table per calendar year (survey_2023,
+field_horticultural_crops_2023, ...) in the same database, so the replica
+and page-level backups carry them unchanged. The hot tables stay the size of
+the retention window and the pages of a finished year are never written
+again.
+
+Each table has a <table>_history view, the union of the hot table and its
+archives, for reports that need every answer ever given; filters on the
+view reach the timestamp index of each table.
+
+Rows move in batches of ARCHIVE_BATCH_SIZE, one short transaction each with
+ARCHIVE_PAUSE seconds between them, so submissions get the write lock
+between batches. Run from cron:
+
+    python archive.py run [--before 2024-01-01]
+"""
+import argparse
+import re
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, Index, MetaData, Table, bindparam, event, inspect, text
+
+from models import db, Survey, FieldHorticulturalCrops
+
+TABLES = (Survey.__table__, FieldHorticulturalCrops.__table__)
+DEFAULT_AFTER_DAYS = 365
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE = 0.05
+
+
+def history(table_name):
+    """The view over table_name and all of its archives."""
+    return f'{table_name}_history'
+
+
+def archive_name(table, year):
+    return f'{table.name}_{year:04d}'
+
+
+def archive_names(connection, table):
+    """Names of table's archive tables, oldest first."""
+    pattern = re.compile(rf'{re.escape(table.name)}_\d{{4}}$')
+    return sorted(name for name in inspect(connection).get_table_names() if pattern.match(name))
+
+
+def archive_table(table, name):
+    """The archive table called name for table."""
+    # Same columns and keys as the hot table; no foreign keys, so archived
+    # rows never hold up a change to the tables they point at.
+    columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+               for column in table.columns]
+    return Table(name, MetaData(), *columns,
+                 Index(f'ix_{name}_timestamp', 'timestamp'),
+                 Index(f'ix_{name}_user_id_timestamp', 'user_id', 'timestamp'))
+
+
+def create_views(connection):
+    """(Re)create each table's history view over the archives that exist now."""
+    for table in TABLES:
+        columns = ', '.join(column.name for column in table.columns)
+        selects = [f'SELECT {columns} FROM {name}' for name in [table.name] + archive_names(connection, table)]
+        connection.exec_driver_sql(f'DROP VIEW IF EXISTS {history(table.name)}')
+        connection.exec_driver_sql(f'CREATE VIEW {history(table.name)} AS ' + ' UNION ALL '.join(selects))
+
+
+def _move_batch(table, start, end, batch_size, archives):
+    """Move up to batch_size rows with start <= timestamp < end; returns how many moved."""
+    # The newest row always stays, so an emptied hot table cannot hand out
+    # ids that its archives already use.
+    ids = db.session.execute(text(f"""
+        SELECT id FROM {table.name}
+        WHERE timestamp >= :start AND timestamp < :end AND id < (SELECT MAX(id) FROM {table.name})
+        ORDER BY timestamp LIMIT :limit"""),
+        {'start': start.isoformat(sep=' '), 'end': end.isoformat(sep=' '), 'limit': batch_size}).scalars().all()
+    if not ids:
+        return 0
+    name = archive_name(table, start.year)
+    if name not in archives:
+        connection = db.session.connection()
+        archive_table(table, name).create(connection)
+        archives.append(name)
+        create_views(connection)
+    columns = ', '.join(column.name for column in table.columns)
+    db.session.execute(text(f'INSERT INTO {name} ({columns}) SELECT {columns} FROM {table.name} WHERE id IN :ids')
+                       .bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+    db.session.execute(text(f'DELETE FROM {table.name} WHERE id IN :ids')
+                       .bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+    db.session.commit()
+    return len(ids)
+
+
+def run(before, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_PAUSE):
+    """Move rows with a timestamp before `before` into their year's archive table.
+
+    Returns {table name: rows moved}.
+    """
+    moved = {}
+    for table in TABLES:
+        moved[table.name] = 0
+        archives = archive_names(db.session.connection(), table)
+        oldest = db.session.execute(text(f'SELECT MIN(timestamp) FROM {table.name}')).scalar()
+        if oldest is None:
+            continue
+        for year in range(datetime.fromisoformat(str(oldest)).year, before.year + 1):
+            start, end = datetime(year, 1, 1), min(datetime(year + 1, 1, 1), before)
+            while start < end:
+                count = _move_batch(table, start, end, batch_size, archives)
+                moved[table.name] += count
+                if count < batch_size:
+                    break
+                time.sleep(pause)
+    return moved
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _after_create(metadata, connection, **kw):
+    create_views(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _before_drop(metadata, connection, **kw):
+    for table in TABLES:
+        connection.exec_driver_sql(f'DROP VIEW IF EXISTS {history(table.name)}')
+        for name in archive_names(connection, table):
+            connection.exec_driver_sql(f'DROP TABLE {name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move old survey and crops answers into yearly archive tables.')
+    parser.add_argument('mode', choices=['run', 'views'],
+                        help="'views' only (re)creates the history views")
+    parser.add_argument('--before', type=datetime.fromisoformat,
+                        help='archive rows older than this ISO date/time (default: ARCHIVE_AFTER_DAYS ago)')
+    args = parser.parse_args()
+
+    from app import app
+    with app.app_context():
+        if args.mode == 'views':
+            create_views(db.session.connection())
+            db.session.commit()
+            print('Created the history views')
+            return
+        before = args.before or datetime.utcnow() - timedelta(
+            days=app.config.get('ARCHIVE_AFTER_DAYS', DEFAULT_AFTER_DAYS))
+        start = time.perf_counter()
+        moved = run(before, app.config.get('ARCHIVE_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                    app.config.get('ARCHIVE_PAUSE', DEFAULT_PAUSE))
+        print(f"Archived rows before {before.isoformat(sep=' ')} in {time.perf_counter() - start:.1f}s: "
+              + ', '.join(f'{name} {count}' for name, count in moved.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Grouped survey statistics: NumPy matrix versus an ORM loop.
+
+Run from the project root:
+
+    python -m benchmarks.bench_analytics --respondents 200000
+"""
+import argparse
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+import analytics
+from models import Survey, Demographic, HECTARE_COLUMNS, HECTARE_SCALE
+from benchmarks.fixtures import make_app, create_database, seed
+
+
+def orm_district_totals():
+    """What an analyst script does today: walk ORM rows and add up their areas."""
+    totals = defaultdict(lambda: defaultdict(float))
+    # Demographics prefetched so only the ORM cost is measured.
+    districts = {d.id: d.district for d in Demographic.query}
+    for survey in Survey.query.yield_per(5000):
+        group = totals[districts.get(survey.demographic_id)]
+        for name, _, _ in HECTARE_COLUMNS:
+            group[name] += getattr(survey, name) / HECTARE_SCALE
+    return totals
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--respondents', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        seed(db_path, args.respondents)
+        app = make_app(f'sqlite:///{db_path}')
+        with app.app_context():
+            orm_time, orm = timed(orm_district_totals)
+            cold_time, _ = timed(lambda: analytics.summary('district'))
+            warm_time, result = timed(lambda: analytics.summary('district'))
+
+        for group in result['groups']:
+            expected = orm[group['district']]['crops_own']
+            assert abs(group['columns']['crops_own']['sum'] - expected) < 1e-6 * max(1.0, expected)
+
+        print(f"respondents={args.respondents}")
+        print(f"orm loop          {orm_time * 1000:10.1f} ms  (totals only)")
+        print(f"numpy cold cache  {cold_time * 1000:10.1f} ms  (load + totals, shares, percentiles, outliers)")
+        print(f"numpy warm cache  {warm_time * 1000:10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
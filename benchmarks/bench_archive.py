@@ -0,0 +1,119 @@
+"""Archival: hot-table query latency before and after, and what it costs live writers.
+
+Seeds surveys spread over several years, times the hot-path queries, moves
+everything older than the retention window into yearly archive tables while
+a writer thread keeps submitting surveys, then times the queries again.
+Run from the project root:
+
+    python -m benchmarks.bench_archive --respondents 300000 --years 3
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import archive
+from models import db, HECTARE_COLUMNS
+from benchmarks.fixtures import make_app, create_database, seed
+
+
+def hot_queries(conn, now, user_ids):
+    """Milliseconds for this season's submissions and for users' latest surveys."""
+    start = time.perf_counter()
+    conn.execute('SELECT COUNT(*) FROM survey WHERE timestamp >= ?',
+                 ((now - timedelta(days=30)).isoformat(sep=' '),)).fetchone()
+    recent = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for user_id in user_ids:
+        conn.execute('SELECT * FROM survey WHERE user_id = ? ORDER BY id DESC LIMIT 1', (user_id,)).fetchone()
+    latest = (time.perf_counter() - start) * 1000 / len(user_ids)
+    return recent, latest
+
+
+class Writer(threading.Thread):
+    """Submits a survey every interval seconds and records how long each commit took."""
+
+    def __init__(self, path, interval=0.01):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.latencies = []
+        self.stopping = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        columns = ', '.join(name for name, _, _ in HECTARE_COLUMNS)
+        values = ', '.join('5' for _ in HECTARE_COLUMNS)
+        while not self.stopping.is_set():
+            start = time.perf_counter()
+            with conn:
+                conn.execute(f"INSERT INTO survey (user_id, {columns}, timestamp) "
+                             f"VALUES (1, {values}, datetime('now'))")
+            self.latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(self.interval)
+        conn.close()
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        return (f"{len(latencies)} commits, p50 {statistics.median(latencies):.1f} ms, "
+                f"p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms, max {latencies[-1]:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--respondents', type=int, default=300000)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=archive.DEFAULT_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=archive.DEFAULT_PAUSE)
+    args = parser.parse_args()
+
+    now = datetime(2025, 1, 1)
+    start = now - timedelta(days=365 * args.years)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        # A year at a time, so ids rise with time as they do in production.
+        for year in range(args.years):
+            seed(db_path, args.respondents // args.years, seed=year, start=start + timedelta(days=365 * year))
+        conn = sqlite3.connect(db_path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        user_ids = [row[0] for row in conn.execute('SELECT id FROM "user" ORDER BY random() LIMIT 50')]
+        total = conn.execute('SELECT COUNT(*) FROM survey').fetchone()[0]
+        recent, latest = hot_queries(conn, now, user_ids)
+        print(f"before: survey {total} rows; last 30 days {recent:.1f} ms, latest per user {latest:.1f} ms")
+
+        writer = Writer(db_path)
+        writer.start()
+        time.sleep(1)
+        baseline = len(writer.latencies)
+        app = make_app(f'sqlite:///{db_path}', DATABASE_PROFILE='production')
+        with app.app_context():
+            began = time.perf_counter()
+            moved = archive.run(now - timedelta(days=365), args.batch_size, args.pause)
+            elapsed = time.perf_counter() - began
+            db.engine.dispose()
+        writer.stopping.set()
+        writer.join()
+        writer.latencies = writer.latencies[baseline:]
+        print(f"archive: moved {moved} in {elapsed:.1f}s, "
+              f"{sum(moved.values()) / elapsed:.0f} rows/s, batch {args.batch_size}")
+        print(f"writer during archive: {writer.summary()}")
+
+        hot = conn.execute('SELECT COUNT(*) FROM survey').fetchone()[0]
+        recent, latest = hot_queries(conn, now, user_ids)
+        print(f"after: survey {hot} rows; last 30 days {recent:.1f} ms, latest per user {latest:.1f} ms")
+        view = archive.history('survey')
+        print(f"{view}: {conn.execute(f'SELECT COUNT(*) FROM {view}').fetchone()[0]} rows "
+              f"(seeded {total} plus the writer's)")
+        plan = conn.execute(f'EXPLAIN QUERY PLAN SELECT COUNT(*) FROM {view} WHERE timestamp >= ?',
+                            ('2024-06-01',)).fetchall()
+        print('history plan: ' + '; '.join(row[-1] for row in plan))
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
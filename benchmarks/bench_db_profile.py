@@ -0,0 +1,80 @@
+"""Concurrent survey writes and reads under each database profile.
+
+Each worker process plays one app worker: writers commit one Survey row per
+transaction, readers run the kind of aggregate an analyst report issues.
+Run from the project root:
+
+    python -m benchmarks.bench_db_profile --writers 4 --readers 2 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from models import db, Survey
+from benchmarks.fixtures import make_app, create_database, seed
+
+
+def worker(db_path, profile, role, seconds, results):
+    app = make_app(f'sqlite:///{db_path}', DATABASE_PROFILE=profile)
+    done = errors = 0
+    with app.app_context():
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            try:
+                if role == 'writer':
+                    db.session.add(Survey(user_id=1, crops_own=1, pastures_own=2))
+                    db.session.commit()
+                else:
+                    db.session.query(func.count(Survey.id), func.sum(Survey.crops_own)).one()
+                    db.session.rollback()
+                done += 1
+            except OperationalError:
+                # "database is locked"
+                db.session.rollback()
+                errors += 1
+    results.put((role, done, errors))
+
+
+def run(profile, args, tmp):
+    db_path = os.path.join(tmp, f'{profile}.db')
+    create_database(db_path)
+    seed(db_path, args.respondents)
+    results = multiprocessing.Queue()
+    roles = ['writer'] * args.writers + ['reader'] * args.readers
+    procs = [multiprocessing.Process(target=worker, args=(db_path, profile, role, args.seconds, results))
+             for role in roles]
+    for proc in procs:
+        proc.start()
+    totals = {'writer': [0, 0], 'reader': [0, 0]}
+    for _ in procs:
+        role, done, errors = results.get()
+        totals[role][0] += done
+        totals[role][1] += errors
+    for proc in procs:
+        proc.join()
+    print(f"{profile:11} writes {totals['writer'][0] / args.seconds:9.1f}/sec "
+          f"(locked {totals['writer'][1]})  "
+          f"reads {totals['reader'][0] / args.seconds:9.1f}/sec (locked {totals['reader'][1]})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--respondents', type=int, default=20000)
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in args.profiles:
+            run(profile, args, tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Measure Excel export throughput and peak memory as the survey grows.
+
+Run from the project root:
+
+    python -m benchmarks.bench_export_excel --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import create_database, seed
+
+
+def run_export(db_path, output):
+    """Run export_to_excel.py in a child process and return (seconds, peak RSS in MB)."""
+    start = time.perf_counter()
+    # The database grows between runs, so always export from a fresh replica.
+    proc = subprocess.Popen([sys.executable, 'export_to_excel.py', '--db', db_path, '--output', output,
+                             '--max-staleness', '0'],
+                            stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f'export failed with status {status}')
+    # ru_maxrss is in kilobytes on Linux.
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        seeded = 0
+        for size in sorted(args.sizes):
+            seed(db_path, size - seeded, seed=size)
+            seeded = size
+            elapsed, peak_mb = run_export(db_path, os.path.join(tmp, 'site_data.xlsx'))
+            # Each respondent contributes a user, demographic, survey and crops row.
+            rows = size * 4
+            print(f"respondents={size:9d}  {rows / elapsed:9.0f} rows/sec  peak RSS {peak_mb:7.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
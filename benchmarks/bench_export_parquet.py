@@ -0,0 +1,55 @@
+"""Measure Parquet export throughput, peak memory and incremental run cost.
+
+Run from the project root:
+
+    python -m benchmarks.bench_export_parquet --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import create_database, seed
+
+
+def run_export(db_path, output, *args):
+    """Run export_parquet.py in a child process and return (seconds, peak RSS in MB)."""
+    start = time.perf_counter()
+    # The database grows between runs, so always export from a fresh replica.
+    proc = subprocess.Popen([sys.executable, 'export_parquet.py', '--db', db_path, '--output', output,
+                             '--max-staleness', '0', *args],
+                            stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f'export failed with status {status}')
+    # ru_maxrss is in kilobytes on Linux.
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        output = os.path.join(tmp, 'parquet')
+        create_database(db_path)
+        seeded = 0
+        for size in sorted(args.sizes):
+            seed(db_path, size - seeded, seed=size)
+            seeded = size
+            shutil.rmtree(output, ignore_errors=True)
+            elapsed, peak_mb = run_export(db_path, output)
+            # An incremental run straight after only rewrites the current month.
+            incremental, _ = run_export(db_path, output)
+            print(f"respondents={size:9d}  {size / elapsed:9.0f} surveys/sec  peak RSS {peak_mb:7.1f} MB  "
+                  f"incremental {incremental:6.2f}s")
+
+
+if __name__ == '__main__':
+    main()
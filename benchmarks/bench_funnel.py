@@ -0,0 +1,351 @@
+"""End-to-end load test of the survey funnel, from registration to crops.
+
+Every virtual user registers, logs in, and answers the screening,
+demographic, survey and crops pages. It first GETs each form to pick up its
+CSRF token, then POSTs it, exactly as a browser would. The app runs against
+a throwaway database, with mail going to a local SMTP stub. It is driven
+either in-process through Flask's test client or over HTTP against a pool
+of pre-forked WSGI workers.
+
+Run from the project root:
+
+    python -m benchmarks.bench_funnel --users 200 --concurrency 8
+    python -m benchmarks.bench_funnel --mode server --workers 4 --json run.json
+    python -m benchmarks.bench_funnel --json new.json --baseline run.json --threshold 0.15
+
+With --baseline the run exits with status 1 if any route's p95 latency
+grew, or its throughput fell, by more than the threshold.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from benchmarks.fixtures import create_database, MUNICIPALITIES
+from benchmarks.smtp_stub import SMTPStub
+
+PASSWORD = 'load-test-password'
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+# Used for any page whose template is not on disk: just enough to carry the token.
+STUB_TEMPLATE = ('<!doctype html><title>{{ request.path }}</title>'
+                 '{% if form is defined %}<form method="post">{{ form.csrf_token }}</form>{% endif %}')
+
+
+def funnel(n):
+    """(path, form data) for each step of virtual user n, in order."""
+    districts = list(MUNICIPALITIES)
+    district = districts[n % len(districts)]
+    email = f'loadtest{n}@example.com'
+    return [
+        ('/register', {'first_name': 'Load', 'surname': f'Tester{n}', 'email': email,
+                       'phone_number': '0210000000', 'address': '1 Farm Road',
+                       'password': PASSWORD, 'confirm_password': PASSWORD, 'declaration': 'agree'}),
+        ('/login', {'email': email, 'password': PASSWORD}),
+        ('/screening', {'province': 'Western Cape', 'is_farmer': 'yes'}),
+        ('/submit-demographic', {'registered_name': f'Farm {n}', 'province': 'wc', 'district': district,
+                                 'municipality': MUNICIPALITIES[district][n % len(MUNICIPALITIES[district])],
+                                 'agricultural_activity': ['farming'], 'farm_activity': ['fruits', 'vegetables']}),
+        ('/survey', {'crops_own': str(10 + n % 40), 'pastures_govt': '4.5', 'woodland_own': '1.25'}),
+        ('/field-horticultural-crops', {'farming_practice': ['Irrigation'], 'water_supply': ['River', 'Dam'],
+                                        'irrigation_system': ['Drip irrigation']}),
+    ]
+
+
+def configure_environment(db_path, smtp_port, password_method=None):
+    """Point the app at the benchmark database and SMTP stub before it is imported."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['MAIL_SERVER'] = '127.0.0.1'
+    os.environ['MAIL_PORT'] = str(smtp_port)
+    if password_method:
+        os.environ['PASSWORD_HASH_METHOD'] = password_method
+
+
+def load_app():
+    import app as application
+    from jinja2 import ChoiceLoader, FunctionLoader
+
+    app = application.app
+    app.config['MAIL_USE_TLS'] = False  # the stub speaks plain SMTP
+    application.mail.state = application.mail.init_app(app)
+    # Every simulated respondent comes from this machine, so keep only the concurrency limits.
+    application.admission.limits = {endpoint: {'concurrency': limits['concurrency']}
+                                    for endpoint, limits in application.admission.limits.items()
+                                    if 'concurrency' in limits}
+    app.jinja_loader = ChoiceLoader([app.jinja_loader, FunctionLoader(lambda name: STUB_TEMPLATE)])
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    return app
+
+
+class ClientSession:
+    """One browser's worth of requests through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HTTPSession:
+    """One browser's worth of requests over HTTP, with cookies and no redirect following."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        if data is not None:
+            body = urlencode(data, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            text = response.read().decode('utf-8', 'replace')
+        finally:
+            conn.close()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, text
+
+
+class Recorder:
+    """Per-route latencies and failures, shared by the virtual user threads."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def timed(self, session, method, path, data=None, expect=200):
+        start = time.perf_counter()
+        status, body = session.request(method, path, data)
+        elapsed = time.perf_counter() - start
+        route = f'{method} {path}'
+        with self._lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if status != expect:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status == expect, body
+
+    def finished(self):
+        with self._lock:
+            self.completed += 1
+
+
+def run_user(session, n, recorder):
+    for path, data in funnel(n):
+        ok, body = recorder.timed(session, 'GET', path)
+        token = CSRF_RE.search(body) if ok else None
+        if token is None:
+            return
+        ok, _ = recorder.timed(session, 'POST', path, dict(data, csrf_token=token.group(1)), expect=302)
+        if not ok:
+            return
+    recorder.finished()
+
+
+def drive(make_session, users, concurrency):
+    """Push users through the funnel on concurrency threads; returns (recorder, seconds)."""
+    recorder = Recorder()
+    numbers = itertools.count()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                n = next(numbers)
+            if n >= users:
+                return
+            run_user(make_session(), n, recorder)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - start
+
+
+def _serve(sock, db_path, smtp_port, password_method):
+    # Worker process: SIGTERM exits normally so atexit flushes the app's queues.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    from werkzeug.serving import make_server
+
+    configure_environment(db_path, smtp_port, password_method)
+    from passwords import hasher
+
+    host, port = sock.getsockname()[:2]
+    try:
+        make_server(host, port, load_app(), threaded=True, fd=sock.fileno()).serve_forever()
+    finally:
+        # multiprocessing joins child processes on exit, including the hashing
+        # pool's, so make sure they have been told to stop first.
+        hasher.shutdown(wait=True)
+
+
+def start_workers(count, db_path, smtp_port, password_method):
+    """Pre-fork count WSGI workers accepting on one shared socket."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(256)
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=_serve, args=(sock, db_path, smtp_port, password_method))
+               for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    port = sock.getsockname()[1]
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            if HTTPSession('127.0.0.1', port).request('GET', '/')[0] == 200:
+                break
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            stop_workers(workers)
+            raise RuntimeError('WSGI workers did not come up')
+        time.sleep(0.2)
+    sock.close()
+    return workers, port
+
+
+def stop_workers(workers):
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join(10)
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarise(recorder, elapsed, args):
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        ordered = sorted(latencies)
+        routes[route] = {
+            'count': len(ordered),
+            'errors': recorder.errors.get(route, 0),
+            'rps': len(ordered) / elapsed,
+            'mean_ms': sum(ordered) / len(ordered) * 1000,
+            'p50_ms': percentile(ordered, 50) * 1000,
+            'p95_ms': percentile(ordered, 95) * 1000,
+            'p99_ms': percentile(ordered, 99) * 1000,
+        }
+    return {
+        'mode': args.mode,
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'workers': args.workers if args.mode == 'server' else 1,
+        'elapsed_s': elapsed,
+        'completed_funnels': recorder.completed,
+        'funnels_per_sec': recorder.completed / elapsed,
+        'routes': routes,
+    }
+
+
+def report(results):
+    print(f"{results['mode']}: {results['completed_funnels']}/{results['users']} funnels completed in "
+          f"{results['elapsed_s']:.1f}s ({results['funnels_per_sec']:.1f}/sec, "
+          f"concurrency {results['concurrency']}, workers {results['workers']})")
+    print(f"{'route':36} {'count':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, r in results['routes'].items():
+        print(f"{route:36} {r['count']:6d} {r['errors']:6d} {r['rps']:8.1f} "
+              f"{r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f}")
+
+
+def compare(baseline, results, threshold):
+    """Print the change per route against baseline; returns the regressed routes."""
+    if (baseline.get('mode'), baseline.get('concurrency')) != (results['mode'], results['concurrency']):
+        print('warning: baseline was taken with a different mode or concurrency')
+    regressions = []
+    for route, r in results['routes'].items():
+        base = baseline['routes'].get(route)
+        if base is None:
+            continue
+        p95_change = r['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0.0
+        rps_change = r['rps'] / base['rps'] - 1 if base['rps'] else 0.0
+        regressed = (p95_change > threshold or rps_change < -threshold
+                     or r['errors'] > base['errors'])
+        print(f"{route:36} p95 {p95_change:+7.1%}  req/s {rps_change:+7.1%}  errors "
+              f"{base['errors']}->{r['errors']}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(route)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('client', 'server'), default='client')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4, help='WSGI worker processes in server mode')
+    parser.add_argument('--password-method', help="e.g. 'pbkdf2:sha256:1000' to take hashing cost out of the picture")
+    parser.add_argument('--json', help='write machine-readable results here')
+    parser.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='allowed relative p95 growth / throughput drop per route')
+    args = parser.parse_args()
+
+    stub = SMTPStub(connect_delay=0.0).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'site.db')
+            create_database(db_path)
+            if args.mode == 'client':
+                configure_environment(db_path, stub.port, args.password_method)
+                app = load_app()
+                recorder, elapsed = drive(lambda: ClientSession(app), args.users, args.concurrency)
+            else:
+                workers, port = start_workers(args.workers, db_path, stub.port, args.password_method)
+                try:
+                    recorder, elapsed = drive(lambda: HTTPSession('127.0.0.1', port),
+                                              args.users, args.concurrency)
+                finally:
+                    stop_workers(workers)
+    finally:
+        stub.stop()
+
+    results = summarise(recorder, elapsed, args)
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            sys.exit(f"{len(regressions)} route(s) regressed by more than {args.threshold:.0%}")
+
+
+if __name__ == '__main__':
+    main()
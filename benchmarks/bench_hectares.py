@@ -0,0 +1,120 @@
+"""Survey areas as NUMERIC Decimals versus integer hundredths of a hectare.
+
+Times the form-to-row mapping, bulk inserts the way the ingest API and the
+questionnaire write them, bulk reads through the ORM and Core, and the bytes
+each row takes. Run from the project root:
+
+    python -m benchmarks.bench_hectares --rows 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, Numeric, Table, insert, select, text
+from sqlalchemy.orm import Session, registry
+from werkzeug.datastructures import MultiDict
+
+import responses
+from forms import SurveyForm
+from models import db, Survey, HECTARE_COLUMNS
+from benchmarks.fixtures import make_app, create_database
+
+# The survey table as it was: NUMERIC areas, read back as Decimal.
+legacy_table = Table(
+    'survey_numeric', MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, nullable=False),
+    *[Column(name, Numeric, nullable=False, default=0) for name, _, _ in HECTARE_COLUMNS],
+    Column('timestamp', DateTime))
+
+
+class LegacySurvey:
+    pass
+
+
+registry().map_imperatively(LegacySurvey, legacy_table)
+
+
+def legacy_values(form):
+    return {name: Decimal(form[name].data or 0) for name, _, _ in HECTARE_COLUMNS}
+
+
+def timed(fn, repeat=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def table_bytes(conn, name):
+    pages = conn.exec_driver_sql(f"SELECT COUNT(*) FROM dbstat WHERE name = '{name}'").scalar()
+    return pages * conn.exec_driver_sql('PRAGMA page_size').scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--forms', type=int, default=5000)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        app = make_app(f'sqlite:///{db_path}', SECRET_KEY='bench', WTF_CSRF_ENABLED=False)
+        with app.app_context():
+            legacy_table.create(db.engine)
+            submissions = [MultiDict({name: f'{rng.expovariate(1 / 50):.2f}' for name, _, _ in HECTARE_COLUMNS
+                                      if rng.random() < 0.4}) for _ in range(args.forms)]
+            with app.test_request_context():
+                forms = [SurveyForm(formdata=data) for data in submissions]
+            mapping = {label: timed(lambda: [build(form) for form in forms], 3) / len(forms) * 1e6
+                       for label, build in (('numeric', legacy_values), ('integer', responses.survey_values))}
+
+            rows = {'numeric': [], 'integer': []}
+            for i in range(args.rows):
+                form = forms[i % len(forms)]
+                rows['numeric'].append(dict(legacy_values(form), user_id=1))
+                rows['integer'].append(dict(responses.survey_values(form), user_id=1))
+            results = {}
+            for label, model, table in (('numeric', LegacySurvey, legacy_table), ('integer', Survey, Survey.__table__)):
+                with Session(db.engine) as session:
+                    core_insert = timed(lambda: session.execute(insert(table), rows[label]))
+                    session.commit()
+                    orm_rows = rows[label][:args.forms]
+                    orm_insert = timed(lambda: (session.add_all([model(**values) for values in orm_rows]),
+                                                session.flush()))
+                    session.commit()
+                with Session(db.engine) as session:
+                    orm_read = timed(lambda: session.scalars(select(model)).all())
+                with Session(db.engine) as session:
+                    core_read = timed(lambda: session.execute(select(table)).all(), 3)
+                with db.engine.connect() as conn:
+                    conn.exec_driver_sql('VACUUM')
+                    size = table_bytes(conn, table.name)
+                results[label] = (core_insert / args.rows * 1e6, orm_insert / args.forms * 1e6,
+                                  orm_read * 1000, core_read * 1000, size / (args.rows + args.forms))
+
+            with db.engine.connect() as conn:
+                legacy = conn.execute(text('SELECT SUM(crops_own), SUM(woodland_other) FROM survey_numeric')).one()
+                scaled = conn.execute(text('SELECT SUM(crops_own) / 100.0, SUM(woodland_other) / 100.0 '
+                                           'FROM survey')).one()
+            assert all(abs(float(a) - b) < 1e-6 * max(1.0, b) for a, b in zip(legacy, scaled)), (legacy, scaled)
+
+    total = args.rows + args.forms
+    print(f"rows={total}, {len(HECTARE_COLUMNS)} area columns")
+    print(f"{'':10}{'form map':>12}{'core insert':>14}{'orm insert':>13}{'orm read':>12}{'core read':>12}"
+          f"{'bytes/row':>11}")
+    for label, (core_insert, orm_insert, orm_read, core_read, size) in results.items():
+        print(f"{label:10}{mapping[label]:9.1f} us{core_insert:11.1f} us{orm_insert:10.1f} us"
+              f"{orm_read:9.0f} ms{core_read:9.0f} ms{size:11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Bulk ingestion throughput for offline enumerator uploads.
+
+Run from the project root:
+
+    python -m benchmarks.bench_ingest --records 20000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import ingest
+from models import db, User, HECTARE_COLUMNS
+from benchmarks.fixtures import make_app, create_database, MUNICIPALITIES
+
+
+def make_bundles(n, rng):
+    bundles = []
+    for i in range(n):
+        district = rng.choice(list(MUNICIPALITIES))
+        bundles.append({
+            'idempotency_key': f'device-1/{i}',
+            'demographic': {
+                'registered_name': f'Farm {i}', 'province': 'wc', 'district': district,
+                'municipality': rng.choice(MUNICIPALITIES[district]),
+                'agricultural_activity': ['farming'], 'farm_activity': ['fruits', 'vegetables'],
+            },
+            'survey': {name: round(rng.uniform(0, 80), 2) for name, _, _ in HECTARE_COLUMNS
+                       if rng.random() < 0.4},
+            'field_horticultural_crops': {
+                'farming_practice': ['Irrigation'],
+                'water_supply': [rng.choice(['River', 'Dam', 'Groundwater/boreholes'])],
+                'irrigation_system': [rng.choice(['Sprinklers', 'Drip irrigation'])],
+            },
+        })
+    return bundles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--chunk-size', type=int, default=ingest.CHUNK_SIZE)
+    args = parser.parse_args()
+
+    body = '\n'.join(json.dumps(b) for b in make_bundles(args.records, random.Random(1)))
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        app = make_app(f'sqlite:///{db_path}', DATABASE_PROFILE='production')
+        with app.app_context(), app.test_request_context():
+            db.session.add(User(username='enumerator', first_name='E', surname='N', email='e@example.com',
+                                phone_number='0', address='a', password_hash='x'))
+            db.session.commit()
+
+            start = time.perf_counter()
+            bundles = ingest.parse_bundles(body, 'application/x-ndjson')
+            results = ingest.ingest(bundles, 1, args.chunk_size)
+            elapsed = time.perf_counter() - start
+            assert all(r['status'] == 'created' for r in results), results[:3]
+
+            start = time.perf_counter()
+            retry = ingest.ingest(ingest.parse_bundles(body, 'application/x-ndjson'), 1, args.chunk_size)
+            retry_elapsed = time.perf_counter() - start
+            assert all(r['status'] == 'duplicate' for r in retry)
+
+    print(f"ingest  {args.records / elapsed:9.0f} records/sec  ({args.records} bundles, 3 rows each)")
+    print(f"resend  {args.records / retry_elapsed:9.0f} records/sec  (all duplicates)")
+
+
+if __name__ == '__main__':
+    main()
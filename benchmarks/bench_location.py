@@ -0,0 +1,75 @@
+"""GPS ping throughput: a commit per ping versus the coalescing location buffer.
+
+Run from the project root:
+
+    python -m benchmarks.bench_location --users 500 --pings 20000 --threads 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import update
+
+from location_buffer import LocationBuffer
+from models import db, User
+from benchmarks.fixtures import make_app, create_database, seed
+
+
+def run_threads(threads, pings, users, ping):
+    per_thread = pings // threads
+
+    def worker(n):
+        rng = random.Random(n)
+        for _ in range(per_thread):
+            ping(rng.randint(1, users), rng.uniform(-34.9, -30.0), rng.uniform(17.8, 24.0))
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return per_thread * threads, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--pings', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--flush-interval', type=float, default=1.0)
+    parser.add_argument('--flush-size', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        seed(db_path, args.users)
+        app = make_app(f'sqlite:///{db_path}', DATABASE_PROFILE='production',
+                       LOCATION_FLUSH_INTERVAL=args.flush_interval, LOCATION_FLUSH_SIZE=args.flush_size)
+
+        def direct(user_id, lat, lon):
+            with app.app_context():
+                db.session.execute(update(User).where(User.id == user_id)
+                                   .values(latitude=lat, longitude=lon))
+                db.session.commit()
+
+        sent, direct_elapsed = run_threads(args.threads, args.pings, args.users, direct)
+        print(f"commit per ping  {sent / direct_elapsed:9.0f} pings/sec  {sent} rows written")
+
+        buffer = LocationBuffer(app)
+        sent, buffered_elapsed = run_threads(args.threads, args.pings, args.users, buffer.record)
+        start = time.perf_counter()
+        buffer.stop()
+        drain = time.perf_counter() - start
+        stats = buffer.stats()
+        print(f"buffered         {sent / buffered_elapsed:9.0f} pings/sec  {stats['rows_written']} rows written "
+              f"in {stats['flushes']} flushes  (final flush {drain * 1000:.1f} ms)")
+        assert stats['pings'] == sent and stats['pending'] == 0
+
+
+if __name__ == '__main__':
+    main()
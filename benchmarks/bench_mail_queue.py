@@ -0,0 +1,84 @@
+"""Compare inline OTP delivery against the background mail queue.
+
+Run from the project root:
+
+    python -m benchmarks.bench_mail_queue --messages 500
+"""
+import argparse
+import time
+
+from flask import Flask
+from flask_mail import Mail, Message
+
+from mail_queue import MailQueue
+from benchmarks.smtp_stub import SMTPStub
+
+
+def make_app(port, workers):
+    app = Flask(__name__)
+    app.config['MAIL_SERVER'] = '127.0.0.1'
+    app.config['MAIL_PORT'] = port
+    app.config['MAIL_USE_TLS'] = False
+    app.config['MAIL_DEFAULT_SENDER'] = 'bench@example.com'
+    app.config['MAIL_QUEUE_WORKERS'] = workers
+    app.config['MAIL_QUEUE_MAXSIZE'] = 100000
+    mail = Mail(app)
+    return app, mail, MailQueue(mail, app)
+
+
+def otp_message(i):
+    msg = Message('Your OTP for Verification', recipients=[f'user{i}@example.com'])
+    msg.body = 'Your OTP is: 123456'
+    return msg
+
+
+def bench_inline(app, mail, n):
+    with app.app_context():
+        start = time.perf_counter()
+        for i in range(n):
+            mail.send(otp_message(i))
+        return time.perf_counter() - start, None
+
+
+def bench_queue(app, mail_queue, n):
+    with app.app_context():
+        start = time.perf_counter()
+        for i in range(n):
+            mail_queue.enqueue(otp_message(i))
+        enqueue_time = time.perf_counter() - start
+    mail_queue.join()
+    total = time.perf_counter() - start
+    mail_queue.stop()
+    return total, enqueue_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--connect-delay', type=float, default=0.05,
+                        help='simulated SMTP connect/TLS handshake cost in seconds')
+    args = parser.parse_args()
+
+    stub = SMTPStub(connect_delay=args.connect_delay).start()
+    try:
+        app, mail, mail_queue = make_app(stub.port, args.workers)
+
+        elapsed, _ = bench_inline(app, mail, args.messages)
+        print(f"inline    {args.messages / elapsed:10.1f} msgs/sec  "
+              f"request blocked {elapsed / args.messages * 1000:.2f} ms/msg  "
+              f"connections={stub.counters['connections']}")
+
+        stub.counters = {'connections': 0, 'messages': 0}
+        elapsed, enqueue_time = bench_queue(app, mail_queue, args.messages)
+        stats = mail_queue.stats()
+        print(f"queued    {args.messages / elapsed:10.1f} msgs/sec  "
+              f"request blocked {enqueue_time / args.messages * 1000:.3f} ms/msg  "
+              f"connections={stub.counters['connections']}  "
+              f"latency avg={stats['latency_avg'] * 1000:.1f}ms max={stats['latency_max'] * 1000:.1f}ms")
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Password checks per second, overall and per core, at each hashing cost.
+
+Run from the project root:
+
+    python -m benchmarks.bench_passwords --workers 4 --logins 200
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+from passwords import PasswordHasher
+
+METHODS = ['pbkdf2:sha256:100000', 'pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1']
+
+
+def bench(method, workers, logins, threads):
+    app = Flask(__name__)
+    app.config.update(PASSWORD_HASH_METHOD=method, PASSWORD_HASH_WORKERS=workers,
+                      PASSWORD_HASH_MAX_PENDING=threads, PASSWORD_HASH_TIMEOUT=60)
+    hasher = PasswordHasher(app)
+    pwhash = generate_password_hash('correct horse', method)
+    hasher.verify(pwhash, 'warm up the pool')
+    start = time.perf_counter()
+    # Request threads, as a threaded WSGI server would run them.
+    with ThreadPoolExecutor(max_workers=threads) as requests:
+        results = list(requests.map(lambda _: hasher.verify(pwhash, 'correct horse'), range(logins)))
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+    assert all(results)
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=16, help='concurrent request threads')
+    parser.add_argument('--methods', nargs='+', default=METHODS)
+    args = parser.parse_args()
+
+    for method in args.methods:
+        inline = bench(method, 0, args.logins, args.threads)
+        pooled = bench(method, args.workers, args.logins, args.threads)
+        print(f"{method:24} inline {inline:8.1f} logins/sec   "
+              f"pool({args.workers}) {pooled:8.1f} logins/sec  {pooled / args.workers:7.1f} per core")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Respondent listing: OFFSET pages with lazy loads versus keyset pages with selectin.
+
+Times a page at several depths into the listing and counts the queries it
+takes, first the way a naive listing reads (OFFSET, each relationship
+lazy-loaded per row, no indexes behind the lazy loads), then through
+respondents.listing(). Run from the project root:
+
+    python -m benchmarks.bench_respondents --respondents 300000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import event, select
+
+import respondents
+from models import db, Survey
+from benchmarks.fixtures import make_app, create_database, seed
+
+DEPTHS = (0, 0.1, 0.5, 0.99)
+
+
+def naive_page(offset, per_page):
+    surveys = db.session.scalars(select(Survey).where(Survey.timestamp.is_not(None))
+                                 .order_by(Survey.timestamp.desc(), Survey.id.desc())
+                                 .offset(offset).limit(per_page)).all()
+    return [respondents._entry(survey) for survey in surveys]
+
+
+def cursor_at(offset):
+    # The cursor a client holds after paging to offset, found without timing it.
+    survey = db.session.scalars(select(Survey).where(Survey.timestamp.is_not(None))
+                                .order_by(Survey.timestamp.desc(), Survey.id.desc())
+                                .offset(offset - 1).limit(1)).one()
+    return respondents.encode_cursor(survey)
+
+
+def measure(fn, repeat=3):
+    """(best milliseconds, queries) for fn, each run on an empty session."""
+    best = None
+    for _ in range(repeat):
+        db.session.remove()
+        queries = []
+        listener = lambda *args: queries.append(1)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        start = time.perf_counter()
+        fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        event.remove(db.engine, 'before_cursor_execute', listener)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--respondents', type=int, default=300000)
+    parser.add_argument('--per-page', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        seed(db_path, args.respondents)
+        app = make_app(f'sqlite:///{db_path}')
+        with app.app_context():
+            offsets = [int(args.respondents * depth) for depth in DEPTHS]
+            cursors = {offset: cursor_at(offset) if offset else None for offset in offsets}
+            with db.engine.begin() as conn:
+                for name in ('ix_survey_user_id_timestamp', 'ix_field_horticultural_crops_user_id_timestamp',
+                             'ix_field_horticultural_crops_demographic_id'):
+                    conn.exec_driver_sql(f'DROP INDEX {name}')
+            naive = {offset: measure(lambda: naive_page(offset, args.per_page)) for offset in offsets}
+            print(f"created {', '.join(respondents.index())}")
+            keyset = {offset: measure(lambda: respondents.listing(cursors[offset], args.per_page))
+                      for offset in offsets}
+
+            # Walking the pages must visit every survey exactly once.
+            seen, cursor = set(), cursors[offsets[-1]]
+            while True:
+                entries, cursor = respondents.listing(cursor, respondents.MAX_PER_PAGE)
+                seen.update(entry['survey_id'] for entry in entries)
+                if cursor is None:
+                    break
+            assert len(seen) == args.respondents - offsets[-1], (len(seen), args.respondents - offsets[-1])
+
+            compiled = respondents.page_query(cursors[offsets[1]], args.per_page).compile(db.engine)
+            with db.engine.connect() as conn:
+                plan = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}',
+                                            tuple(compiled.params[key] for key in compiled.positiontup)).all()
+
+    print(f"respondents={args.respondents}, {args.per_page} per page")
+    print(f"{'offset':>8}{'offset + lazy':>22}{'keyset + selectin':>24}")
+    for offset in offsets:
+        (naive_ms, naive_queries), (keyset_ms, keyset_queries) = naive[offset], keyset[offset]
+        print(f"{offset:>8}{naive_ms:10.1f} ms {naive_queries:4} q{keyset_ms:12.1f} ms {keyset_queries:4} q")
+    print('keyset plan: ' + '; '.join(row[-1] for row in plan))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Respondent search: FTS5 prefix queries versus LIKE scans.
+
+Run from the project root:
+
+    python -m benchmarks.bench_search --users 1000000 --queries 200
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import search
+from models import db
+from benchmarks.fixtures import make_app, create_database
+
+FIRST_NAMES = ['Thabo', 'Sipho', 'Lerato', 'Johan', 'Anna', 'Pieter', 'Nomsa', 'Bongani', 'Elsa',
+               'Kagiso', 'Zanele', 'Willem', 'Lindiwe', 'Themba', 'Marike', 'Ayanda', 'Hendrik',
+               'Naledi', 'Riaan', 'Palesa', 'Mandla', 'Karin', 'Sibusiso', 'Annelie', 'Lwazi']
+SURNAMES = ['Nkosi', 'Dlamini', 'van der Merwe', 'Botha', 'Mokoena', 'Naidoo', 'Pretorius', 'Khumalo',
+            'du Plessis', 'Ndlovu', 'Venter', 'Mahlangu', 'Smit', 'Zulu', 'Coetzee', 'Mthembu',
+            'Fourie', 'Molefe', 'Steyn', 'Sithole', 'Joubert', 'Radebe', 'Nel', 'Mabaso', 'Kruger']
+STREETS = ['Main Road', 'Church Street', 'Farm Road', 'Voortrekker Road', 'River Lane', 'Dam Road']
+TOWNS = ['Worcester', 'Paarl', 'Robertson', 'Stellenbosch', 'Ceres', 'George', 'Oudtshoorn',
+         'Swellendam', 'Malmesbury', 'Vredendal', 'Beaufort West', 'Caledon']
+FARM_WORDS = ['Rivier', 'Berg', 'Vlei', 'Kloof', 'Fontein', 'Rand', 'Dal', 'Hoek', 'Bos', 'Vallei']
+
+
+def seed_users(path, n, rng, batch=50000):
+    conn = sqlite3.connect(path)
+    with conn:
+        for start in range(1, n + 1, batch):
+            users, farms = [], []
+            for i in range(start, min(start + batch, n + 1)):
+                first, surname = rng.choice(FIRST_NAMES), rng.choice(SURNAMES)
+                users.append((i, f'user{i}', first, surname,
+                              f"{first.lower()}.{surname.replace(' ', '').lower()}{i}@example.com",
+                              '0820000000',
+                              f'{rng.randint(1, 999)} {rng.choice(STREETS)}, {rng.choice(TOWNS)}', 'x'))
+                farms.append((i, f'{rng.choice(FARM_WORDS)}{rng.choice(FARM_WORDS).lower()} {i}', 'wc',
+                              'cape_winelands', 'drakenstein', 'farming', 'fruits'))
+            conn.executemany(
+                'INSERT INTO "user" (id, username, first_name, surname, email, phone_number, address, '
+                'password_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', users)
+            conn.executemany(
+                'INSERT INTO demographic (user_id, registered_name, province, district, municipality, '
+                'agricultural_activity, farm_activity) VALUES (?, ?, ?, ?, ?, ?, ?)', farms)
+    conn.close()
+
+
+def like_scan(conn, query, limit):
+    # What a search looks like without the index: a LIKE per field.
+    words = query.split()
+    clauses = ' AND '.join(
+        '(u.first_name LIKE ? OR u.surname LIKE ? OR u.email LIKE ? OR u.address LIKE ? '
+        'OR d.registered_name LIKE ?)' for _ in words)
+    params = [f'%{word}%' for word in words for _ in range(5)]
+    return conn.execute(
+        f'SELECT u.id FROM "user" u LEFT JOIN demographic d ON d.user_id = u.id WHERE {clauses} LIMIT ?',
+        params + [limit]).fetchall()
+
+
+def lookup_queries(path, rng, n):
+    """Queries for one particular respondent, by email or farm name."""
+    conn = sqlite3.connect(path)
+    count = conn.execute('SELECT MAX(id) FROM "user"').fetchone()[0]
+    queries = []
+    for user_id in rng.sample(range(1, count + 1), n):
+        email, farm = conn.execute(
+            'SELECT u.email, d.registered_name FROM "user" u JOIN demographic d ON d.user_id = u.id '
+            'WHERE u.id = ?', (user_id,)).fetchone()
+        queries.append(email.split('@')[0] if user_id % 2 else farm)
+    conn.close()
+    return queries
+
+
+def browse_queries(rng, n):
+    """Broad queries on common names, towns and farm words."""
+    queries = []
+    for _ in range(n):
+        kind = rng.randrange(4)
+        if kind == 0:
+            queries.append(rng.choice(FIRST_NAMES)[:rng.randint(2, 5)])
+        elif kind == 1:
+            queries.append(f'{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES).split()[-1][:3]}')
+        elif kind == 2:
+            queries.append(f'{rng.choice(FARM_WORDS)}{rng.choice(FARM_WORDS).lower()}')
+        else:
+            queries.append(f'{rng.choice(TOWNS)} {rng.choice(STREETS).split()[0]}')
+    return queries
+
+
+def percentile(values, q):
+    return sorted(values)[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--pages', type=int, default=3, help='pages fetched per query')
+    parser.add_argument('--scan-queries', type=int, default=3,
+                        help='LIKE scans are slow; run only this many of them')
+    parser.add_argument('--inserts', type=int, default=5000,
+                        help='registrations timed with and without the index triggers')
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        conn = sqlite3.connect(db_path)
+        # Seed without the index and build it in bulk afterwards, as on an existing database.
+        for statement in search.UNINSTALL:
+            conn.execute(statement)
+        conn.close()
+        start = time.perf_counter()
+        seed_users(db_path, args.users, rng)
+        print(f"seeded {args.users} users in {time.perf_counter() - start:.1f}s")
+
+        app = make_app(f'sqlite:///{db_path}', DATABASE_PROFILE='production')
+        with app.app_context():
+            start = time.perf_counter()
+            count = search.rebuild()
+            print(f"rebuild: indexed {count} users in {time.perf_counter() - start:.1f}s, "
+                  f"database now {os.path.getsize(db_path) / 2**20:.0f} MiB")
+
+            lookups = lookup_queries(db_path, rng, args.queries)
+            for label, queries in (('lookup', lookups), ('browse', browse_queries(rng, args.queries))):
+                latencies, hits = [], 0
+                for query in queries:
+                    for page in range(1, args.pages + 1):
+                        start = time.perf_counter()
+                        results, has_more, _ = search.search(query, page=page, per_page=20)
+                        latencies.append((time.perf_counter() - start) * 1000)
+                        hits += len(results)
+                        if not has_more:
+                            break
+                print(f"fts5 {label}: {len(latencies)} page fetches, {hits} results, "
+                      f"p50 {statistics.median(latencies):.2f} ms, p95 {percentile(latencies, 95):.2f} ms, "
+                      f"p99 {percentile(latencies, 99):.2f} ms, max {max(latencies):.2f} ms")
+            db.engine.dispose()
+
+        conn = sqlite3.connect(db_path)
+        start = time.perf_counter()
+        for query in lookups[:args.scan_queries]:
+            like_scan(conn, query, 20)
+        scan_ms = (time.perf_counter() - start) / args.scan_queries * 1000
+        print(f"like lookup: {scan_ms:.0f} ms per query")
+
+        # Cost the triggers add to each registration and demographic submission.
+        timings = {}
+        for label, statements in (('with triggers', []), ('without triggers', search.UNINSTALL)):
+            for statement in statements:
+                conn.execute(statement)
+            first = args.users + 1 + len(timings) * args.inserts
+            start = time.perf_counter()
+            for i in range(first, first + args.inserts):
+                with conn:
+                    conn.execute(
+                        'INSERT INTO "user" (id, username, first_name, surname, email, phone_number, '
+                        "address, password_hash) VALUES (?, ?, 'Thabo', 'Nkosi', ?, '0', '1 Main Road', 'x')",
+                        (i, f'user{i}', f'thabo{i}@example.com'))
+                    conn.execute(
+                        'INSERT INTO demographic (user_id, registered_name, province, district, '
+                        "municipality, agricultural_activity, farm_activity) "
+                        "VALUES (?, 'Rivierberg', 'wc', 'eden', 'george', 'farming', 'fruits')", (i,))
+            timings[label] = (time.perf_counter() - start) / args.inserts * 1e6
+        conn.close()
+        print('inserts: ' + ', '.join(f'{label} {us:.0f} us' for label, us in timings.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Nearest-farm queries: grid-cell index versus a full scan with haversine.
+
+Run from the project root:
+
+    python -m benchmarks.bench_spatial --points 1000000 --queries 50
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import spatial
+from models import db
+from benchmarks.fixtures import make_app, create_database
+
+# Roughly the extent of South Africa.
+SOUTH, WEST, NORTH, EAST = -34.8, 16.5, -22.1, 32.9
+
+
+def seed_points(path, n, rng, batch=50000):
+    conn = sqlite3.connect(path)
+    with conn:
+        for start in range(0, n, batch):
+            rows = []
+            for i in range(start, min(start + batch, n)):
+                lat, lon = rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST)
+                rows.append((f'user{i}', 'F', 'S', f'user{i}@example.com', '0', 'a', 'x',
+                             lat, lon, spatial.cell_for(lat, lon)))
+            conn.executemany(
+                'INSERT INTO "user" (username, first_name, surname, email, phone_number, address, '
+                'password_hash, latitude, longitude, location_cell) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows)
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def full_scan(conn, lat, lon, radius_km, limit):
+    found = []
+    for user_id, plat, plon in conn.execute(
+            'SELECT id, latitude, longitude FROM "user" WHERE latitude IS NOT NULL'):
+        distance = spatial.distance_km(lat, lon, plat, plon)
+        if distance <= radius_km:
+            found.append((distance, user_id))
+    found.sort()
+    return [user_id for _, user_id in found[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--radius-km', type=float, default=10.0)
+    parser.add_argument('--scan-queries', type=int, default=3,
+                        help='full scans are slow; run only this many of them')
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'site.db')
+        create_database(db_path)
+        start = time.perf_counter()
+        seed_points(db_path, args.points, rng)
+        print(f"seeded {args.points} points in {time.perf_counter() - start:.1f}s")
+        centres = [(rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST)) for _ in range(args.queries)]
+
+        conn = sqlite3.connect(db_path)
+        start = time.perf_counter()
+        expected = [full_scan(conn, lat, lon, args.radius_km, 50) for lat, lon in centres[:args.scan_queries]]
+        scan_ms = (time.perf_counter() - start) / args.scan_queries * 1000
+        conn.close()
+
+        app = make_app(f'sqlite:///{db_path}', DATABASE_PROFILE='production')
+        with app.app_context():
+            south, west, north, east = spatial.bounding_box(*centres[0], args.radius_km)
+            query = spatial.within_box(south, west, north, east)
+            plan = db.session.connection().exec_driver_sql(
+                'EXPLAIN QUERY PLAN SELECT id FROM "user" WHERE location_cell BETWEEN ? AND ?', (0, 1)).all()
+            print(f"plan: {plan[0][-1]}")
+
+            start = time.perf_counter()
+            results = [spatial.nearby(lat, lon, args.radius_km) for lat, lon in centres]
+            indexed_ms = (time.perf_counter() - start) / len(centres) * 1000
+            for want, got in zip(expected, results):
+                assert want == [farm['id'] for farm in got]
+
+            start = time.perf_counter()
+            boxes = [spatial.within_box(lat - 0.5, lon - 0.5, lat + 0.5, lon + 0.5) for lat, lon in centres]
+            box_ms = (time.perf_counter() - start) / len(centres) * 1000
+
+    matches = sum(len(r) for r in results) / len(results)
+    print(f"full scan  {scan_ms:10.1f} ms/query")
+    print(f"indexed    {indexed_ms:10.2f} ms/query  ({matches:.0f} farms within {args.radius_km} km, "
+          f"{len(query)} candidates in the first box)")
+    print(f"1x1 deg box {box_ms:9.2f} ms/query  ({sum(len(b) for b in boxes) / len(boxes):.0f} farms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Register many respondents that share one base username.
+
+Compares the counter-based allocator against the old probe-one-suffix-at-a-time
+loop. Run from the project root:
+
+    python -m benchmarks.bench_usernames --users 10000 --legacy-users 300
+"""
+import argparse
+import time
+
+from sqlalchemy import event
+
+from models import db, User
+from usernames import allocate_username
+from benchmarks.fixtures import make_app
+
+
+def legacy_username(base):
+    username = base
+    counter = 1
+    while User.query.filter_by(username=username).first():
+        username = f"{base}{counter}"
+        counter += 1
+    return username
+
+
+def register_all(allocate, n):
+    queries = 0
+
+    def count(*args):
+        nonlocal queries
+        queries += 1
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    start = time.perf_counter()
+    for i in range(n):
+        user = User(first_name='Thabo', surname='Nkosi', email=f'thabo{i}@example.com',
+                    phone_number='0820000000', address='1 Farm Road', password_hash='x')
+        user.username = allocate('thabon')
+        db.session.add(user)
+        db.session.commit()
+    elapsed = time.perf_counter() - start
+    event.remove(db.engine, 'before_cursor_execute', count)
+    return elapsed, queries
+
+
+def run(label, allocate, n):
+    app = make_app()
+    with app.app_context():
+        db.create_all()
+        elapsed, queries = register_all(allocate, n)
+        last = db.session.query(User.username).order_by(User.id.desc()).first()[0]
+        print(f"{label:8} users={n:6d}  {n / elapsed:9.1f} registrations/sec  "
+              f"{queries / n:7.1f} queries/registration  last={last}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--legacy-users', type=int, default=300,
+                        help='the legacy loop is quadratic, so it runs on a smaller set')
+    args = parser.parse_args()
+
+    run('counter', allocate_username, args.users)
+    if args.legacy_users:
+        run('legacy', legacy_username, args.legacy_users)
+
+
+if __name__ == '__main__':
+    main()
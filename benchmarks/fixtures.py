@@ -0,0 +1,97 @@
+"""Shared helpers for building throwaway benchmark databases."""
+import itertools
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+import archive
+from database import init_database
+from models import db, User, Demographic, Survey, FieldHorticulturalCrops, HECTARE_COLUMNS, HECTARE_SCALE
+
+
+MUNICIPALITIES = {
+    'cape_winelands': ['breede_valley', 'drakenstein', 'langeberg', 'stellenbosch', 'witzenberg'],
+    'central_karoo': ['beaufort_west', 'laingsburg', 'prince_albert'],
+    'eden': ['bitou', 'george', 'knysna', 'mossel_bay', 'oudtshoorn'],
+    'overberg': ['cape_agulhas', 'overstrand', 'swellendam', 'theewaterskloof'],
+    'west_coast': ['bergrivier', 'cederberg', 'matzikama', 'saldanha_bay', 'swartland'],
+}
+
+
+def make_app(database_uri='sqlite://', **config):
+    """A bare Flask app bound to the project's models."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config.update(config)
+    init_database(app, db)
+    return app
+
+
+def create_database(path):
+    """Create an empty database file with the project schema."""
+    app = make_app(f'sqlite:///{path}')
+    with app.app_context():
+        db.create_all()
+        # create_all() already ran archive's after_create hook; building the
+        # history views here too keeps that dependency explicit.
+        with db.engine.begin() as conn:
+            archive.create_views(conn)
+        db.engine.dispose()
+
+
+def _insert(conn, table, rows):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    columns = list(first)
+    sql = (f'INSERT INTO "{table}" ({", ".join(columns)}) '
+           f'VALUES ({", ".join("?" for _ in columns)})')
+    conn.executemany(sql, ([row[c] for c in columns] for row in itertools.chain([first], rows)))
+
+
+def seed(path, respondents, seed=1, start=datetime(2024, 1, 1), span_days=365):
+    """Fill path with respondents users, each with demographics, a survey and crops answers."""
+    rng = random.Random(seed)
+    hectare_columns = [name for name, _, _ in HECTARE_COLUMNS]
+    districts = list(MUNICIPALITIES)
+    conn = sqlite3.connect(path)
+    with conn:
+        offset = conn.execute('SELECT COALESCE(MAX(id), 0) FROM user').fetchone()[0]
+        demographic_offset = conn.execute('SELECT COALESCE(MAX(id), 0) FROM demographic').fetchone()[0]
+        ids = range(offset + 1, offset + respondents + 1)
+
+        def timestamp():
+            return (start + timedelta(seconds=rng.uniform(0, span_days * 86400))).isoformat(sep=' ')
+
+        _insert(conn, User.__tablename__, ({
+            'id': i, 'username': f'user{i}', 'first_name': 'Bench', 'surname': f'User{i}',
+            'email': f'user{i}@example.com', 'phone_number': '0820000000',
+            'address': f'{i} Farm Road', 'password_hash': 'x',
+            'latitude': rng.uniform(-34.8, -30.5), 'longitude': rng.uniform(17.8, 24.2),
+        } for i in ids))
+
+        def demographic(i):
+            district = rng.choice(districts)
+            return {'user_id': i, 'registered_name': f'Farm {i}', 'province': 'wc',
+                    'district': district, 'municipality': rng.choice(MUNICIPALITIES[district]),
+                    'agricultural_activity': 'farming', 'farm_activity': 'field_crops,fruits'}
+
+        _insert(conn, Demographic.__tablename__, (demographic(i) for i in ids))
+
+        def survey(i):
+            row = {'user_id': i, 'demographic_id': demographic_offset + i - offset, 'timestamp': timestamp()}
+            for name in hectare_columns:
+                row[name] = round(rng.expovariate(1 / 50) * HECTARE_SCALE) if rng.random() < 0.4 else 0
+            return row
+
+        _insert(conn, Survey.__tablename__, (survey(i) for i in ids))
+        _insert(conn, FieldHorticulturalCrops.__tablename__, ({
+            'user_id': i, 'demographic_id': demographic_offset + i - offset, 'farming_practice': 'Irrigation',
+            'water_supply': rng.choice(['River', 'Dam', 'Groundwater/boreholes']),
+            'irrigation_system': rng.choice(['Sprinklers', 'Drip irrigation', 'Pivots']),
+            'timestamp': timestamp(),
+        } for i in ids))
+    conn.close()
@@ -0,0 +1,74 @@
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP for smtplib/Flask-Mail to deliver a message."""
+
+    def handle(self):
+        server = self.server
+        # Stand-in for the TCP + TLS handshake cost of a real mail server.
+        time.sleep(server.connect_delay)
+        server.count('connections')
+        self._reply('220 localhost stub ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self._reply('250 localhost')
+            elif command.startswith('DATA'):
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                time.sleep(server.message_delay)
+                server.count('messages')
+                self._reply('250 OK')
+            elif command.startswith('QUIT'):
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('250 OK')
+
+    def _reply(self, text):
+        self.wfile.write(text.encode('ascii') + b'\r\n')
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """Local SMTP sink that counts connections and delivered messages."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, connect_delay=0.05, message_delay=0.0):
+        super().__init__((host, port), _SMTPHandler)
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.counters = {'connections': 0, 'messages': 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    stub = SMTPStub(port=2525, connect_delay=0.0)
+    print(f"SMTP stub listening on 127.0.0.1:{stub.port}")
+    stub.serve_forever()
@@ -4,3 +4,67 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your_secret_key'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///site.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Engine profile from database.DATABASE_PROFILES: WAL, pragmas and pool sizing.
+    DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE') or 'production'
+
+    MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.your-email-provider.com'
+    MAIL_PORT = int(os.environ.get('MAIL_PORT') or 587)
+    MAIL_USE_TLS = True
+    MAIL_USE_SSL = False
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME') or 'your-email@example.com'
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD') or 'your-email-password'
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or 'your-email@example.com'
+    MAIL_QUEUE_WORKERS = 2
+    MAIL_QUEUE_MAXSIZE = 1000
+    # Any werkzeug method string, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'.
+    # Stored hashes made with another method are upgraded on the next login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1)
+    PASSWORD_HASH_MAX_PENDING = 64
+    USER_CACHE_SIZE = 4096
+    # Seconds a cached login stays valid in this worker before it is re-read.
+    USER_CACHE_TTL = 300
+    INGEST_MAX_RECORDS = 20000
+    # Upload bodies larger than this are refused before they are read or parsed.
+    INGEST_MAX_BYTES = 32 * 1024 * 1024
+    # GPS pings keep only the latest fix per user and are written in batches
+    # every LOCATION_FLUSH_INTERVAL seconds or once LOCATION_FLUSH_SIZE users wait.
+    LOCATION_FLUSH_INTERVAL = 5.0
+    LOCATION_FLUSH_SIZE = 500
+    # Seconds an untouched, half-finished questionnaire is kept for the user to resume.
+    SURVEY_DRAFT_TTL = 30 * 24 * 3600
+    # Requests are stack-sampled when they send X-Profile-Token: PROFILER_TOKEN,
+    # or at random for a PROFILER_SAMPLE_RATE fraction of all requests.
+    PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE') or 0)
+    PROFILER_INTERVAL = 0.005
+    PROFILER_KEEP = 50
+    # Seconds browsers and proxies may reuse the anonymous home and not_targeted pages.
+    PAGE_CACHE_MAX_AGE = 300
+    # Limits on submissions to the mail-sending and password-hashing endpoints:
+    # concurrent requests per endpoint, and (count, seconds) token buckets per
+    # client IP and per submitted email. 'sqlite' shares them across workers.
+    ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND') or 'sqlite'
+    ADMISSION_LIMITS = {
+        'send_otp': {'concurrency': 4, 'per_ip': (20, 3600), 'per_email': (5, 3600)},
+        'register': {'concurrency': 8, 'per_ip': (30, 600)},
+        'login': {'concurrency': 8, 'per_ip': (60, 600), 'per_email': (10, 600)},
+    }
+    # Reverse proxies in front of the app (e.g. 1 on a hosted proxy). Each one's
+    # X-Forwarded-For entry is trusted, so request.remote_addr is the client's
+    # address; the admission per_ip limits depend on it. 0 trusts none.
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES') or 0)
+    # Reports and exports read a replica of the database copied at most this many seconds ago;
+    # reports older than that are served anyway, with a logged warning.
+    REPLICA_MAX_STALENESS = 300
+    # Seconds between the app's background replica refreshes. 0 leaves it to
+    # cron (python replica.py refresh).
+    REPLICA_REFRESH_INTERVAL = 120
+    # Staff allowed into the /admin views, as a comma-separated list of emails.
+    ADMIN_EMAILS = {email.strip().lower() for email in (os.environ.get('ADMIN_EMAILS') or '').split(',')
+                    if email.strip()}
+    # Survey and crops answers older than ARCHIVE_AFTER_DAYS move to yearly archive
+    # tables (python archive.py run), ARCHIVE_BATCH_SIZE rows per transaction.
+    ARCHIVE_AFTER_DAYS = 365
+    ARCHIVE_BATCH_SIZE = 500
+    ARCHIVE_PAUSE = 0.05
@@ -0,0 +1,176 @@
+"""Server-side drafts of the questionnaire a respondent is part-way through.
+
+Each step's submitted answers are parked in the user's survey_draft row
+instead of being committed as Demographic, Survey and crops rows one request
+at a time. The last step on the respondent's path writes every section in a
+single transaction and deletes the draft, so an abandoned questionnaire
+leaves no partial answers behind and a returning user finds their earlier
+answers filled in.
+
+Which steps a respondent sees depends on their demographic answers, and is
+worked out from the draft rather than carried in the session cookie.
+
+Drafts untouched for SURVEY_DRAFT_TTL seconds are swept now and then by the
+app itself; to sweep from cron instead run:
+
+    python drafts.py sweep
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+
+import rollups
+from models import db, SurveyDraft
+from responses import SECTIONS
+
+STEP_ENDPOINTS = {
+    'demographic': 'submit_demographic',
+    'survey': 'survey',
+    'field_horticultural_crops': 'field_horticultural_crops',
+}
+SKIP_FIELDS = ('csrf_token', 'submit')
+DEFAULT_TTL = 30 * 24 * 3600
+SWEEP_INTERVAL = 3600
+
+_last_sweep = 0.0
+
+
+def _expiry():
+    return datetime.utcnow() - timedelta(seconds=current_app.config.get('SURVEY_DRAFT_TTL', DEFAULT_TTL))
+
+
+def _answers(draft):
+    if draft is None or draft.updated_at < _expiry():
+        return {}
+    return json.loads(draft.answers)
+
+
+def load(user_id):
+    """The user's unexpired draft answers, {section: {field: [values]}}."""
+    return _answers(db.session.get(SurveyDraft, user_id))
+
+
+def path(answers):
+    """The sections this respondent has to answer, in order.
+
+    Farmers answer all three; forestry-only respondents skip the crops
+    questions; anyone else stops after the demographics. Without demographic
+    answers on file the survey page stands on its own.
+    """
+    if 'demographic' not in answers:
+        return ['survey']
+    activities = answers['demographic'].get('agricultural_activity', [])
+    steps = ['demographic']
+    if 'farming' in activities or 'forestry' in activities:
+        steps.append('survey')
+    if 'farming' in activities:
+        steps.append('field_horticultural_crops')
+    return steps
+
+
+def next_step(user_id):
+    """The first section on the user's path that the draft has no answers for."""
+    answers = load(user_id)
+    if 'demographic' not in answers:
+        return 'demographic'
+    for section in path(answers):
+        if section not in answers:
+            return section
+    return 'demographic'
+
+
+def form_for(section, user_id):
+    """The section's form; on a GET it is filled in from the user's draft."""
+    form_class = SECTIONS[section][0]
+    if request.method == 'GET':
+        saved = load(user_id).get(section)
+        if saved is not None:
+            return form_class(formdata=_formdata(saved))
+    return form_class()
+
+
+def _formdata(values):
+    return MultiDict([(name, value) for name, items in values.items() for value in items])
+
+
+def advance(user_id, section, form):
+    """Record a validated step and return the next section, or None when done.
+
+    When section is the last one on the respondent's path, every drafted
+    section on that path is written in one transaction and the draft is
+    removed.
+    """
+    try:
+        return _advance(user_id, section, form)
+    except IntegrityError:
+        # A concurrent first step (a double-click, a second tab) created the
+        # draft first; start again from the row it committed.
+        db.session.rollback()
+        return _advance(user_id, section, form)
+
+
+def _advance(user_id, section, form):
+    draft = db.session.get(SurveyDraft, user_id)
+    answers = _answers(draft)
+    answers[section] = {field.name: list(field.raw_data)
+                        for field in form if field.raw_data and field.name not in SKIP_FIELDS}
+    steps = path(answers)
+    remaining = steps[steps.index(section) + 1:] if section in steps else []
+    if remaining:
+        if draft is None:
+            draft = SurveyDraft(user_id=user_id)
+            db.session.add(draft)
+        draft.answers = json.dumps(answers, separators=(',', ':'))
+        draft.updated_at = datetime.utcnow()
+        db.session.commit()
+        _maybe_sweep()
+        return remaining[0]
+    sections = [name for name in SECTIONS if name in answers and (name in steps or name == section)]
+    _finish(user_id, answers, sections)
+    return None
+
+
+def _finish(user_id, answers, sections):
+    responses = {}
+    for name in sections:
+        form_class, model, build = SECTIONS[name]
+        form = form_class(formdata=_formdata(answers[name]), meta={'csrf': False})
+        responses[name] = model(user_id=user_id, **build(form))
+        db.session.add(responses[name])
+    demographic = responses.get('demographic') or rollups.latest_demographic(user_id)
+    for name in ('survey', 'field_horticultural_crops'):
+        if name in responses:
+            responses[name].demographic = demographic
+    if 'survey' in responses:
+        rollups.record_survey(responses['survey'], demographic)
+    db.session.execute(delete(SurveyDraft).where(SurveyDraft.user_id == user_id))
+    db.session.commit()
+
+
+def sweep():
+    """Delete expired drafts; returns how many went."""
+    result = db.session.execute(delete(SurveyDraft).where(SurveyDraft.updated_at < _expiry()))
+    db.session.commit()
+    return result.rowcount
+
+
+def _maybe_sweep():
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep >= SWEEP_INTERVAL:
+        _last_sweep = now
+        sweep()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['sweep']:
+        sys.exit('usage: python drafts.py sweep')
+    from app import app
+    with app.app_context():
+        print(f"Removed {sweep()} expired survey drafts")
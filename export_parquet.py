@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import replica
+
+
+DB_PATH = 'instance/site.db'
+OUTPUT_DIR = 'site_data_parquet'
+BATCH_SIZE = 10000
+MANIFEST = '_manifest.json'
+# What Hive, Spark and pyarrow call a partition whose key is NULL.
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# archive.py's views over the hot tables and their yearly archives.
+SURVEYS = 'survey_history'
+CROPS = 'field_horticultural_crops_history'
+SURVEY_KEYS = ('id', 'user_id', 'demographic_id', 'timestamp')
+# Survey areas are stored as integer hundredths of a hectare (models.HECTARE_SCALE).
+HECTARE_SCALE = 100
+USER_COLUMNS = [('username', pa.string()), ('latitude', pa.float64()), ('longitude', pa.float64())]
+DEMOGRAPHIC_COLUMNS = [('registered_name', pa.string()), ('district', pa.string()),
+                       ('municipality', pa.string()), ('agricultural_activity', pa.string()),
+                       ('other_agricultural_activity', pa.string()), ('farm_activity', pa.string())]
+CROPS_COLUMNS = [('farming_practice', pa.string()), ('water_supply', pa.string()),
+                 ('irrigation_system', pa.string())]
+
+
+def hectare_columns(conn):
+    """The survey table's land-area columns, in table order."""
+    return [row[1] for row in conn.execute('PRAGMA table_info(survey)') if row[1] not in SURVEY_KEYS]
+
+
+def fact_schema(hectares):
+    return pa.schema(
+        [('survey_id', pa.int64()), ('user_id', pa.int64()), ('timestamp', pa.timestamp('us'))]
+        + USER_COLUMNS + DEMOGRAPHIC_COLUMNS
+        + [(name, pa.float64()) for name in hectares]
+        + CROPS_COLUMNS)
+
+
+def fact_query(hectares):
+    """One row per survey response with the demographic and crops answers submitted with it.
+
+    Rows come out ordered by (province, month) so each partition is a
+    contiguous run of the cursor.
+    """
+    columns = (['s.id', 's.user_id', 's.timestamp']
+               + [f'u.{name}' for name, _ in USER_COLUMNS]
+               + [f'd.{name}' for name, _ in DEMOGRAPHIC_COLUMNS]
+               + [f's.{name} / {HECTARE_SCALE}.0' for name in hectares]
+               + [f'c.{name}' for name, _ in CROPS_COLUMNS])
+    return f"""
+        SELECT d.province, strftime('%Y-%m', s.timestamp) AS month, {', '.join(columns)}
+        FROM {SURVEYS} s
+        JOIN "user" u ON u.id = s.user_id
+        LEFT JOIN demographic d ON d.id = s.demographic_id
+        LEFT JOIN (SELECT demographic_id, MAX(id) AS id FROM {CROPS} GROUP BY demographic_id) lc
+            ON lc.demographic_id = s.demographic_id
+        LEFT JOIN {CROPS} c ON c.id = lc.id
+        WHERE s.timestamp >= ?
+        ORDER BY d.province, month, s.id"""
+
+
+def partition_path(output_dir, province, month):
+    province = NULL_PARTITION if province is None else quote(province, safe='')
+    return os.path.join(output_dir, f'province={province}', f'month={month}', 'part-0.parquet')
+
+
+def read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _next_month(month):
+    year, number = map(int, month.split('-'))
+    return f'{year + number // 12:04d}-{number % 12 + 1:02d}'
+
+
+class _PartitionWriter:
+    """Writes one partition's rows to a temporary file and moves it into place on close."""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.writer = pq.ParquetWriter(path + '.tmp', schema, compression='zstd')
+        self.rows = 0
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        batch = pa.RecordBatch.from_arrays(
+            [_array(values, field.type) for values, field in zip(columns, self.schema)], schema=self.schema)
+        self.writer.write_batch(batch)
+        self.rows += len(rows)
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+def _array(values, type):
+    if pa.types.is_timestamp(type):
+        return pa.array(values, pa.string()).cast(type)
+    return pa.array(values, type)
+
+
+def export(db_path=DB_PATH, output_dir=OUTPUT_DIR, full=False, batch_size=BATCH_SIZE, now=None,
+           max_staleness=replica.DEFAULT_MAX_STALENESS):
+    """Write the survey fact table as Parquet, partitioned by province and month.
+
+    Rows are read from the database's replica, refreshed first if it is older
+    than max_staleness seconds. Its snapshot time is recorded as data_as_of
+    in the manifest and in every file's metadata, and stands in for now.
+
+    Surveys are timestamped when they are submitted, so once a month is over
+    its partitions never change. The manifest records the last month that
+    was over at the previous run; an incremental run only reads surveys from
+    the month after it and writes just those partitions, replacing the
+    still-open current month's. With full set everything is rewritten and
+    partitions left without rows are removed.
+    Returns a {(province, month): row_count} dict of the partitions written.
+    """
+    path = replica.path_for(db_path)
+    taken = replica.ensure_fresh(db_path, path, max_staleness)
+    now = now or datetime.utcfromtimestamp(taken)
+    manifest = read_manifest(output_dir)
+    sealed = None if full else manifest.get('sealed_through')
+    since = f'{_next_month(sealed)}-01' if sealed else ''
+
+    conn = replica.connect(path)
+    written = {}
+    writer = None
+    try:
+        hectares = hectare_columns(conn)
+        schema = fact_schema(hectares).with_metadata({'data_as_of': replica.isoformat(taken)})
+        cursor = conn.execute(fact_query(hectares), (since,))
+        key = None
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            start = 0
+            for i, row in enumerate(rows):
+                if (row[0], row[1]) == key:
+                    continue
+                if writer is not None:
+                    if i > start:
+                        writer.write([r[2:] for r in rows[start:i]])
+                    writer.close()
+                    written[key] = writer.rows
+                    writer = None
+                key = (row[0], row[1])
+                writer = _PartitionWriter(partition_path(output_dir, *key), schema)
+                start = i
+            writer.write([r[2:] for r in rows[start:]])
+        if writer is not None:
+            writer.close()
+            written[key] = writer.rows
+            writer = None
+    finally:
+        if writer is not None:
+            writer.writer.close()
+            os.remove(writer.path + '.tmp')
+        conn.close()
+
+    # Every month before this one has now been written in full.
+    year, month = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+    manifest['sealed_through'] = f'{year:04d}-{month:02d}'
+    manifest['data_as_of'] = replica.isoformat(taken)
+    manifest['exported_at'] = replica.isoformat(time.time())
+    partitions = {tuple(partition) for partition in manifest.get('partitions', [])}
+    if full:
+        # Partitions whose surveys have all gone (deleted, or relinked by a migration) go too.
+        for province, month in partitions - set(written):
+            shutil.rmtree(os.path.dirname(partition_path(output_dir, province, month)), ignore_errors=True)
+        partitions = set()
+    manifest['partitions'] = sorted(partitions | set(written), key=lambda p: (p[0] or '', p[1]))
+    os.makedirs(output_dir, exist_ok=True)
+    write_manifest(output_dir, manifest)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the survey fact table to Parquet.')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--output', default=OUTPUT_DIR, help='directory to write the partitions to')
+    parser.add_argument('--full', action='store_true', help='rewrite every partition, not just new ones')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--max-staleness', type=float, default=replica.DEFAULT_MAX_STALENESS,
+                        help='refresh the replica first if it is older than this many seconds')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    written = export(args.db, args.output, args.full, args.batch_size, max_staleness=args.max_staleness)
+    elapsed = time.perf_counter() - start
+    total = sum(written.values())
+
+    print(f"Wrote {len(written)} partitions to {args.output} "
+          f"({total} rows in {elapsed:.1f}s, {total / elapsed if elapsed else 0:.0f} rows/sec, "
+          f"data as of {read_manifest(args.output)['data_as_of']})")
+
+
+if __name__ == '__main__':
+    main()
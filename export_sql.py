@@ -1,18 +1,225 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
 import sqlite3
+import struct
+import tempfile
+import time
+from datetime import datetime
 
+import replica
 
-db_path = 'site.db'
 
+DB_PATH = 'instance/site.db'
+BACKUP_DIR = 'backups'
+PAGES_PER_STEP = 256
+STEP_SLEEP = 0.05
+# A backup run now should hold everything committed until now, so by default
+# the replica is refreshed first rather than reused.
+MAX_STALENESS = 0
+MANIFEST = 'manifest.json'
+HASHES = 'pages.hash'
+DIGEST_SIZE = 8
+PAGE_RECORD = struct.Struct('>I')
 
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
 
+def page_hashes(path, page_size):
+    """Return one short digest per page of a database file, concatenated."""
+    digests = bytearray()
+    with open(path, 'rb') as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                break
+            digests += hashlib.blake2b(page, digest_size=DIGEST_SIZE).digest()
+    return bytes(digests)
 
-with open('site_backup.sql', 'w') as f:
-    for line in conn.iterdump():
-        f.write('%s\n' % line)
 
+def read_page_size(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return conn.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        conn.close()
 
-conn.close()
 
-print("SQL dump saved to site_backup.sql")
+def load_manifest(backup_dir):
+    path = os.path.join(backup_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(backup_dir, manifest, hashes):
+    with open(os.path.join(backup_dir, HASHES), 'wb') as f:
+        f.write(hashes)
+    tmp = os.path.join(backup_dir, MANIFEST + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(backup_dir, MANIFEST))
+
+
+def copy_replica(db_path, image, pages=PAGES_PER_STEP, sleep=STEP_SLEEP,
+                 max_staleness=MAX_STALENESS):
+    """Copy the database's read-only replica to image, refreshing it first if it is stale.
+
+    Returns the replica's snapshot time. Backups are built from the replica,
+    which is never written in place, so hashing and compressing them holds
+    no read transaction on the live database.
+    """
+    path = replica.path_for(db_path)
+    taken = replica.ensure_fresh(db_path, path, max_staleness, pages, sleep)
+    shutil.copyfile(path, image)
+    return taken
+
+
+def full_backup(db_path, backup_dir, pages=PAGES_PER_STEP, sleep=STEP_SLEEP,
+                max_staleness=MAX_STALENESS):
+    """Write a compressed full snapshot and start a new incremental chain."""
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+    name = f'site-{stamp}-full.db.gz'
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        image = os.path.join(tmp, 'snapshot.db')
+        taken = copy_replica(db_path, image, pages, sleep, max_staleness)
+        page_size = read_page_size(image)
+        hashes = page_hashes(image, page_size)
+        with open(image, 'rb') as src, gzip.open(os.path.join(backup_dir, name), 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    page_count = len(hashes) // DIGEST_SIZE
+    manifest = {
+        'page_size': page_size,
+        'chain': [{'file': name, 'kind': 'full', 'created': stamp, 'data_as_of': replica.isoformat(taken),
+                   'page_count': page_count, 'pages_written': page_count}],
+    }
+    save_manifest(backup_dir, manifest, hashes)
+    return manifest['chain'][-1]
+
+
+def incremental_backup(db_path, backup_dir, pages=PAGES_PER_STEP, sleep=STEP_SLEEP,
+                       max_staleness=MAX_STALENESS):
+    """Ship only the pages that changed since the last backup in the chain."""
+    manifest = load_manifest(backup_dir)
+    if manifest is None:
+        return full_backup(db_path, backup_dir, pages, sleep, max_staleness)
+    with open(os.path.join(backup_dir, HASHES), 'rb') as f:
+        previous = f.read()
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+    name = f"site-{stamp}-incr{len(manifest['chain']):04d}.pages.gz"
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        image = os.path.join(tmp, 'snapshot.db')
+        taken = copy_replica(db_path, image, pages, sleep, max_staleness)
+        page_size = read_page_size(image)
+        if page_size != manifest['page_size']:
+            # A VACUUM changed the page size; page diffs no longer line up.
+            return full_backup(db_path, backup_dir, pages, sleep, max_staleness)
+        hashes = page_hashes(image, page_size)
+        written = 0
+        with open(image, 'rb') as src, gzip.open(os.path.join(backup_dir, name), 'wb') as dst:
+            for number in range(len(hashes) // DIGEST_SIZE):
+                offset = number * DIGEST_SIZE
+                if hashes[offset:offset + DIGEST_SIZE] == previous[offset:offset + DIGEST_SIZE]:
+                    continue
+                src.seek(number * page_size)
+                dst.write(PAGE_RECORD.pack(number))
+                dst.write(src.read(page_size))
+                written += 1
+    entry = {'file': name, 'kind': 'incremental', 'created': stamp, 'data_as_of': replica.isoformat(taken),
+             'page_count': len(hashes) // DIGEST_SIZE, 'pages_written': written}
+    manifest['chain'].append(entry)
+    save_manifest(backup_dir, manifest, hashes)
+    return entry
+
+
+def check_restore_target(target_path):
+    """Refuse a target that is in use: a WAL or shared-memory file beside it,
+    or a connection holding a lock on it. A stale WAL would be replayed onto
+    the restored image and corrupt it."""
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(target_path + suffix):
+            raise SystemExit(f'{target_path}{suffix} exists; stop the app and checkpoint or remove it first')
+    if not os.path.exists(target_path):
+        return
+    conn = sqlite3.connect(target_path, timeout=0, isolation_level=None)
+    try:
+        conn.execute('BEGIN EXCLUSIVE')
+        conn.execute('ROLLBACK')
+    except sqlite3.OperationalError:
+        raise SystemExit(f'{target_path} is in use; stop the app first') from None
+    finally:
+        conn.close()
+
+
+def restore(backup_dir, target_path):
+    """Rebuild a database file from the full snapshot plus every incremental after it.
+
+    The image is built beside target_path and renamed over it once complete,
+    so an interrupted restore never leaves a half-written database.
+    """
+    manifest = load_manifest(backup_dir)
+    if manifest is None:
+        raise SystemExit(f'No backups found in {backup_dir}')
+    check_restore_target(target_path)
+    page_size = manifest['page_size']
+    full, *incrementals = manifest['chain']
+    image = target_path + '.restore'
+    with gzip.open(os.path.join(backup_dir, full['file']), 'rb') as src, open(image, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    with open(image, 'r+b') as dst:
+        for entry in incrementals:
+            with gzip.open(os.path.join(backup_dir, entry['file']), 'rb') as src:
+                while True:
+                    header = src.read(PAGE_RECORD.size)
+                    if not header:
+                        break
+                    (number,) = PAGE_RECORD.unpack(header)
+                    dst.seek(number * page_size)
+                    dst.write(src.read(page_size))
+            dst.truncate(entry['page_count'] * page_size)
+        dst.flush()
+        os.fsync(dst.fileno())
+    check_restore_target(target_path)
+    os.replace(image, target_path)
+    return manifest['chain'][-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up the survey database without blocking the app.')
+    parser.add_argument('mode', nargs='?', choices=['full', 'incremental', 'restore'], default='full')
+    parser.add_argument('--db', help=f'database to back up (default: {DB_PATH}), or to restore into '
+                                     '(required: restore replaces it)')
+    parser.add_argument('--backup-dir', default=BACKUP_DIR)
+    parser.add_argument('--pages-per-step', type=int, default=PAGES_PER_STEP,
+                        help='pages copied before yielding to writers')
+    parser.add_argument('--sleep', type=float, default=STEP_SLEEP,
+                        help='seconds to pause between steps')
+    parser.add_argument('--max-staleness', type=float, default=MAX_STALENESS,
+                        help='reuse the replica if it is at most this many seconds old '
+                             '(default: always refresh it)')
+    args = parser.parse_args()
+    if args.db is None:
+        if args.mode == 'restore':
+            parser.error('restore needs an explicit --db to write to')
+        args.db = DB_PATH
+
+    start = time.perf_counter()
+    if args.mode == 'restore':
+        entry = restore(args.backup_dir, args.db)
+        print(f"Restored {args.db} up to {entry['file']} in {time.perf_counter() - start:.1f}s")
+        return
+    if args.mode == 'full':
+        entry = full_backup(args.db, args.backup_dir, args.pages_per_step, args.sleep, args.max_staleness)
+    else:
+        entry = incremental_backup(args.db, args.backup_dir, args.pages_per_step, args.sleep, args.max_staleness)
+    size = os.path.getsize(os.path.join(args.backup_dir, entry['file']))
+    print(f"{entry['kind'].capitalize()} backup saved to {os.path.join(args.backup_dir, entry['file'])}: "
+          f"{entry['pages_written']} of {entry['page_count']} pages, {size / 1024:.0f} KiB "
+          f"in {time.perf_counter() - start:.1f}s (data as of {entry['data_as_of']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,147 @@
-import sqlite3
-import pandas as pd
+import argparse
+import re
+import time
+from datetime import datetime
 
+from openpyxl import Workbook
 
-db_path = 'instance/site.db'
+import replica
+from models import HECTARE_SCALE
 
 
-conn = sqlite3.connect(db_path)
+DB_PATH = 'instance/site.db'
+EXCEL_FILE = 'site_data.xlsx'
+CHUNK_SIZE = 5000
+# Excel caps a worksheet at 1,048,576 rows; leave room for the header.
+MAX_SHEET_ROWS = 1048575
+INFO_SHEET = 'export_info'
+# Survey areas are stored in hundredths of a hectare; the workbook shows
+# hectares. Archived years live in survey_<year>.
+SURVEY_TABLE = re.compile(r'survey(_\d{4})?$')
+SURVEY_KEYS = ('id', 'user_id', 'demographic_id', 'timestamp')
 
 
-table_query = "SELECT name FROM sqlite_master WHERE type='table';"
-tables = pd.read_sql_query(table_query, conn)
+def list_tables(conn):
+    rows = conn.execute("SELECT name, sql FROM sqlite_master WHERE type='table' ORDER BY name").fetchall()
+    # Virtual tables such as the search index, and the shadow tables holding
+    # their data, are derived from the others and not worth a sheet.
+    virtual = tuple(name + '_' for name, sql in rows if (sql or '').upper().startswith('CREATE VIRTUAL TABLE'))
+    return [name for name, sql in rows
+            if not name.startswith('sqlite_') and not name.startswith(virtual) and name + '_' not in virtual]
 
 
-excel_file = 'site_data.xlsx'
-with pd.ExcelWriter(excel_file) as writer:
-    for table_name in tables['name']:
-        
-        if table_name.startswith('sqlite_'):
-            continue
-        
-        df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
-    
-        df.to_excel(writer, sheet_name=table_name, index=False)
+def table_columns(conn, table_name):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
 
 
-conn.close()
+def hectare_positions(table_name, columns):
+    """Indexes of the area columns in a survey table's rows; empty for other tables."""
+    if not SURVEY_TABLE.match(table_name):
+        return []
+    return [i for i, name in enumerate(columns) if name not in SURVEY_KEYS]
 
-print(f"Data has been exported to {excel_file}")
 
+def stream_rows(conn, table_name, since=None, chunk_size=CHUNK_SIZE):
+    """Yield the rows of a table a chunk at a time instead of loading it whole."""
+    query = f'SELECT * FROM "{table_name}"'
+    params = ()
+    if since is not None:
+        query += ' WHERE timestamp > ?'
+        params = (since.isoformat(sep=' '),)
+    cursor = conn.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def export(db_path=DB_PATH, excel_file=EXCEL_FILE, since=None, chunk_size=CHUNK_SIZE,
+           max_staleness=replica.DEFAULT_MAX_STALENESS):
+    """Write every table to its own sheet through a write-only workbook.
+
+    Rows are read from the database's replica, refreshed first if it is older
+    than max_staleness seconds, and go straight from the cursor to disk, so
+    memory stays flat however large the survey tables grow. With since set,
+    timestamped tables only export rows newer than it; the other tables are
+    exported in full. The first sheet records when the data was copied.
+    Returns ({table_name: row_count}, snapshot time).
+    """
+    path = replica.path_for(db_path)
+    taken = replica.ensure_fresh(db_path, path, max_staleness)
+    conn = replica.connect(path)
+    workbook = Workbook(write_only=True)
+    counts = {}
+    try:
+        info = workbook.create_sheet(title=INFO_SHEET)
+        info.append(['data_as_of', replica.isoformat(taken)])
+        info.append(['exported_at', replica.isoformat(time.time())])
+        if since is not None:
+            info.append(['since', since.isoformat(sep=' ')])
+        for table_name in list_tables(conn):
+            columns = table_columns(conn, table_name)
+            table_since = since if 'timestamp' in columns else None
+            areas = hectare_positions(table_name, columns)
+            sheet = None
+            sheet_rows = 0
+            sheet_number = 1
+            count = 0
+            for row in stream_rows(conn, table_name, table_since, chunk_size):
+                if sheet is None or sheet_rows == MAX_SHEET_ROWS:
+                    title = table_name if sheet_number == 1 else f'{table_name[:27]}_{sheet_number}'
+                    sheet = workbook.create_sheet(title=title)
+                    sheet.append(columns)
+                    sheet_rows = 0
+                    sheet_number += 1
+                if areas:
+                    row = list(row)
+                    for i in areas:
+                        if row[i] is not None:
+                            row[i] /= HECTARE_SCALE
+                sheet.append(row)
+                sheet_rows += 1
+                count += 1
+            if sheet is None:
+                workbook.create_sheet(title=table_name).append(columns)
+            counts[table_name] = count
+        workbook.save(excel_file)
+    finally:
+        conn.close()
+    return counts, taken
+
+
+def delta_file(since):
+    """Default workbook for a --since export, kept apart from the full EXCEL_FILE."""
+    stamp = since.strftime('%Y-%m-%d' if since.time() == datetime.min.time() else '%Y-%m-%dT%H%M%S')
+    return f'site_data-since-{stamp}.xlsx'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the survey database to an Excel workbook.')
+    parser.add_argument('--db', default=DB_PATH, help='path to the SQLite database')
+    parser.add_argument('--output', help=f'workbook to write (default: {EXCEL_FILE}, or '
+                                         'site_data-since-<date>.xlsx with --since)')
+    parser.add_argument('--since', type=datetime.fromisoformat,
+                        help='only export survey/crops rows with a timestamp after this ISO date/time')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--max-staleness', type=float, default=replica.DEFAULT_MAX_STALENESS,
+                        help='refresh the replica first if it is older than this many seconds')
+    args = parser.parse_args()
+    if args.output is None:
+        # A delta must never replace the full export under the same name.
+        args.output = EXCEL_FILE if args.since is None else delta_file(args.since)
+
+    start = time.perf_counter()
+    counts, taken = export(args.db, args.output, args.since, args.chunk_size, args.max_staleness)
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+
+    for table_name, count in counts.items():
+        print(f"{table_name}: {count} rows")
+    print(f"Data has been exported to {args.output} "
+          f"({total} rows in {elapsed:.1f}s, {total / elapsed if elapsed else 0:.0f} rows/sec, "
+          f"data as of {replica.isoformat(taken)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, HiddenField, PasswordField, SelectField, FloatField, SelectMultipleField, SubmitField, BooleanField
-from wtforms.validators import DataRequired, Email, EqualTo, Optional
-from wtforms.widgets import ListWidget, CheckboxInput
+from wtforms.validators import DataRequired, Email, EqualTo, Optional, ValidationError
+from wtforms.widgets import CheckboxInput
+from fragments import CachedSelect, CachedListWidget
 
 
 class RegistrationForm(FlaskForm):
@@ -33,7 +34,7 @@ class DemographicForm(FlaskForm):
                            choices=[('wc', 'Western Cape'), ('ec', 'Eastern Cape'), ('nc', 'Northern Cape'), 
                                     ('gp', 'Gauteng'), ('kzn', 'KwaZulu-Natal'), ('fs', 'Free State'),
                                     ('lp', 'Limpopo'), ('mp', 'Mpumalanga'), ('nw', 'North West')],
-                           validators=[DataRequired()])
+                           validators=[DataRequired()], widget=CachedSelect())
     
     district = SelectField('District/Metropolitan Municipality', 
                            choices=[
@@ -43,7 +44,7 @@ class DemographicForm(FlaskForm):
                                ('eden', 'Garden Route District Municipality'),
                                ('overberg', 'Overberg District Municipality'),
                                ('west_coast', 'West Coast District Municipality')],
-                           validators=[DataRequired()])
+                           validators=[DataRequired()], widget=CachedSelect())
     
     municipality = SelectField('Local Municipality',
                                choices=[
@@ -79,7 +80,7 @@ class DemographicForm(FlaskForm):
                                    ('saldanha_bay', 'Saldanha Bay Local Municipality'),
                                    ('swartland', 'Swartland Local Municipality')
                                ],
-                               validators=[DataRequired()])
+                               validators=[DataRequired()], widget=CachedSelect())
     
     agricultural_activity = SelectMultipleField(
         'Agricultural activity(ies) of this farm/forest/fisheries operation',
@@ -97,7 +98,7 @@ class DemographicForm(FlaskForm):
         ],
         validators=[Optional()],
         option_widget=CheckboxInput(), 
-        widget=ListWidget(prefix_label=False)
+        widget=CachedListWidget(prefix_label=False)
     )
     
     other_agricultural_activity = StringField('If Other, please specify:', validators=[Optional()])
@@ -113,40 +114,47 @@ class DemographicForm(FlaskForm):
                                                  ('animal_farming', 'Farming/raising of animals (excluding wild animals) and poultry production'),
                                                  ('seed', 'Production of seed')],
                                         validators=[Optional()],
-                                        option_widget=CheckboxInput(), widget=ListWidget(prefix_label=False))
+                                        option_widget=CheckboxInput(), widget=CachedListWidget(prefix_label=False))
     
     submit = SubmitField('Next')
 
+MAX_HECTARES = 10_000_000
+
+def hectares(form, field):
+    """Areas are stored as integer hundredths of a hectare, so they must be finite and in range."""
+    if field.data is not None and not 0 <= field.data <= MAX_HECTARES:
+        raise ValidationError(f'Enter an area between 0 and {MAX_HECTARES:,} hectares.')
+
 class SurveyForm(FlaskForm):
-    crops_own = FloatField('Own (Area in hectares) - Crops', validators=[Optional()])
-    crops_govt = FloatField('Lease/rent from government (Area in hectares) - Crops', validators=[Optional()])
-    crops_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Crops', validators=[Optional()])
-    crops_other = FloatField('Lease/rent from other (Area in hectares) - Crops', validators=[Optional()])
-    
-    pastures_own = FloatField('Own (Area in hectares) - Pastures', validators=[Optional()])
-    pastures_govt = FloatField('Lease/rent from government (Area in hectares) - Pastures', validators=[Optional()])
-    pastures_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Pastures', validators=[Optional()])
-    pastures_other = FloatField('Lease/rent from other (Area in hectares) - Pastures', validators=[Optional()])
-    
-    greenhouses_own = FloatField('Own (Area in hectares) - Greenhouses', validators=[Optional()])
-    greenhouses_govt = FloatField('Lease/rent from government (Area in hectares) - Greenhouses', validators=[Optional()])
-    greenhouses_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Greenhouses', validators=[Optional()])
-    greenhouses_other = FloatField('Lease/rent from other (Area in hectares) - Greenhouses', validators=[Optional()])
-    
-    natural_forest_own = FloatField('Own (Area in hectares) - Natural forest', validators=[Optional()])
-    natural_forest_govt = FloatField('Lease/rent from government (Area in hectares) - Natural forest', validators=[Optional()])
-    natural_forest_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Natural forest', validators=[Optional()])
-    natural_forest_other = FloatField('Lease/rent from other (Area in hectares) - Natural forest', validators=[Optional()])
-    
-    woodland_own = FloatField('Own (Area in hectares) - Woodland', validators=[Optional()])
-    woodland_govt = FloatField('Lease/rent from government (Area in hectares) - Woodland', validators=[Optional()])
-    woodland_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Woodland', validators=[Optional()])
-    woodland_other = FloatField('Lease/rent from other (Area in hectares) - Woodland', validators=[Optional()])
-    
-    forest_plantations_own = FloatField('Own (Area in hectares) - Forest plantations', validators=[Optional()])
-    forest_plantations_govt = FloatField('Lease/rent from government (Area in hectares) - Forest plantations', validators=[Optional()])
-    forest_plantations_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Forest plantations', validators=[Optional()])
-    forest_plantations_other = FloatField('Lease/rent from other (Area in hectares) - Forest plantations', validators=[Optional()])
+    crops_own = FloatField('Own (Area in hectares) - Crops', validators=[Optional(), hectares])
+    crops_govt = FloatField('Lease/rent from government (Area in hectares) - Crops', validators=[Optional(), hectares])
+    crops_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Crops', validators=[Optional(), hectares])
+    crops_other = FloatField('Lease/rent from other (Area in hectares) - Crops', validators=[Optional(), hectares])
+    
+    pastures_own = FloatField('Own (Area in hectares) - Pastures', validators=[Optional(), hectares])
+    pastures_govt = FloatField('Lease/rent from government (Area in hectares) - Pastures', validators=[Optional(), hectares])
+    pastures_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Pastures', validators=[Optional(), hectares])
+    pastures_other = FloatField('Lease/rent from other (Area in hectares) - Pastures', validators=[Optional(), hectares])
+    
+    greenhouses_own = FloatField('Own (Area in hectares) - Greenhouses', validators=[Optional(), hectares])
+    greenhouses_govt = FloatField('Lease/rent from government (Area in hectares) - Greenhouses', validators=[Optional(), hectares])
+    greenhouses_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Greenhouses', validators=[Optional(), hectares])
+    greenhouses_other = FloatField('Lease/rent from other (Area in hectares) - Greenhouses', validators=[Optional(), hectares])
+    
+    natural_forest_own = FloatField('Own (Area in hectares) - Natural forest', validators=[Optional(), hectares])
+    natural_forest_govt = FloatField('Lease/rent from government (Area in hectares) - Natural forest', validators=[Optional(), hectares])
+    natural_forest_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Natural forest', validators=[Optional(), hectares])
+    natural_forest_other = FloatField('Lease/rent from other (Area in hectares) - Natural forest', validators=[Optional(), hectares])
+    
+    woodland_own = FloatField('Own (Area in hectares) - Woodland', validators=[Optional(), hectares])
+    woodland_govt = FloatField('Lease/rent from government (Area in hectares) - Woodland', validators=[Optional(), hectares])
+    woodland_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Woodland', validators=[Optional(), hectares])
+    woodland_other = FloatField('Lease/rent from other (Area in hectares) - Woodland', validators=[Optional(), hectares])
+    
+    forest_plantations_own = FloatField('Own (Area in hectares) - Forest plantations', validators=[Optional(), hectares])
+    forest_plantations_govt = FloatField('Lease/rent from government (Area in hectares) - Forest plantations', validators=[Optional(), hectares])
+    forest_plantations_traditional = FloatField('Lease/rent from traditional administration (Area in hectares) - Forest plantations', validators=[Optional(), hectares])
+    forest_plantations_other = FloatField('Lease/rent from other (Area in hectares) - Forest plantations', validators=[Optional(), hectares])
     
    
     submit = SubmitField('Submit')
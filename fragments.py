@@ -0,0 +1,99 @@
+"""Form widgets that reuse the markup of their choice lists.
+
+A choice list looks the same for every respondent; only which options are
+selected differs. These widgets render each option once per process in both
+its selected and unselected state, through the stock WTForms widgets so the
+markup is identical, and afterwards only join the cached strings. The
+surrounding tag and every other field, the CSRF token included, are still
+rendered per request.
+
+Widget instances are created with the form class, so a widget together with
+the field's id, name and choices identifies the cached markup.
+"""
+from markupsafe import Markup
+from wtforms.widgets import ListWidget, Select, html_params
+
+MAX_ENTRIES = 256
+
+_options = {}
+
+
+def _cached(key, build):
+    options = _options.get(key)
+    if options is None:
+        if len(_options) >= MAX_ENTRIES:
+            _options.clear()
+        options = _options[key] = build()
+    return options
+
+
+def _choices(field):
+    """The field's (value, label, selected) triples, or None if an option has its own render_kw."""
+    choices = []
+    for value, label, selected, render_kw in field.iter_choices():
+        if render_kw:
+            return None
+        choices.append((value, label, selected))
+    return choices
+
+
+class CachedSelect(Select):
+    """A Select whose <option> markup is rendered once and reused."""
+
+    def __call__(self, field, **kwargs):
+        choices = None if field.has_groups() else _choices(field)
+        if choices is None:
+            return super().__call__(field, **kwargs)
+        kwargs.setdefault('id', field.id)
+        if self.multiple:
+            kwargs['multiple'] = True
+        flags = getattr(field, 'flags', {})
+        for k in dir(flags):
+            if k in self.validation_attrs and k not in kwargs:
+                kwargs[k] = getattr(flags, k)
+
+        def build():
+            return [(self.render_option(value, label, False), self.render_option(value, label, True))
+                    for value, label, _ in choices]
+
+        key = (self, tuple((value, label) for value, label, _ in choices))
+        options = _cached(key, build)
+        html = [f'<select {html_params(name=field.name, **kwargs)}>']
+        html.extend(option[selected] for option, (_, _, selected) in zip(options, choices))
+        html.append('</select>')
+        return Markup(''.join(html))
+
+
+class CachedListWidget(ListWidget):
+    """A ListWidget for checkbox and radio choices whose <li> items are rendered once and reused.
+
+    Building the list normally creates and renders a throwaway subfield per
+    option on every request.
+    """
+
+    def __call__(self, field, **kwargs):
+        choices = _choices(field)
+        if choices is None:
+            return super().__call__(field, **kwargs)
+        kwargs.setdefault('id', field.id)
+
+        def build():
+            items = []
+            for subfield in field:
+                subfield.checked = False
+                plain = self._item(subfield)
+                subfield.checked = True
+                items.append((plain, self._item(subfield)))
+            return items
+
+        key = (self, field.id, field.name, tuple((value, label) for value, label, _ in choices))
+        items = _cached(key, build)
+        html = [f'<{self.html_tag} {html_params(**kwargs)}>']
+        html.extend(item[selected] for item, (_, _, selected) in zip(items, choices))
+        html.append(f'</{self.html_tag}>')
+        return Markup(''.join(html))
+
+    def _item(self, subfield):
+        if self.prefix_label:
+            return f'<li>{subfield.label} {subfield()}</li>'
+        return f'<li>{subfield()} {subfield.label}</li>'
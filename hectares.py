@@ -0,0 +1,73 @@
+"""Migrate survey areas from NUMERIC hectares to integer hundredths.
+
+Survey tables created before areas became integer hundredths of a hectare
+hold NUMERIC hectares, which SQLite keeps as REAL or INTEGER depending on
+the value and SQLAlchemy reads back as Decimal, and lack the
+forest_plantations_* columns. SQLite cannot change a column's type in
+place, so each table (survey and its yearly archives) is rebuilt with the
+current schema: renamed aside, recreated, copied across with every area
+multiplied by HECTARE_SCALE, and the old copy dropped. All of the tables
+change in one transaction, so readers see either the old schema or the new.
+
+Submissions wait for the write lock while a table is copied, so run it in a
+quiet period:
+
+    python hectares.py migrate
+"""
+import sys
+
+from sqlalchemy import Integer, inspect
+
+import archive
+from models import db, Survey, HECTARE_COLUMNS, HECTARE_SCALE
+
+
+def _migrated(connection, name):
+    columns = {column['name']: column['type'] for column in inspect(connection).get_columns(name)}
+    return all(isinstance(columns.get(column), Integer) for column, _, _ in HECTARE_COLUMNS)
+
+
+def _rebuild(connection, table):
+    old = f'{table.name}_numeric'
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    for index in inspect(connection).get_indexes(table.name):
+        connection.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+    connection.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{old}"')
+    table.create(connection)
+    values = {name: f'CAST(ROUND(COALESCE({name}, 0) * {HECTARE_SCALE}) AS INTEGER)' if name in existing else '0'
+              for name, _, _ in HECTARE_COLUMNS}
+    # Any other column the old table has (demographic_id, say) copies as it is.
+    values.update((column.name, column.name) for column in table.columns
+                  if column.name in existing and column.name not in values)
+    connection.exec_driver_sql(f'INSERT INTO "{table.name}" ({", ".join(values)}) '
+                               f'SELECT {", ".join(values.values())} FROM "{old}"')
+    connection.exec_driver_sql(f'DROP TABLE "{old}"')
+
+
+def migrate():
+    """Rebuild every survey table still on NUMERIC areas. Returns the names of the tables rebuilt."""
+    connection = db.session.connection()
+    names = [Survey.__tablename__] + archive.archive_names(connection, Survey.__table__)
+    pending = [name for name in names if not _migrated(connection, name)]
+    if not pending:
+        return []
+    if connection.dialect.name == 'sqlite':
+        # pysqlite only opens a transaction before DML, and this starts with DDL.
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    # The history view would stop the renames; it is recreated at the end.
+    connection.exec_driver_sql(f'DROP VIEW IF EXISTS {archive.history(Survey.__tablename__)}')
+    for name in pending:
+        table = Survey.__table__ if name == Survey.__tablename__ else archive.archive_table(Survey.__table__, name)
+        _rebuild(connection, table)
+    archive.create_views(connection)
+    db.session.commit()
+    return pending
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['migrate']:
+        sys.exit('usage: python hectares.py migrate')
+    from app import app
+    with app.app_context():
+        rebuilt = migrate()
+        print(f"Rebuilt {', '.join(rebuilt)}" if rebuilt else "Survey areas are already integer hundredths")
@@ -0,0 +1,186 @@
+"""Bulk ingestion of respondent bundles collected offline by field enumerators.
+
+A bundle is one respondent's answers to any of the three questionnaires:
+
+    {"idempotency_key": "tablet-7/0042",
+     "demographic": {"registered_name": "...", "province": "wc", ...},
+     "survey": {"crops_own": 12.5, ...},
+     "field_horticultural_crops": {"water_supply": ["River", "Dam"], ...}}
+
+Each section is validated with the same WTForms class as the HTML page.
+Valid bundles are written with executemany inserts, a chunk of bundles per
+transaction. One enumerator account uploads many respondents, so a bundle's
+survey and crops rows point at the demographics row stored with them
+(demographic_id) rather than leaving readers to guess from the account's
+latest one; a bundle without demographics is linked to the latest, as on
+the questionnaire pages. A bundle whose idempotency key was already accepted for this
+user is reported as a duplicate rather than stored twice, so a device can
+safely resend a whole batch after a dropped connection.
+"""
+import json
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+
+import rollups
+from models import db, Demographic, IngestionKey
+from responses import SECTIONS
+
+CHUNK_SIZE = 500
+MAX_KEY_LENGTH = 100
+
+
+def parse_bundles(body, content_type=''):
+    """Decode an NDJSON body, a JSON array, or {"records": [...]}; raises ValueError."""
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    if 'ndjson' in content_type or 'jsonlines' in content_type:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('records')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array of records or NDJSON')
+    return data
+
+
+def _formdata(section):
+    pairs = []
+    for name, value in section.items():
+        for item in value if isinstance(value, list) else [value]:
+            if item is not None:
+                pairs.append((name, str(item)))
+    return MultiDict(pairs)
+
+
+def validate_bundle(bundle, forms=None):
+    """Return ({section: column values}, errors) for one bundle.
+
+    forms may hold one reusable form instance per section; binding fields is
+    most of the cost of building a form, so bulk callers reprocess the same
+    instances instead of constructing new ones for every record.
+    """
+    if not isinstance(bundle, dict):
+        return {}, {'bundle': ['Each record must be a JSON object.']}
+    if forms is None:
+        forms = section_forms()
+    values = {}
+    errors = {}
+    key = bundle.get('idempotency_key')
+    if key is not None and (not isinstance(key, str) or not 0 < len(key) <= MAX_KEY_LENGTH):
+        errors['idempotency_key'] = [f'Must be a string of 1 to {MAX_KEY_LENGTH} characters.']
+    for section, (_, _, build) in SECTIONS.items():
+        data = bundle.get(section)
+        if data is None:
+            continue
+        if not isinstance(data, dict):
+            errors[section] = ['Must be a JSON object.']
+            continue
+        form = forms[section]
+        form.process(formdata=_formdata(data))
+        if form.validate():
+            values[section] = build(form)
+        else:
+            errors[section] = form.errors
+    if not values and not errors:
+        errors['bundle'] = [f"Provide at least one of: {', '.join(SECTIONS)}."]
+    return values, errors
+
+
+def section_forms():
+    return {section: form_class(formdata=None, meta={'csrf': False})
+            for section, (form_class, _, _) in SECTIONS.items()}
+
+
+def ingest(bundles, user_id, chunk_size=CHUNK_SIZE):
+    """Validate and store bundles for user_id; returns one result dict per bundle."""
+    results = [None] * len(bundles)
+    pending = []
+    forms = section_forms()
+    for index, bundle in enumerate(bundles):
+        values, errors = validate_bundle(bundle, forms)
+        key = bundle.get('idempotency_key') if isinstance(bundle, dict) else None
+        if errors:
+            results[index] = {'index': index, 'idempotency_key': key, 'status': 'invalid', 'errors': errors}
+        else:
+            pending.append((index, key, values))
+
+    seen = set()
+    latest = {}
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        try:
+            _store_chunk(chunk, user_id, results, seen, latest)
+        except IntegrityError:
+            # A concurrent retry claimed one of our keys first; recheck and go again.
+            db.session.rollback()
+            try:
+                _store_chunk(chunk, user_id, results, seen, latest)
+            except IntegrityError:
+                # Still racing another upload of the same keys: report the
+                # keyed bundles as duplicates and store only the rest.
+                db.session.rollback()
+                for index, key, _ in chunk:
+                    if key is not None:
+                        results[index] = {'index': index, 'idempotency_key': key, 'status': 'duplicate'}
+                unkeyed = [item for item in chunk if item[1] is None]
+                if unkeyed:
+                    _store_chunk(unkeyed, user_id, results, seen, latest)
+    return results
+
+
+def _store_chunk(chunk, user_id, results, seen, latest):
+    keys = [key for _, key, _ in chunk if key is not None]
+    taken = set(db.session.scalars(
+        select(IngestionKey.key).where(IngestionKey.user_id == user_id, IngestionKey.key.in_(keys))
+    )) if keys else set()
+
+    queued = set()
+    new_keys = []
+    stored = []
+    for index, key, values in chunk:
+        if key is not None and (key in taken or key in seen or key in queued):
+            results[index] = {'index': index, 'idempotency_key': key, 'status': 'duplicate'}
+            continue
+        if key is not None:
+            queued.add(key)
+            new_keys.append({'user_id': user_id, 'key': key})
+        stored.append((index, key, values))
+
+    # Demographics go in first; their ids, in parameter order, link the rest.
+    demographics = [dict(values['demographic'], user_id=user_id) for _, _, values in stored
+                    if 'demographic' in values]
+    ids = iter(db.session.scalars(
+        insert(Demographic).returning(Demographic.id, sort_by_parameter_order=True), demographics
+    ).all() if demographics else [])
+    rows = {section: [] for section in SECTIONS if section != 'demographic'}
+    attributed = []
+    # Only kept once the chunk commits; a retried chunk gets new ids.
+    current = latest.get(user_id)
+    for _, _, values in stored:
+        if 'demographic' in values:
+            current = next(ids), values['demographic']
+        elif current is None:
+            demographic = rollups.latest_demographic(user_id)
+            current = (demographic.id if demographic is not None else None), demographic
+        demographic_id, demographic = current
+        for section in rows:
+            if section in values:
+                rows[section].append(dict(values[section], user_id=user_id, demographic_id=demographic_id))
+        if 'survey' in values:
+            attributed.append((values['survey'], demographic))
+
+    for section, (_, model, _) in SECTIONS.items():
+        if rows.get(section):
+            db.session.execute(insert(model), rows[section])
+    if new_keys:
+        db.session.execute(insert(IngestionKey), new_keys)
+    rollups.record_surveys(attributed)
+    db.session.commit()
+    if current is not None:
+        latest[user_id] = current
+
+    for index, key, _ in stored:
+        results[index] = {'index': index, 'idempotency_key': key, 'status': 'created'}
+        if key is not None:
+            seen.add(key)
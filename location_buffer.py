@@ -0,0 +1,126 @@
+import atexit
+import threading
+import time
+
+from sqlalchemy import bindparam, update
+
+from models import db, User
+from spatial import cell_for
+
+
+class LocationBuffer:
+    """Coalesces GPS fixes in memory and writes them to the user table in batches.
+
+    Only the latest fix per user is kept, so a phone pinging every few seconds
+    costs one row in the next batched UPDATE instead of a write transaction of
+    its own. The buffer is flushed every flush_interval seconds, as soon as
+    max_pending users are waiting, and once more at shutdown.
+    """
+
+    def __init__(self, app=None, user_cache=None):
+        self.app = None
+        self.user_cache = user_cache
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.counters = {
+            'pings': 0,
+            'coalesced': 0,
+            'rows_written': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+        }
+        if app is not None:
+            self.init_app(app, user_cache)
+
+    def init_app(self, app, user_cache=None):
+        self.app = app
+        if user_cache is not None:
+            self.user_cache = user_cache
+        self.flush_interval = app.config.get('LOCATION_FLUSH_INTERVAL', 5.0)
+        self.max_pending = app.config.get('LOCATION_FLUSH_SIZE', 500)
+        app.extensions['location_buffer'] = self
+        atexit.register(self.stop)
+
+    def record(self, user_id, latitude, longitude):
+        """Keep (latitude, longitude) as user_id's latest fix until the next flush."""
+        with self._lock:
+            if user_id in self._pending:
+                self.counters['coalesced'] += 1
+            self._pending[user_id] = (latitude, longitude)
+            self.counters['pings'] += 1
+            full = len(self._pending) >= self.max_pending
+        if self._thread is None:
+            self.start()
+        if full:
+            self._wake.set()
+
+    def start(self):
+        """Start the background flusher if it is not already running."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='location-buffer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the flusher and write out whatever is still pending."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            thread.join(timeout)
+        self.flush()
+
+    def flush(self):
+        """Write every pending fix in one transaction; returns the number of rows."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            table = User.__table__
+            statement = (update(table).where(table.c.id == bindparam('user_id'))
+                         .values(latitude=bindparam('lat'), longitude=bindparam('lon'),
+                                 location_cell=bindparam('cell')))
+            rows = [{'user_id': user_id, 'lat': lat, 'lon': lon, 'cell': cell_for(lat, lon)}
+                    for user_id, (lat, lon) in batch.items()]
+            try:
+                with self.app.app_context():
+                    db.session.execute(statement, rows)
+                    db.session.commit()
+            except Exception:
+                with self._lock:
+                    # Put the batch back behind any fix that arrived meanwhile.
+                    for user_id, fix in batch.items():
+                        self._pending.setdefault(user_id, fix)
+                    self.counters['failed_flushes'] += 1
+                raise
+            with self._lock:
+                self.counters['rows_written'] += len(rows)
+                self.counters['flushes'] += 1
+        if self.user_cache is not None:
+            for user_id in batch:
+                self.user_cache.invalidate(user_id)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = len(self._pending)
+        return stats
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Location flush failed; retrying in %ss', self.flush_interval)
+                time.sleep(min(self.flush_interval, 1.0))
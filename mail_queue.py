@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+import atexit
+
+
+class MailQueue:
+    """Bounded outbound mail queue drained by background worker threads.
+
+    Each worker keeps its Flask-Mail connection open while there is mail to
+    send, so a burst of OTP emails shares one SMTP connect/TLS handshake
+    instead of paying for it per message.
+    """
+
+    OVERFLOW_POLICIES = ('drop_new', 'drop_oldest', 'block')
+
+    def __init__(self, mail=None, app=None):
+        self.mail = mail
+        self.app = None
+        self._queue = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.counters = {
+            'enqueued': 0,
+            'sent': 0,
+            'retried': 0,
+            'failed': 0,
+            'dropped': 0,
+            'connections': 0,
+        }
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.maxsize = app.config.get('MAIL_QUEUE_MAXSIZE', 1000)
+        self.num_workers = app.config.get('MAIL_QUEUE_WORKERS', 2)
+        self.batch_size = app.config.get('MAIL_QUEUE_BATCH_SIZE', 50)
+        self.idle_timeout = app.config.get('MAIL_QUEUE_IDLE_TIMEOUT', 5.0)
+        self.max_retries = app.config.get('MAIL_QUEUE_MAX_RETRIES', 3)
+        self.backoff = app.config.get('MAIL_QUEUE_BACKOFF', 0.5)
+        self.overflow = app.config.get('MAIL_QUEUE_OVERFLOW', 'drop_oldest')
+        if self.overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown MAIL_QUEUE_OVERFLOW policy: {self.overflow}")
+        self._queue = queue.Queue(maxsize=self.maxsize)
+        app.extensions['mail_queue'] = self
+        atexit.register(self.stop)
+
+    def start(self):
+        """Start the worker threads if they are not already running."""
+        with self._lock:
+            if self._workers:
+                return
+            self._stopping.clear()
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._run, name=f'mail-queue-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self, timeout=10.0):
+        """Stop the workers after they have drained what is already queued."""
+        with self._lock:
+            workers, self._workers = self._workers, []
+        if not workers:
+            return
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+
+    def enqueue(self, msg):
+        """Queue a message for delivery. Returns False if it was dropped."""
+        if not self._workers:
+            self.start()
+        item = (msg, time.monotonic(), 0)
+        try:
+            if self.overflow == 'block':
+                self._queue.put(item)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow == 'drop_new':
+                self._count('dropped')
+                return False
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._count('dropped')
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._count('dropped')
+                return False
+        self._count('enqueued')
+        return True
+
+    def join(self):
+        """Block until every queued message has been sent or given up on."""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            sent = stats['sent']
+            stats['latency_avg'] = self._latency_total / sent if sent else 0.0
+            stats['latency_max'] = self._latency_max
+        stats['depth'] = self._queue.qsize() if self._queue is not None else 0
+        return stats
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            conn = None
+            last_sent = time.monotonic()
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    if self._stopping.is_set():
+                        self._close(conn)
+                        return
+                    # Give the SMTP connection back once the queue has gone quiet.
+                    if conn is not None and time.monotonic() - last_sent > self.idle_timeout:
+                        conn = self._close(conn)
+                    continue
+                last_sent = time.monotonic()
+                for item in batch:
+                    conn = self._deliver(conn, item)
+                    self._queue.task_done()
+
+    def _deliver(self, conn, item):
+        msg, enqueued_at, attempts = item
+        while True:
+            try:
+                if conn is None:
+                    conn = self.mail.connect()
+                    conn.__enter__()
+                    self._count('connections')
+                conn.send(msg)
+            except Exception as e:
+                conn = self._close(conn)
+                attempts += 1
+                if attempts > self.max_retries:
+                    self._count('failed')
+                    self.app.logger.error('Giving up on email to %s: %s', msg.recipients, e)
+                    return conn
+                self._count('retried')
+                time.sleep(self.backoff * 2 ** (attempts - 1))
+                continue
+            latency = time.monotonic() - enqueued_at
+            with self._lock:
+                self.counters['sent'] += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+            return conn
+
+    def _close(self, conn):
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except Exception:
+                pass
+        return None
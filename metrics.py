@@ -0,0 +1,218 @@
+"""Request and database instrumentation, exposed in Prometheus text format.
+
+Every request gets a small RequestMetrics object that the SQLAlchemy
+cursor hooks add their query count and time to. When the response goes
+out, the route's fixed-bucket histograms are updated in place. Histograms
+and counters are allocated once per endpoint rather than per request.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Counter:
+    __slots__ = ('name', 'help', 'value', '_lock')
+
+    def __init__(self, name, help, lock):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = lock
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+class RequestMetrics:
+    __slots__ = ('start', 'queries', 'db_seconds', 'recorded')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.recorded = False
+
+
+class _RouteMetrics:
+    __slots__ = ('latency', 'queries', 'db_seconds', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = Histogram(DB_TIME_BUCKETS)
+        self.statuses = {}
+
+
+class Metrics:
+    """Collects per-route latency and SQL statistics for a Flask app."""
+
+    _engine_hooks = None
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._counters = []
+        self._stats = []
+        self.db_queries = self.counter('db_queries_total', 'SQL statements executed.')
+        self.db_seconds = self.counter('db_query_seconds_total', 'Time spent executing SQL statements.')
+        self.db_commits = self.counter('db_commits_total', 'Database transactions committed.')
+        self.db_rollbacks = self.counter(
+            'db_rollbacks_total', 'Database transactions rolled back, including read-only ones ended at teardown.')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['metrics'] = self
+        # Engines are created lazily and per app, so listen on the Engine class.
+        # Only the most recently initialised Metrics receives the events.
+        if Metrics._engine_hooks is None:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'commit', _commit)
+            event.listen(Engine, 'rollback', _rollback)
+        Metrics._engine_hooks = self
+
+    def counter(self, name, help):
+        counter = Counter(name, help, self._lock)
+        self._counters.append(counter)
+        return counter
+
+    def register_stats(self, prefix, stats):
+        """Export the numbers returned by stats() as <prefix>_<key> gauges at scrape time."""
+        self._stats.append((prefix, stats))
+
+    def _before_request(self):
+        _current.set(RequestMetrics())
+
+    def _after_request(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        # after_request is skipped when a view raises; count those as 500s here.
+        self._record(500)
+        _current.set(None)
+
+    def _record(self, status):
+        current = _current.get()
+        if current is None or current.recorded:
+            return
+        current.recorded = True
+        elapsed = time.perf_counter() - current.start
+        rule = request.url_rule
+        endpoint = rule.endpoint if rule is not None else 'unmatched'
+        with self._lock:
+            methods = self._routes.get(endpoint)
+            if methods is None:
+                methods = self._routes[endpoint] = {}
+            route = methods.get(request.method)
+            if route is None:
+                route = methods[request.method] = _RouteMetrics()
+            route.latency.observe(elapsed)
+            route.queries.observe(current.queries)
+            route.db_seconds.observe(current.db_seconds)
+            route.statuses[status] = route.statuses.get(status, 0) + 1
+
+    def _query(self, elapsed):
+        current = _current.get()
+        if current is not None:
+            current.queries += 1
+            current.db_seconds += elapsed
+        with self._lock:
+            self.db_queries.value += 1
+            self.db_seconds.value += elapsed
+
+    def render(self):
+        """The current values in Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            routes = sorted(((endpoint, method), route) for endpoint, methods in self._routes.items()
+                            for method, route in methods.items())
+            for name, help, attr in (
+                    ('http_request_duration_seconds', 'Request latency by endpoint.', 'latency'),
+                    ('http_request_db_queries', 'SQL statements issued per request.', 'queries'),
+                    ('http_request_db_seconds', 'Time spent in SQL per request.', 'db_seconds')):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} histogram')
+                for (endpoint, method), route in routes:
+                    _render_histogram(lines, name, f'endpoint="{endpoint}",method="{method}"',
+                                      getattr(route, attr))
+            lines.append('# HELP http_requests_total Responses by endpoint and status code.')
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method), route in routes:
+                for status, count in sorted(route.statuses.items()):
+                    lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",'
+                                 f'status="{status}"}} {count}')
+            for counter in self._counters:
+                lines.append(f'# HELP {counter.name} {counter.help}')
+                lines.append(f'# TYPE {counter.name} counter')
+                lines.append(f'{counter.name} {_number(counter.value)}')
+        for prefix, stats in self._stats:
+            for key, value in sorted(stats().items()):
+                lines.append(f'# TYPE {prefix}_{key} gauge')
+                lines.append(f'{prefix}_{key} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _render_histogram(lines, name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{_number(bound)}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{labels}}} {_number(histogram.sum)}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is not None:
+        Metrics._engine_hooks._query(time.perf_counter() - start)
+
+
+def _commit(conn):
+    Metrics._engine_hooks.db_commits.inc()
+
+
+def _rollback(conn):
+    Metrics._engine_hooks.db_rollbacks.inc()
@@ -1,10 +1,18 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hasher
 from datetime import datetime
 
 db = SQLAlchemy()
 
+LAND_TYPES = ['crops', 'pastures', 'greenhouses', 'natural_forest', 'woodland', 'forest_plantations']
+TENURES = ['own', 'govt', 'traditional', 'other']
+# Survey hectare columns, e.g. ('crops_own', 'crops', 'own')
+HECTARE_COLUMNS = [(f'{land_type}_{tenure}', land_type, tenure)
+                   for land_type in LAND_TYPES for tenure in TENURES]
+# Survey areas are stored as whole hundredths of a hectare: 12.5 ha is 1250.
+HECTARE_SCALE = 100
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
@@ -13,22 +21,39 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(120), unique=True, nullable=False)
     phone_number = db.Column(db.String(20), nullable=False)
     address = db.Column(db.String(200), nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    # Grid cell of (latitude, longitude), maintained by spatial.py.
+    location_cell = db.Column(db.Integer)
     survey_responses = db.relationship('Survey', backref='user', lazy=True)
     field_horticultural_crops = db.relationship('FieldHorticulturalCrops', backref='user', lazy=True)
     demographics = db.relationship('Demographic', backref='user', lazy=True)
 
+    __table_args__ = (
+        # Covers the cell-range scan so bounding-box pruning never reads table rows.
+        db.Index('ix_user_location_cell', 'location_cell', 'latitude', 'longitude'),
+    )
+
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
+
+class UsernameCounter(db.Model):
+    base = db.Column(db.String(20), primary_key=True)
+    allocated = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"UsernameCounter('{self.base}', '{self.allocated}')"
 
 class Demographic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     registered_name = db.Column(db.String(255), nullable=False)
     province = db.Column(db.String(100), nullable=False)
     district = db.Column(db.String(100), nullable=False)
@@ -36,6 +61,9 @@ class Demographic(db.Model):
     agricultural_activity = db.Column(db.String(255), nullable=False)
     other_agricultural_activity = db.Column(db.String(255))
     farm_activity = db.Column(db.String(255))
+    # Bitmask copies of the multi-select answers; bit positions live in multiselect.py
+    agricultural_activity_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    farm_activity_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return (f"Demographic('{self.id}', '{self.user_id}', '{self.registered_name}', "
@@ -46,56 +74,105 @@ class Demographic(db.Model):
 class Survey(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    crops_own = db.Column(db.Numeric, nullable=False, default=0)
-    crops_govt = db.Column(db.Numeric, nullable=False, default=0)
-    crops_traditional = db.Column(db.Numeric, nullable=False, default=0)
-    crops_other = db.Column(db.Numeric, nullable=False, default=0)
-    pastures_own = db.Column(db.Numeric, nullable=False, default=0)
-    pastures_govt = db.Column(db.Numeric, nullable=False, default=0)
-    pastures_traditional = db.Column(db.Numeric, nullable=False, default=0)
-    pastures_other = db.Column(db.Numeric, nullable=False, default=0)
-    greenhouses_own = db.Column(db.Numeric, nullable=False, default=0)
-    greenhouses_govt = db.Column(db.Numeric, nullable=False, default=0)
-    greenhouses_traditional = db.Column(db.Numeric, nullable=False, default=0)
-    greenhouses_other = db.Column(db.Numeric, nullable=False, default=0)
-    natural_forest_own = db.Column(db.Numeric, nullable=False, default=0)
-    natural_forest_govt = db.Column(db.Numeric, nullable=False, default=0)
-    natural_forest_traditional = db.Column(db.Numeric, nullable=False, default=0)
-    natural_forest_other = db.Column(db.Numeric, nullable=False, default=0)
-    woodland_own = db.Column(db.Numeric, nullable=False, default=0)
-    woodland_govt = db.Column(db.Numeric, nullable=False, default=0)
-    woodland_traditional = db.Column(db.Numeric, nullable=False, default=0)
-    woodland_other = db.Column(db.Numeric, nullable=False, default=0)
+    # The demographics row the survey was submitted with and credited to in
+    # the rollups. An enumerator's account holds many respondents' answers,
+    # so readers follow this rather than the user's latest demographics.
+    demographic_id = db.Column(db.Integer, db.ForeignKey('demographic.id'), index=True)
+    crops_own = db.Column(db.Integer, nullable=False, default=0)
+    crops_govt = db.Column(db.Integer, nullable=False, default=0)
+    crops_traditional = db.Column(db.Integer, nullable=False, default=0)
+    crops_other = db.Column(db.Integer, nullable=False, default=0)
+    pastures_own = db.Column(db.Integer, nullable=False, default=0)
+    pastures_govt = db.Column(db.Integer, nullable=False, default=0)
+    pastures_traditional = db.Column(db.Integer, nullable=False, default=0)
+    pastures_other = db.Column(db.Integer, nullable=False, default=0)
+    greenhouses_own = db.Column(db.Integer, nullable=False, default=0)
+    greenhouses_govt = db.Column(db.Integer, nullable=False, default=0)
+    greenhouses_traditional = db.Column(db.Integer, nullable=False, default=0)
+    greenhouses_other = db.Column(db.Integer, nullable=False, default=0)
+    natural_forest_own = db.Column(db.Integer, nullable=False, default=0)
+    natural_forest_govt = db.Column(db.Integer, nullable=False, default=0)
+    natural_forest_traditional = db.Column(db.Integer, nullable=False, default=0)
+    natural_forest_other = db.Column(db.Integer, nullable=False, default=0)
+    woodland_own = db.Column(db.Integer, nullable=False, default=0)
+    woodland_govt = db.Column(db.Integer, nullable=False, default=0)
+    woodland_traditional = db.Column(db.Integer, nullable=False, default=0)
+    woodland_other = db.Column(db.Integer, nullable=False, default=0)
+    forest_plantations_own = db.Column(db.Integer, nullable=False, default=0)
+    forest_plantations_govt = db.Column(db.Integer, nullable=False, default=0)
+    forest_plantations_traditional = db.Column(db.Integer, nullable=False, default=0)
+    forest_plantations_other = db.Column(db.Integer, nullable=False, default=0)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Serves the selectin loads of a page of users' rows, and their latest first.
+        db.Index('ix_survey_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    demographic = db.relationship('Demographic')
+
     def __repr__(self):
-        return (f"Survey('{self.id}', '{self.user_id}', "
-                f"crops_own='{self.crops_own}', crops_govt='{self.crops_govt}', "
-                f"crops_traditional='{self.crops_traditional}', crops_other='{self.crops_other}', "
-                f"pastures_own='{self.pastures_own}', pastures_govt='{self.pastures_govt}', "
-                f"pastures_traditional='{self.pastures_traditional}', pastures_other='{self.pastures_other}', "
-                f"greenhouses_own='{self.greenhouses_own}', greenhouses_govt='{self.greenhouses_govt}', "
-                f"greenhouses_traditional='{self.greenhouses_traditional}', greenhouses_other='{self.greenhouses_other}', "
-                f"natural_forest_own='{self.natural_forest_own}', natural_forest_govt='{self.natural_forest_govt}', "
-                f"natural_forest_traditional='{self.natural_forest_traditional}', natural_forest_other='{self.natural_forest_other}', "
-                f"woodland_own='{self.woodland_own}', woodland_govt='{self.woodland_govt}', "
-                f"woodland_traditional='{self.woodland_traditional}', woodland_other='{self.woodland_other}', "
-                f"timestamp='{self.timestamp}')")
+        areas = ', '.join(f"{name}='{getattr(self, name)}'" for name, _, _ in HECTARE_COLUMNS)
+        return f"Survey('{self.id}', '{self.user_id}', {areas}, timestamp='{self.timestamp}')"
 
 class FieldHorticulturalCrops(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # The demographics row submitted with these answers, as on Survey.
+    demographic_id = db.Column(db.Integer, db.ForeignKey('demographic.id'), index=True)
     farming_practice = db.Column(db.String(255), nullable=False)
     water_supply = db.Column(db.String(255), nullable=False)
     irrigation_system = db.Column(db.String(255), nullable=False)
+    farming_practice_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    water_supply_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    irrigation_system_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_field_horticultural_crops_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    demographic = db.relationship('Demographic', backref='field_horticultural_crops')
+
     def __repr__(self):
         return (f"FieldHorticulturalCrops('{self.id}', '{self.user_id}', "
                 f"farming_practice='{self.farming_practice}', water_supply='{self.water_supply}', "
                 f"irrigation_system='{self.irrigation_system}', timestamp='{self.timestamp}')")
 
+class LandUseRollup(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('province', 'district', 'municipality', 'land_type', 'tenure',
+                            name='uq_land_use_rollup_group'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    province = db.Column(db.String(100), nullable=False)
+    district = db.Column(db.String(100), nullable=False)
+    municipality = db.Column(db.String(100), nullable=False)
+    land_type = db.Column(db.String(20), nullable=False)
+    tenure = db.Column(db.String(20), nullable=False)
+    total = db.Column(db.Float, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    min = db.Column(db.Float)
+    max = db.Column(db.Float)
+
+    def __repr__(self):
+        return (f"LandUseRollup('{self.province}', '{self.district}', '{self.municipality}', "
+                f"'{self.land_type}', '{self.tenure}', total='{self.total}', count='{self.count}')")
 
+class IngestionKey(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def __repr__(self):
+        return f"IngestionKey('{self.user_id}', '{self.key}', '{self.timestamp}')"
 
+class SurveyDraft(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # JSON {section: {field: [submitted values]}} for the steps answered so far.
+    answers = db.Column(db.Text, nullable=False, default='{}')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 
+    def __repr__(self):
+        return f"SurveyDraft('{self.user_id}', '{self.updated_at}')"
@@ -0,0 +1,160 @@
+"""Bitmask storage and filtering for the multi-select survey answers.
+
+Each answer keeps its comma-joined string column for display and exports,
+plus an integer mask column with one bit per choice. "Farms using drip
+irrigation and boreholes" then becomes a bitwise test on two integers rather
+than LIKE '%...%' scans over strings.
+
+Add and backfill the mask columns on an existing database with:
+
+    python multiselect.py migrate
+"""
+import sys
+
+from sqlalchemy import inspect, or_, and_, select, text
+
+from models import db, Demographic, FieldHorticulturalCrops
+
+# Bit n is VOCABULARIES[field][n]. Append new choices at the end only;
+# reordering would change the meaning of masks already stored.
+VOCABULARIES = {
+    'agricultural_activity': [
+        'farming', 'services', 'wild_farming', 'hunting', 'organic_fertiliser',
+        'forestry', 'fishing', 'fish_farming', 'processing', 'other',
+    ],
+    'farm_activity': [
+        'field_crops', 'vegetables', 'flowers', 'fruits', 'tree_nuts',
+        'spices', 'honey', 'animal_farming', 'seed',
+    ],
+    'farming_practice': [
+        'Irrigation', 'Dry land/rain-fed', 'Both irrigation and dry land/rain-fed',
+    ],
+    'water_supply': [
+        'Municipal water supply', 'Groundwater/boreholes', 'Both surface water and groundwater',
+        'River', 'Dam', 'Water boards/schemes', 'Treated wastewater', 'Rainwater harvesting',
+    ],
+    'irrigation_system': [
+        'Sprinklers', 'Micro-irrigation', 'Drip irrigation', 'Pivots', 'Canals',
+        'Flood irrigation', 'Draglines, quick-coupling lines', 'Other',
+    ],
+}
+
+MODELS = {
+    'agricultural_activity': Demographic,
+    'farm_activity': Demographic,
+    'farming_practice': FieldHorticulturalCrops,
+    'water_supply': FieldHorticulturalCrops,
+    'irrigation_system': FieldHorticulturalCrops,
+}
+
+_BITS = {field: {value: 1 << n for n, value in enumerate(values)}
+         for field, values in VOCABULARIES.items()}
+
+
+def encode(field, values):
+    """Mask for a list of selected choice values; unknown values raise ValueError."""
+    bits = _BITS[field]
+    mask = 0
+    for value in values:
+        try:
+            mask |= bits[value]
+        except KeyError:
+            raise ValueError(f"Unknown {field} choice: {value!r}") from None
+    return mask
+
+
+def decode(field, mask):
+    return [value for value, bit in _BITS[field].items() if mask & bit]
+
+
+def parse_joined(field, joined):
+    """Selected values from a legacy comma-joined string.
+
+    Values are matched whole rather than split on commas, because some
+    choices ("Draglines, quick-coupling lines") contain a comma themselves.
+    """
+    if not joined:
+        return []
+    padded = f',{joined},'
+    return [value for value in VOCABULARIES[field] if f',{value},' in padded]
+
+
+def mask_column(field):
+    return getattr(MODELS[field], f'{field}_mask')
+
+
+def matching_respondents(criteria, match='all'):
+    """Select demographics ids (one per farm answered for) whose answers include the given choices.
+
+    criteria maps a field name to a list of choice values. With match='all'
+    every listed value must be selected; with match='any' one is enough.
+    Crops answers are matched against the demographics row they were given
+    with, so an enumerator's account holding many farms cannot match on one
+    farm's activity and another farm's irrigation.
+    """
+    if match not in ('all', 'any'):
+        raise ValueError("match must be 'all' or 'any'")
+    conditions = []
+    models = set()
+    for field, values in criteria.items():
+        if field not in VOCABULARIES:
+            raise ValueError(f"Unknown multi-select field: {field}")
+        if not values:
+            continue
+        mask = encode(field, values)
+        column = mask_column(field)
+        models.add(MODELS[field])
+        if match == 'all':
+            conditions.append(column.op('&')(mask) == mask)
+        else:
+            conditions.append(column.op('&')(mask) != 0)
+    query = select(Demographic.id).distinct()
+    if FieldHorticulturalCrops in models:
+        query = query.join(FieldHorticulturalCrops, FieldHorticulturalCrops.demographic_id == Demographic.id,
+                           isouter=(match == 'any'))
+    if conditions:
+        query = query.where(and_(*conditions) if match == 'all' else or_(*conditions))
+    return query.order_by(Demographic.id)
+
+
+def migrate(batch_size=5000):
+    """Add any missing mask columns, then backfill them from the string columns."""
+    inspector = inspect(db.engine)
+    for model in (Demographic, FieldHorticulturalCrops):
+        table = model.__tablename__
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for field, owner in MODELS.items():
+            name = f'{field}_mask'
+            if owner is model and name not in existing:
+                db.session.execute(text(
+                    f'ALTER TABLE "{table}" ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0'))
+    db.session.commit()
+
+    updated = 0
+    for model in (Demographic, FieldHorticulturalCrops):
+        fields = [field for field, owner in MODELS.items() if owner is model]
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(model.id, *[getattr(model, field) for field in fields])
+                .where(model.id > last_id).order_by(model.id).limit(batch_size)).all()
+            if not rows:
+                break
+            params = [dict({f'{field}_mask': encode(field, parse_joined(field, joined))
+                            for field, joined in zip(fields, row[1:])}, id=row[0])
+                      for row in rows]
+            assignments = ', '.join(f'{field}_mask = :{field}_mask' for field in fields)
+            db.session.execute(text(f'UPDATE "{model.__tablename__}" SET {assignments} WHERE id = :id'),
+                               params)
+            db.session.commit()
+            last_id = rows[-1][0]
+            updated += len(rows)
+    return updated
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['migrate']:
+        sys.exit('usage: python multiselect.py migrate')
+    from app import app
+    with app.app_context():
+        print(f"Backfilled multi-select masks on {migrate()} rows")
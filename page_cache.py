@@ -0,0 +1,84 @@
+"""HTTP caching for pages that only depend on their template.
+
+Views decorated with page_cache.cached() answer conditional requests with
+304 Not Modified. For anonymous visitors the rendered page is also kept in
+the worker and reused; it is public with max-age PAGE_CACHE_MAX_AGE and
+varies on Cookie, so shared caches never hand a logged-in page to someone
+else. Logged-in users get the same validators on a private, no-cache
+response that is rendered for them each time. Pages carrying flashed
+messages are never stored.
+
+The ETag is a hash of the body, so every worker produces the same one.
+Last-Modified is when the worker started, because templates only change
+with a deploy.
+
+Compiled templates are also kept in a Jinja bytecode cache under
+JINJA_BYTECODE_CACHE_DIR, so a cold worker loads them instead of
+recompiling each one on first use.
+"""
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Response, request, session
+from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache
+
+
+class PageCache:
+
+    def __init__(self, app=None):
+        self.max_age = 300
+        self.started = datetime.now(timezone.utc).replace(microsecond=0)
+        self._pages = {}
+        self._lock = threading.Lock()
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_age = app.config.get('PAGE_CACHE_MAX_AGE', self.max_age)
+        directory = app.config.get('JINJA_BYTECODE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja_cache')
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(directory)}
+        app.extensions['page_cache'] = self
+
+    def cached(self, view):
+        """Decorate a view whose page depends only on its template."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if '_flashes' in session:
+                return view(*args, **kwargs)
+            if current_user.is_authenticated:
+                response = self._response(view(*args, **kwargs))
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response.make_conditional(request)
+            key = (request.endpoint, tuple(sorted(kwargs.items())))
+            page = self._pages.get(key)
+            if page is None or self.app.jinja_env.auto_reload:
+                response = self._response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                page = (response.get_data(), response.mimetype, response.get_etag()[0])
+                with self._lock:
+                    self._pages[key] = page
+            body, mimetype, etag = page
+            response = Response(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.last_modified = self.started
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return wrapper
+
+    def _response(self, rv):
+        response = self.app.make_response(rv)
+        if response.status_code == 200 and not response.is_streamed:
+            response.set_etag(hashlib.blake2b(response.get_data(), digest_size=16).hexdigest())
+            response.last_modified = self.started
+        return response
@@ -0,0 +1,107 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when a hash cannot be had in time: too many are already waiting
+    for a pool worker, the hash timed out, or a worker died."""
+
+
+class PasswordHasher:
+    """Runs password hashing in a bounded process pool.
+
+    Request threads wait on a future instead of burning CPU under the GIL,
+    and at most max_pending hashes may be queued before callers are turned
+    away. With workers set to 0 hashing runs inline, which is what scripts
+    and the shell get when init_app() has not been called.
+    """
+
+    def __init__(self, app=None):
+        self.method = 'scrypt'
+        self.workers = 0
+        self.max_pending = 64
+        self.timeout = 10.0
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._prefix = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', self.max_pending)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', self.timeout)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._prefix = None
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with a different method or cost than configured."""
+        return pwhash.split('$', 1)[0] != self.method_prefix()
+
+    def method_prefix(self):
+        # Werkzeug fills in default costs ('scrypt' -> 'scrypt:32768:8:1'), so
+        # take the canonical prefix from a real hash once.
+        if self._prefix is None:
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._prefix
+
+    def shutdown(self, wait=False):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait, cancel_futures=True)
+                self._pool = None
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        slots = self._slots
+        if not slots.acquire(timeout=self.timeout):
+            raise PasswordHasherBusy()
+        pool = future = None
+        try:
+            pool = self._executor()
+            future = pool.submit(fn, *args)
+            # The slot is held until the hash itself finishes, not until this
+            # caller stops waiting, so timed-out hashes still count as pending.
+            future.add_done_callback(lambda _: slots.release())
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            # A worker died (the OOM killer, say) and the pool refuses all
+            # further work; drop it so the next call starts a fresh one.
+            self._discard(pool)
+            raise PasswordHasherBusy() from None
+        except TimeoutError:
+            raise PasswordHasherBusy() from None
+        finally:
+            if future is None:
+                slots.release()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def _discard(self, pool):
+        with self._pool_lock:
+            # Another thread may already have replaced it.
+            if pool is not None and self._pool is pool:
+                self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,159 @@
+"""On-demand stack-sampling profiler for live requests.
+
+A request is profiled when it carries an X-Profile-Token header matching
+PROFILER_TOKEN, or when it is picked at random at PROFILER_SAMPLE_RATE. A
+sampler thread records the request thread's stack every PROFILER_INTERVAL
+seconds until the response is ready, and writes the samples in collapsed
+("folded") stack format to instance/profiles/<endpoint>/. Only the newest
+PROFILER_KEEP files per endpoint are kept.
+
+Requests that are not profiled pay for one comparison and a header lookup.
+
+Merge an endpoint's retained samples into one file for flamegraph.pl or
+speedscope with:
+
+    python profiling.py merge instance/profiles/survey > survey.folded
+"""
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+
+HEADER = 'X-Profile-Token'
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+
+class RequestProfiler:
+
+    def __init__(self, app=None):
+        self.sample_rate = 0.0
+        self.token = None
+        self.interval = 0.005
+        self.keep = 50
+        self.directory = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sample_rate = app.config.get('PROFILER_SAMPLE_RATE', self.sample_rate)
+        self.token = app.config.get('PROFILER_TOKEN', self.token)
+        self.interval = app.config.get('PROFILER_INTERVAL', self.interval)
+        self.keep = app.config.get('PROFILER_KEEP', self.keep)
+        self.directory = app.config.get('PROFILER_DIR') or os.path.join(app.instance_path, 'profiles')
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['request_profiler'] = self
+
+    def _triggered(self):
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        supplied = request.headers.get(HEADER)
+        return bool(self.token and supplied and hmac.compare_digest(supplied, self.token))
+
+    def _before_request(self):
+        if self._triggered():
+            g._profile = (StackSampler(threading.get_ident(), self.interval).start(), time.perf_counter())
+
+    def _after_request(self, response):
+        path = self._finish()
+        if path is not None and request.headers.get(HEADER):
+            response.headers['X-Profile-File'] = os.path.relpath(path, self.directory)
+        return response
+
+    def _teardown_request(self, exc):
+        self._finish()
+
+    def _finish(self):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return None
+        sampler, start = profile
+        stacks = sampler.stop()
+        rule = request.url_rule
+        endpoint = rule.endpoint if rule is not None else 'unmatched'
+        try:
+            return self._write(endpoint, stacks, time.perf_counter() - start)
+        except OSError:
+            return None
+
+    def _write(self, endpoint, stacks, elapsed):
+        directory = os.path.join(self.directory, endpoint)
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        path = os.path.join(directory, f'{stamp}-{os.getpid()}-{threading.get_ident()}.folded')
+        with open(path, 'w') as f:
+            f.write(f'# {request.method} {request.path} {elapsed * 1000:.1f}ms\n')
+            for stack, count in sorted(stacks.items()):
+                f.write(f'{stack} {count}\n')
+        self._prune(directory)
+        return path
+
+    def _prune(self, directory):
+        files = sorted(name for name in os.listdir(directory) if name.endswith('.folded'))
+        for name in files[:-self.keep]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass  # another worker pruned it first
+
+
+def merge(directory):
+    """Sum the collapsed stacks of every profile in directory."""
+    totals = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.folded'):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            for line in f:
+                if line.startswith('#') or not line.strip():
+                    continue
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                totals[stack] = totals.get(stack, 0) + int(count)
+    return totals
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'merge':
+        sys.exit('usage: python profiling.py merge <profile directory>')
+    for stack, count in sorted(merge(sys.argv[2]).items()):
+        print(f'{stack} {count}')
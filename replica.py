@@ -0,0 +1,216 @@
+"""Read-only snapshot of the live database for exports and reports.
+
+Long analyst reads against instance/site.db compete with survey commits, so
+exports and the /reports endpoints read a replica file instead. The replica
+is a consistent copy taken with SQLite's online backup API and swapped into
+place with a rename, so it is never modified in place and can be opened
+with immutable=1, skipping locking and change detection entirely, and read
+through mmap.
+
+The replica's modification time is set to the moment the copy began; its
+data is at least that fresh. The export and backup scripts refresh it first
+when it is older than their staleness bound. Web requests never copy: the
+app refreshes it from a background thread every REPLICA_REFRESH_INTERVAL
+seconds, and requests read whatever replica is there, logging and flagging
+one older than REPLICA_MAX_STALENESS. With the interval set to 0, refresh
+it from cron instead:
+
+    python replica.py refresh [--db instance/site.db]
+
+The replica lives beside the database as replica.db unless told otherwise.
+"""
+import argparse
+import atexit
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+DB_PATH = 'instance/site.db'
+DEFAULT_MAX_STALENESS = 300
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def snapshot(db_path, target_path, pages=-1, sleep=0.05):
+    """Copy a consistent image of a live database with the online backup API.
+
+    With pages set, the copy advances that many pages at a time and sleeps in
+    between, so survey submissions can take the write lock between steps
+    instead of waiting for the whole backup. Under WAL readers never block
+    the writer and the default single step is fine.
+    """
+    src = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    dst = sqlite3.connect(target_path)
+    try:
+        with dst:
+            src.backup(dst, pages=pages, sleep=sleep)
+        dst.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        dst.close()
+        src.close()
+
+
+def path_for(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'replica.db')
+
+
+def refresh(db_path, path, pages=-1, sleep=0.05):
+    """Replace the replica with a fresh copy; returns its snapshot time."""
+    started = time.time()
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    snapshot(db_path, tmp, pages, sleep)
+    os.utime(tmp, (started, started))
+    # Readers that already have the old file open keep reading it.
+    os.replace(tmp, path)
+    return started
+
+
+def snapshot_time(path):
+    """When the replica's data was copied, as a Unix time, or None if there is no replica."""
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def ensure_fresh(db_path, path=None, max_staleness=DEFAULT_MAX_STALENESS, pages=-1, sleep=0.05):
+    """Refresh the replica if it is older than max_staleness seconds; returns its snapshot time."""
+    path = path or path_for(db_path)
+    taken = snapshot_time(path)
+    if taken is not None and time.time() - taken <= max_staleness:
+        return taken
+    with open(path + '.lock', 'w') as lock:
+        # Only one process copies; the others wait and use its result.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        taken = snapshot_time(path)
+        if taken is None or time.time() - taken > max_staleness:
+            taken = refresh(db_path, path, pages, sleep)
+    return taken
+
+
+def connect(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True, check_same_thread=False)
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    return conn
+
+
+def isoformat(taken):
+    return datetime.fromtimestamp(taken, timezone.utc).isoformat(timespec='seconds')
+
+
+class Replica:
+    """Hands the app's report views a session on the replica, and keeps it refreshed."""
+
+    def __init__(self, app=None, db=None):
+        self.app = None
+        self.db = db
+        self.path = None
+        self.max_staleness = DEFAULT_MAX_STALENESS
+        self.refresh_interval = 0
+        self.engine = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self.app = app
+        self.db = db or self.db
+        self.path = app.config.get('REPLICA_PATH')
+        self.max_staleness = app.config.get('REPLICA_MAX_STALENESS', self.max_staleness)
+        self.refresh_interval = app.config.get('REPLICA_REFRESH_INTERVAL', self.refresh_interval)
+        self.engine = None
+        app.extensions['replica'] = self
+        atexit.register(self.stop)
+
+    @contextmanager
+    def session(self):
+        """A session on the replica as it stands; never refreshes it.
+
+        session.info['data_as_of'] holds the snapshot time and
+        session.info['stale'] whether it is older than max_staleness. Until a
+        replica exists, and for apps whose database is not a SQLite file, the
+        live database is read instead.
+        """
+        url = self.db.engine.url
+        if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+            yield self._live()
+            return
+        path = self.path or path_for(url.database)
+        if self.refresh_interval and self._thread is None:
+            self.start(url.database, path)
+        taken = snapshot_time(path)
+        if taken is None:
+            self.app.logger.warning('No replica at %s yet; reading the live database', path)
+            yield self._live()
+            return
+        age = time.time() - taken
+        if age > self.max_staleness:
+            self.app.logger.warning('Replica %s is %.0fs old, over the %ss bound; is it being refreshed?',
+                                    path, age, self.max_staleness)
+        if self.engine is None:
+            # No pool: every session opens whatever replica file is current.
+            self.engine = create_engine('sqlite://', creator=lambda: connect(path), poolclass=NullPool)
+        with Session(self.engine) as session:
+            session.info['data_as_of'] = isoformat(taken)
+            session.info['stale'] = age > self.max_staleness
+            yield session
+
+    def _live(self):
+        self.db.session.info['data_as_of'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.db.session.info['stale'] = False
+        return self.db.session
+
+    def start(self, db_path, path):
+        """Start the background refresher if it is not already running."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, args=(db_path, path),
+                                            name='replica-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            thread.join(timeout)
+
+    def _run(self, db_path, path):
+        while not self._stopping.is_set():
+            try:
+                # Every worker runs one of these; the lock in ensure_fresh
+                # and its staleness check leave the copying to one of them.
+                ensure_fresh(db_path, path, self.refresh_interval)
+            except Exception:
+                self.app.logger.exception('Replica refresh failed; retrying in %ss', self.refresh_interval)
+            self._stopping.wait(self.refresh_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the read-only replica of the survey database.')
+    parser.add_argument('mode', choices=['refresh'])
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--replica', help='replica file (default: replica.db beside the database)')
+    args = parser.parse_args()
+
+    path = args.replica or path_for(args.db)
+    start = time.perf_counter()
+    taken = ensure_fresh(args.db, path, max_staleness=0)
+    print(f"Replica {path} refreshed as of {isoformat(taken)} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
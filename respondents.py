@@ -0,0 +1,108 @@
+"""Admin listing of respondents' answers, newest survey first.
+
+Each entry is one submitted survey with the account that submitted it and
+the demographics and crops answers it was submitted with (an enumerator's
+account holds many farms, so these follow survey.demographic_id rather than
+the account's latest rows). Pages are keyed on the last
+(timestamp, id) seen rather than an OFFSET, so a page deep into the data
+costs the same index seek as the first one and rows submitted meanwhile
+cannot shift later pages. The related rows are loaded with selectin, one
+IN query per relationship for the whole page, so every page takes four
+queries whatever its size. Archived surveys are not listed; they live in
+survey_history.
+
+Add the indexes it relies on to an existing database with:
+
+    python respondents.py index
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect, or_, select
+from sqlalchemy.orm import selectinload
+
+from models import db, Demographic, Survey, FieldHorticulturalCrops, HECTARE_COLUMNS, HECTARE_SCALE
+
+MAX_PER_PAGE = 100
+INDEXED_TABLES = (Survey.__table__, FieldHorticulturalCrops.__table__)
+
+
+def encode_cursor(survey):
+    return f'{survey.timestamp.isoformat()},{survey.id}'
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor; raises ValueError if it is malformed."""
+    timestamp, _, survey_id = cursor.rpartition(',')
+    try:
+        return datetime.fromisoformat(timestamp), int(survey_id)
+    except ValueError:
+        raise ValueError('Invalid cursor') from None
+
+
+def page_query(cursor=None, per_page=20):
+    query = (select(Survey)
+             .options(selectinload(Survey.user),
+                      selectinload(Survey.demographic).selectinload(Demographic.field_horticultural_crops))
+             .order_by(Survey.timestamp.desc(), Survey.id.desc())
+             .limit(per_page + 1))
+    if cursor is None:
+        return query.where(Survey.timestamp.is_not(None))
+    timestamp, survey_id = decode_cursor(cursor)
+    # The redundant upper bound is what lets SQLite seek the timestamp index
+    # to the cursor; the OR alone is filtered row by row from the newest.
+    return query.where(Survey.timestamp <= timestamp,
+                       or_(Survey.timestamp < timestamp, Survey.id < survey_id))
+
+
+def _entry(survey):
+    user = survey.user
+    demographic = survey.demographic
+    answers = demographic.field_horticultural_crops if demographic is not None else []
+    return {
+        'survey_id': survey.id,
+        'timestamp': survey.timestamp.isoformat(),
+        'respondent': {'id': user.id, 'username': user.username, 'first_name': user.first_name,
+                       'surname': user.surname, 'email': user.email, 'phone_number': user.phone_number},
+        'demographic': demographic and {
+            'registered_name': demographic.registered_name, 'province': demographic.province,
+            'district': demographic.district, 'municipality': demographic.municipality,
+            'agricultural_activity': demographic.agricultural_activity,
+            'farm_activity': demographic.farm_activity},
+        'hectares': {name: getattr(survey, name) / HECTARE_SCALE for name, _, _ in HECTARE_COLUMNS},
+        'crops': [{'farming_practice': crops.farming_practice, 'water_supply': crops.water_supply,
+                   'irrigation_system': crops.irrigation_system, 'timestamp': crops.timestamp.isoformat()}
+                  for crops in sorted(answers, key=lambda row: row.id)],
+    }
+
+
+def listing(cursor=None, per_page=20, session=None):
+    """One page of entries after cursor. Returns (entries, next cursor or None)."""
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    surveys = (session or db.session).scalars(page_query(cursor, per_page)).all()
+    next_cursor = encode_cursor(surveys[per_page - 1]) if len(surveys) > per_page else None
+    return [_entry(survey) for survey in surveys[:per_page]], next_cursor
+
+
+def index():
+    """Create any of the survey and crops tables' indexes that are missing. Returns the names created."""
+    connection = db.session.connection()
+    existing = {table.name: {ix['name'] for ix in inspect(connection).get_indexes(table.name)}
+                for table in INDEXED_TABLES}
+    created = []
+    for table in INDEXED_TABLES:
+        for ix in table.indexes:
+            if ix.name not in existing[table.name]:
+                ix.create(connection)
+                created.append(ix.name)
+    db.session.commit()
+    return created
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['index']:
+        sys.exit('usage: python respondents.py index')
+    from app import app
+    with app.app_context():
+        created = index()
+        print(f"Created {', '.join(created)}" if created else 'The indexes already exist')
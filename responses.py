@@ -0,0 +1,47 @@
+"""Column values for the questionnaire models, built from validated forms.
+
+Shared by the HTML views and the bulk ingestion API so both store answers
+the same way.
+"""
+import multiselect
+from forms import DemographicForm, SurveyForm, FieldHorticulturalCropsForm
+from models import Demographic, Survey, FieldHorticulturalCrops, HECTARE_COLUMNS, HECTARE_SCALE
+
+
+def demographic_values(form):
+    return dict(
+        registered_name=form.registered_name.data,
+        province=form.province.data,
+        district=form.district.data,
+        municipality=form.municipality.data,
+        agricultural_activity=",".join(form.agricultural_activity.data),
+        other_agricultural_activity=form.other_agricultural_activity.data,
+        farm_activity=",".join(form.farm_activity.data),
+        agricultural_activity_mask=multiselect.encode('agricultural_activity', form.agricultural_activity.data),
+        farm_activity_mask=multiselect.encode('farm_activity', form.farm_activity.data),
+    )
+
+
+def survey_values(form):
+    # Areas are stored as integer hundredths of a hectare.
+    return {name: round((form[name].data or 0) * HECTARE_SCALE) for name, _, _ in HECTARE_COLUMNS}
+
+
+def field_horticultural_crops_values(form):
+    return dict(
+        farming_practice=",".join(form.farming_practice.data),
+        water_supply=",".join(form.water_supply.data),
+        irrigation_system=",".join(form.irrigation_system.data),
+        farming_practice_mask=multiselect.encode('farming_practice', form.farming_practice.data),
+        water_supply_mask=multiselect.encode('water_supply', form.water_supply.data),
+        irrigation_system_mask=multiselect.encode('irrigation_system', form.irrigation_system.data),
+    )
+
+
+# Questionnaire sections in the order a respondent answers them.
+SECTIONS = {
+    'demographic': (DemographicForm, Demographic, demographic_values),
+    'survey': (SurveyForm, Survey, survey_values),
+    'field_horticultural_crops': (FieldHorticulturalCropsForm, FieldHorticulturalCrops,
+                                  field_horticultural_crops_values),
+}
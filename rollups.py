@@ -0,0 +1,212 @@
+"""Precomputed land-use totals per municipality, land type and tenure.
+
+Rows are kept at municipality level; district and province figures are
+rolled up from them at read time, which costs O(groups) rather than a scan
+of every survey.
+
+Each survey is credited to the demographics row stored in its
+demographic_id, the one it was submitted or uploaded with, so a rebuild
+reproduces the incremental totals even for respondents who answered again
+after moving and for enumerators uploading many farms under one account.
+Surveys with no demographic_id are left out of a rebuild.
+
+Rebuild offline with:
+
+    python rollups.py rebuild
+
+Databases from before survey and crops rows recorded their demographics
+row need the column added first, once; migrate also links each old row to
+the respondent's latest demographics, so run it before a rebuild or those
+surveys are excluded:
+
+    python rollups.py migrate
+"""
+import sys
+
+from sqlalchemy import delete, func, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+import archive
+from models import db, Demographic, Survey, FieldHorticulturalCrops, LandUseRollup, HECTARE_COLUMNS, HECTARE_SCALE
+
+LEVELS = ('province', 'district', 'municipality')
+GROUP_COLUMNS = ('province', 'district', 'municipality', 'land_type', 'tenure')
+# Tables whose rows point at the demographics row they were submitted with.
+LINKED_TABLES = (Survey.__table__, FieldHorticulturalCrops.__table__)
+
+
+def latest_demographic(user_id):
+    """The respondent's most recent demographics answers, or None."""
+    return (Demographic.query.filter_by(user_id=user_id)
+            .order_by(Demographic.id.desc()).first())
+
+
+def record_survey(survey, demographic):
+    """Fold one new survey into the rollups, in the caller's transaction.
+
+    The caller stores demographic on the survey (survey.demographic) so that
+    rebuild() credits it to the same place. Only land the respondent actually reported (area > 0) is counted, so
+    count/min/max describe the farms that hold that land type and tenure.
+    """
+    record_surveys([(survey, demographic)])
+
+
+def record_surveys(pairs):
+    """Fold many (survey, demographic) pairs in with one upsert per touched group.
+
+    Surveys and demographics may be model instances or plain dicts of column values.
+    """
+    deltas = {}
+    for survey, demographic in pairs:
+        if demographic is None:
+            continue
+        place = tuple(_value(demographic, name) for name in LEVELS)
+        for column, land_type, tenure in HECTARE_COLUMNS:
+            area = (_value(survey, column) or 0) / HECTARE_SCALE
+            if area <= 0:
+                continue
+            key = place + (land_type, tenure)
+            delta = deltas.get(key)
+            if delta is None:
+                deltas[key] = dict(zip(GROUP_COLUMNS, key), total=area, count=1, min=area, max=area)
+            else:
+                delta['total'] += area
+                delta['count'] += 1
+                delta['min'] = min(delta['min'], area)
+                delta['max'] = max(delta['max'], area)
+    _upsert(list(deltas.values()))
+
+
+def _value(obj, name):
+    return obj[name] if isinstance(obj, dict) else getattr(obj, name)
+
+
+def _upsert(rows):
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        db.session.execute(_upsert_statement(dialect), rows)
+        return
+    for values in rows:
+        group = {name: values[name] for name in GROUP_COLUMNS}
+        rollup = LandUseRollup.query.filter_by(**group).with_for_update().first()
+        if rollup is None:
+            db.session.add(LandUseRollup(**values))
+            continue
+        rollup.total += values['total']
+        rollup.count += values['count']
+        rollup.min = min(rollup.min, values['min'])
+        rollup.max = max(rollup.max, values['max'])
+
+
+_upsert_statements = {}
+
+
+def _upsert_statement(dialect):
+    # Built once per dialect so the compiled form is reused for every executemany.
+    stmt = _upsert_statements.get(dialect)
+    if stmt is None:
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        least, greatest = (func.min, func.max) if dialect == 'sqlite' else (func.least, func.greatest)
+        table = LandUseRollup.__table__
+        stmt = insert(table)
+        stmt = _upsert_statements[dialect] = stmt.on_conflict_do_update(
+            index_elements=list(GROUP_COLUMNS),
+            set_={
+                'total': table.c.total + stmt.excluded.total,
+                'count': table.c.count + stmt.excluded.count,
+                'min': least(table.c.min, stmt.excluded.min),
+                'max': greatest(table.c.max, stmt.excluded.max),
+            })
+    return stmt
+
+
+def rebuild():
+    """Recompute every rollup from every survey, archived ones included. Returns the number of groups."""
+    db.session.execute(delete(LandUseRollup))
+    # Each survey is credited to the demographics row it was recorded against,
+    # as record_survey() did at submission time.
+    for column, land_type, tenure in HECTARE_COLUMNS:
+        db.session.execute(text(f"""
+            INSERT INTO land_use_rollup
+                (province, district, municipality, land_type, tenure, total, count, min, max)
+            SELECT d.province, d.district, d.municipality, :land_type, :tenure,
+                   SUM(s.{column}) / {HECTARE_SCALE}.0, COUNT(*),
+                   MIN(s.{column}) / {HECTARE_SCALE}.0, MAX(s.{column}) / {HECTARE_SCALE}.0
+            FROM {archive.history('survey')} s
+            JOIN demographic d ON d.id = s.demographic_id
+            WHERE s.{column} > 0
+            GROUP BY d.province, d.district, d.municipality
+        """), {'land_type': land_type, 'tenure': tenure})
+    db.session.commit()
+    return db.session.scalar(select(func.count()).select_from(LandUseRollup))
+
+
+def land_use_report(level='municipality', session=None, **filters):
+    """Totals per group at the requested level, rolled up from municipality rows."""
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+    keys = LEVELS[:LEVELS.index(level) + 1] + ('land_type', 'tenure')
+    query = select(LandUseRollup)
+    for name, value in filters.items():
+        if value:
+            query = query.where(getattr(LandUseRollup, name) == value)
+    groups = {}
+    for rollup in (session or db.session).scalars(query):
+        key = tuple(getattr(rollup, name) for name in keys)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = dict(zip(keys, key), total=0.0, count=0, min=None, max=None)
+        group['total'] += rollup.total
+        group['count'] += rollup.count
+        group['min'] = rollup.min if group['min'] is None else min(group['min'], rollup.min)
+        group['max'] = rollup.max if group['max'] is None else max(group['max'], rollup.max)
+    return [groups[key] for key in sorted(groups)]
+
+
+def migrate(batch_size=5000):
+    """Add demographic_id to the survey and crops tables and their archives, then link old rows.
+
+    Rows stored before the link existed are linked to their user's latest
+    demographics row, which is what every reader assumed until then. Meant
+    to be run once; running it again only finishes an interrupted backfill.
+    Returns the number of rows linked.
+    """
+    connection = db.session.connection()
+    names = []
+    for table in LINKED_TABLES:
+        for name in [table.name] + archive.archive_names(connection, table):
+            if 'demographic_id' not in {column['name'] for column in inspect(connection).get_columns(name)}:
+                connection.exec_driver_sql(f'ALTER TABLE "{name}" ADD COLUMN demographic_id INTEGER')
+            names.append(name)
+        connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{table.name}_demographic_id '
+                                   f'ON "{table.name}" (demographic_id)')
+    archive.create_views(connection)
+    db.session.commit()
+
+    linked = 0
+    for name in names:
+        top = db.session.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM "{name}"')).scalar()
+        for start in range(0, top, batch_size):
+            result = db.session.execute(text(f"""
+                UPDATE "{name}" SET demographic_id = (
+                    SELECT MAX(id) FROM demographic WHERE user_id = "{name}".user_id)
+                WHERE id > :start AND id <= :end AND demographic_id IS NULL
+                  AND EXISTS (SELECT 1 FROM demographic WHERE user_id = "{name}".user_id)"""),
+                {'start': start, 'end': start + batch_size})
+            db.session.commit()
+            linked += result.rowcount
+    return linked
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in (['rebuild'], ['migrate']):
+        sys.exit('usage: python rollups.py rebuild|migrate')
+    from app import app
+    with app.app_context():
+        if sys.argv[1] == 'migrate':
+            print(f"Linked {migrate()} survey and crops rows to their demographics")
+        else:
+            db.create_all()
+            print(f"Rebuilt {rebuild()} land-use rollup groups")
@@ -0,0 +1,154 @@
+"""Full-text respondent search on an SQLite FTS5 index.
+
+respondent_search holds one row per user, keyed by user id, with their
+names, email, address and latest registered farm name. SQL triggers on the
+user and demographic tables keep it in step with every write path, bulk
+ingest included, and db.create_all() installs it alongside the tables.
+
+Queries match every word as a prefix ("jo smi" finds John Smith) and are
+ranked with BM25, names weighted above addresses. Prefixes of up to six
+characters have their own index entries, so they are read as one term
+instead of a merge of every word they start.
+
+Create or repopulate the index on an existing database with:
+
+    python search.py rebuild
+"""
+import re
+import sys
+
+from sqlalchemy import event, text
+
+from models import db
+
+COLUMNS = ('first_name', 'surname', 'email', 'address', 'registered_name')
+# BM25 weights, in COLUMNS order.
+WEIGHTS = (10.0, 10.0, 4.0, 1.0, 6.0)
+MAX_PER_PAGE = 100
+# Matches ranked per query, newest registrations first.
+RANK_CANDIDATES = 1000
+
+_LATEST_NAME = ('(SELECT registered_name FROM demographic WHERE user_id = {row}.user_id '
+                'ORDER BY id DESC LIMIT 1)')
+
+INSTALL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS respondent_search USING fts5(
+        {', '.join(COLUMNS)}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4 5 6')""",
+    f"""INSERT INTO respondent_search (respondent_search, rank)
+        VALUES ('rank', 'bm25({", ".join(map(str, WEIGHTS))})')""",
+    """CREATE TRIGGER IF NOT EXISTS respondent_search_user_insert AFTER INSERT ON "user" BEGIN
+        INSERT INTO respondent_search (rowid, first_name, surname, email, address)
+        VALUES (new.id, new.first_name, new.surname, new.email, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS respondent_search_user_update
+    AFTER UPDATE OF first_name, surname, email, address ON "user" BEGIN
+        UPDATE respondent_search
+        SET first_name = new.first_name, surname = new.surname, email = new.email, address = new.address
+        WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS respondent_search_user_delete AFTER DELETE ON "user" BEGIN
+        DELETE FROM respondent_search WHERE rowid = old.id;
+    END""",
+] + [
+    f"""CREATE TRIGGER IF NOT EXISTS respondent_search_demographic_{action.lower()}
+    AFTER {action} ON demographic BEGIN
+        UPDATE respondent_search SET registered_name = {_LATEST_NAME.format(row=row)}
+        WHERE rowid = {row}.user_id;
+    END"""
+    for action, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old'))
+]
+UNINSTALL = [f'DROP TRIGGER IF EXISTS respondent_search_{table}_{action}'
+             for table in ('user', 'demographic') for action in ('insert', 'update', 'delete')]
+UNINSTALL.append('DROP TABLE IF EXISTS respondent_search')
+
+
+def install(connection):
+    """Create the index table and its triggers if they are missing."""
+    for statement in INSTALL:
+        connection.exec_driver_sql(statement)
+
+
+def rebuild():
+    """Refill the index from the user and demographic tables. Returns the number of rows."""
+    connection = db.session.connection()
+    install(connection)
+    connection.exec_driver_sql('DELETE FROM respondent_search')
+    connection.exec_driver_sql(f"""
+        INSERT INTO respondent_search (rowid, {', '.join(COLUMNS)})
+        SELECT u.id, u.first_name, u.surname, u.email, u.address, d.registered_name
+        FROM "user" u
+        LEFT JOIN demographic d ON d.id = (SELECT MAX(id) FROM demographic WHERE user_id = u.id)""")
+    # Merge the segments written by the bulk insert into a single b-tree.
+    connection.exec_driver_sql("INSERT INTO respondent_search (respondent_search) VALUES ('optimize')")
+    db.session.commit()
+    return db.session.execute(text('SELECT COUNT(*) FROM respondent_search')).scalar()
+
+
+def match_expression(query, column=None):
+    """An FTS5 expression requiring every word of query as a prefix, or None if it has no words.
+
+    Words are quoted, so punctuation and FTS5 operators typed by the user
+    are never interpreted.
+    """
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return None
+    expression = ' '.join(f'"{word}"*' for word in words)
+    if column is not None:
+        if column not in COLUMNS:
+            raise ValueError(f"field must be one of {', '.join(COLUMNS)}")
+        expression = f'{column} : ({expression})'
+    return expression
+
+
+def search(query, column=None, page=1, per_page=20):
+    """One page of respondents matching query, best first.
+
+    Returns (results, has_more, truncated). Only the newest RANK_CANDIDATES
+    matches are ranked and paged through; truncated says the query matched
+    more than that and should be narrowed.
+    """
+    expression = match_expression(query, column)
+    if expression is None:
+        return [], False, False
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    page = max(page, 1)
+    # BM25 costs a few microseconds per scored row, so scoring every match of
+    # a common name would take most of a second at a million users.
+    rows = db.session.execute(text(f"""
+        SELECT u.id, u.username, {', '.join(f's.{name}' for name in COLUMNS)}, p.matches
+        FROM (SELECT rowid, rank, count(*) OVER () AS matches
+              FROM (SELECT rowid, rank FROM respondent_search
+                    WHERE respondent_search MATCH :expression
+                    ORDER BY rowid DESC LIMIT :candidates)
+              ORDER BY rank LIMIT :limit OFFSET :offset) p
+        JOIN respondent_search s ON s.rowid = p.rowid
+        JOIN "user" u ON u.id = p.rowid
+        ORDER BY p.rank"""),
+        {'expression': expression, 'candidates': RANK_CANDIDATES + 1,
+         'limit': per_page + 1, 'offset': (page - 1) * per_page}).all()
+    results = [dict(zip(('id', 'username') + COLUMNS, row)) for row in rows[:per_page]]
+    truncated = bool(rows) and rows[0][-1] > RANK_CANDIDATES
+    has_more = len(rows) > per_page and page * per_page < RANK_CANDIDATES
+    return results, has_more, truncated
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _after_create(metadata, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        install(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _before_drop(metadata, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in UNINSTALL:
+            connection.exec_driver_sql(statement)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['rebuild']:
+        sys.exit('usage: python search.py rebuild')
+    from app import app
+    with app.app_context():
+        print(f"Indexed {rebuild()} respondents")
@@ -0,0 +1,164 @@
+"""Grid-cell spatial index over the respondents' GPS coordinates.
+
+The globe is cut into CELL_DEGREES squares numbered row by row from the
+south-west corner, and each user row stores the number of the cell its
+location falls in. A bounding box then covers one contiguous run of cell
+numbers per row of cells, which the B-tree index on location_cell answers as
+a handful of range scans. Only the candidates in those cells get the exact
+box test and, for radius queries, the great-circle distance.
+
+Add and backfill the index on an existing database with:
+
+    python spatial.py reindex
+"""
+import math
+import sys
+
+from sqlalchemy import event, inspect, or_, select, text, union_all
+
+from models import db, User
+
+CELL_DEGREES = 0.05
+ROWS = int(round(180 / CELL_DEGREES))
+COLUMNS = int(round(360 / CELL_DEGREES))
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Above this many rows of cells one latitude-band range beats a long OR.
+MAX_RANGES = 64
+
+
+def _row(latitude):
+    return min(max(int((latitude + 90) // CELL_DEGREES), 0), ROWS - 1)
+
+
+def _column(longitude):
+    return int((longitude + 180) // CELL_DEGREES) % COLUMNS
+
+
+def cell_for(latitude, longitude):
+    """Cell number for a coordinate, or None if either part is missing."""
+    if latitude is None or longitude is None:
+        return None
+    return _row(latitude) * COLUMNS + _column(longitude)
+
+
+def cell_ranges(south, west, north, east):
+    """(first, last) cell number runs covering a bounding box.
+
+    A box with west > east crosses the antimeridian and is split in two.
+    """
+    rows = range(_row(south), _row(north) + 1)
+    if len(rows) > MAX_RANGES:
+        return [(rows[0] * COLUMNS, rows[-1] * COLUMNS + COLUMNS - 1)]
+    if west <= east:
+        spans = [(_column(west), _column(east))]
+    else:
+        spans = [(_column(west), COLUMNS - 1), (0, _column(east))]
+    if any(first > last for first, last in spans):
+        # east sits on +180 and wrapped to column 0; take the whole row.
+        spans = [(0, COLUMNS - 1)]
+    return [(row * COLUMNS + first, row * COLUMNS + last) for row in rows for first, last in spans]
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _exact_box(south, west, north, east):
+    conditions = [User.latitude.between(south, north)]
+    if west <= east:
+        conditions.append(User.longitude.between(west, east))
+    else:
+        conditions.append(or_(User.longitude >= west, User.longitude <= east))
+    return conditions
+
+
+def within_box(south, west, north, east, limit=None):
+    """Users located inside the box, as (id, username, latitude, longitude) rows.
+
+    Each run of cells is its own range scan, glued together with UNION ALL, so
+    rows come back in cell order. A single statement OR-ing the runs, or one
+    with an ORDER BY, tempts SQLite into walking the whole index instead.
+    """
+    exact = _exact_box(south, west, north, east)
+    parts = [select(User.id, User.username, User.latitude, User.longitude)
+             .where(User.location_cell.between(first, last), *exact)
+             for first, last in cell_ranges(south, west, north, east)]
+    query = parts[0] if len(parts) == 1 else union_all(*parts)
+    if limit is not None:
+        query = query.limit(limit)
+    return db.session.execute(query).all()
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(south, west, north, east) enclosing every point within radius_km."""
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    # Longitude degrees shrink towards the poles; use the widest latitude in the box.
+    widest = math.cos(math.radians(max(abs(south), abs(north))))
+    if widest <= 0 or radius_km / (KM_PER_DEGREE * widest) >= 180:
+        return south, -180.0, north, 180.0
+    dlon = radius_km / (KM_PER_DEGREE * widest)
+    west, east = longitude - dlon, longitude + dlon
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+
+def nearby(latitude, longitude, radius_km, limit=50):
+    """The closest users within radius_km, nearest first, with their distance."""
+    candidates = within_box(*bounding_box(latitude, longitude, radius_km))
+    found = []
+    for user_id, username, lat, lon in candidates:
+        distance = distance_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            found.append((distance, user_id, username, lat, lon))
+    found.sort()
+    return [{'id': user_id, 'username': username, 'latitude': lat, 'longitude': lon,
+             'distance_km': round(distance, 3)}
+            for distance, user_id, username, lat, lon in found[:limit]]
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _sync_cell(mapper, connection, target):
+    target.location_cell = cell_for(target.latitude, target.longitude)
+
+
+def reindex(batch_size=5000):
+    """Add the cell column and index if missing, then recompute every user's cell."""
+    inspector = inspect(db.engine)
+    if 'location_cell' not in {column['name'] for column in inspector.get_columns('user')}:
+        db.session.execute(text('ALTER TABLE "user" ADD COLUMN location_cell INTEGER'))
+    db.session.execute(text('CREATE INDEX IF NOT EXISTS ix_user_location_cell '
+                            'ON "user" (location_cell, latitude, longitude)'))
+    db.session.commit()
+
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(User.id, User.latitude, User.longitude)
+            .where(User.id > last_id).order_by(User.id).limit(batch_size)).all()
+        if not rows:
+            break
+        db.session.execute(text('UPDATE "user" SET location_cell = :cell WHERE id = :id'),
+                           [{'id': row.id, 'cell': cell_for(row.latitude, row.longitude)} for row in rows])
+        db.session.commit()
+        last_id = rows[-1].id
+        updated += len(rows)
+    return updated
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['reindex']:
+        sys.exit('usage: python spatial.py reindex')
+    from app import app
+    with app.app_context():
+        print(f"Indexed locations of {reindex()} users")
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event, select
+
+from models import db, User
+
+
+class UserSnapshot(UserMixin):
+    """Detached, read-only view of a User row for current_user.
+
+    It carries no password hash and no relationships; views that need to
+    change the user must load or update the User row explicitly.
+    """
+
+    FIELDS = ('id', 'username', 'first_name', 'surname', 'email',
+              'phone_number', 'address', 'latitude', 'longitude')
+
+    __slots__ = FIELDS
+
+    def __init__(self, row):
+        for name, value in zip(self.FIELDS, row):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UserSnapshot is read-only; update the User row instead')
+
+    def __repr__(self):
+        return f"UserSnapshot('{self.id}', '{self.username}')"
+
+
+class UserCache:
+    """Per-process LRU of UserSnapshots with a time-to-live."""
+
+    def __init__(self, app=None):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.maxsize = 4096
+        self.ttl = 300
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('USER_CACHE_SIZE', self.maxsize)
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+        app.extensions['user_cache'] = self
+        # Any ORM write to a User (password change, profile edit) drops its entry.
+        event.listen(User, 'after_update', self._after_update)
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.counters['hits'] += 1
+                return entry[0]
+            self.counters['misses'] += 1
+        row = db.session.execute(
+            select(*[getattr(User, name) for name in UserSnapshot.FIELDS]).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(row)
+        with self._lock:
+            self._entries[user_id] = (snapshot, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+        return snapshot
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['size'] = len(self._entries)
+        return stats
+
+    def _after_update(self, mapper, connection, target):
+        self.invalidate(target.id)
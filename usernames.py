@@ -0,0 +1,60 @@
+import re
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, UsernameCounter
+
+
+def base_username(first_name, surname):
+    """Build the base username (first name + surname initial) for a respondent."""
+    return f"{first_name.lower()}{surname[0].lower()}"
+
+
+def allocate_username(base):
+    """Reserve the next free username for base in the current transaction.
+
+    The first respondent gets the bare base and later ones get base1, base2, ...
+    A counter row per base makes this a fixed number of queries however many
+    respondents share the name. The counter row stays write-locked until the
+    caller commits, so concurrent registrations queue on it instead of picking
+    the same suffix.
+    """
+    bump = (update(UsernameCounter)
+            .where(UsernameCounter.base == base)
+            .values(allocated=UsernameCounter.allocated + 1))
+    if db.session.execute(bump).rowcount == 0:
+        if not _seed_counter(base):
+            # Another registration seeded the counter first; take the next slot.
+            db.session.execute(bump)
+    allocated = db.session.execute(
+        select(UsernameCounter.allocated).where(UsernameCounter.base == base)
+    ).scalar_one()
+    return base if allocated == 1 else f"{base}{allocated - 1}"
+
+
+def _seed_counter(base):
+    """Create the counter for base, continuing after any usernames already taken."""
+    taken = _taken_suffixes(base)
+    counter = UsernameCounter(base=base, allocated=max(taken) + 2 if taken else 1)
+    try:
+        with db.session.begin_nested():
+            db.session.add(counter)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _taken_suffixes(base):
+    # Range scan over the unique username index: base itself, then base followed
+    # by anything sorting below ':' -- which covers every base<digits> name.
+    usernames = db.session.execute(
+        select(User.username).where(User.username >= base, User.username < base + ':')
+    ).scalars()
+    pattern = re.compile(re.escape(base) + r'(\d*)')
+    suffixes = []
+    for username in usernames:
+        match = pattern.fullmatch(username)
+        if match:
+            suffixes.append(int(match.group(1) or 0))
+    return suffixes
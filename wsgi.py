@@ -8,6 +8,9 @@ if path not in sys.path:
 
 
 os.environ['FLASK_APP'] = 'app'
+# The host's proxy sits in front of the app; trust its X-Forwarded-For so
+# per-IP rate limits see the client's address rather than the proxy's.
+os.environ.setdefault('TRUSTED_PROXIES', '1')
 
 
 from app import app as application